@@ -5,36 +5,385 @@ Sistema completo de autenticación con JWT, roles y encriptación
 
 import jwt
 import hashlib
+import hmac
 import secrets
 import sqlite3
+import threading
+import time
+import queue
+import atexit
+import math
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, deque
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from functools import wraps
 from flask import request, jsonify
 import os
 from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 import base64
 
+# PBKDF2 nativo (FastPBKDF2 / SHA-NI) si está instalado; mismo resultado que hashlib
+try:
+    from fastpbkdf2 import pbkdf2_hmac
+except ImportError:
+    from hashlib import pbkdf2_hmac
+
+# Argon2id (argon2-cffi) para hashes nuevos si está instalado
+try:
+    import argon2
+except ImportError:
+    argon2 = None
+
 # Configuración de seguridad
 SECRET_KEY = os.getenv('JWT_SECRET_KEY', secrets.token_urlsafe(32))
 JWT_ALGORITHM = 'HS256'
 JWT_EXPIRATION_HOURS = 24
 REFRESH_TOKEN_DAYS = 30
+JWT_CACHE_SIZE = 4096
+
+# Tamaño del pool de conexiones de lectura a SQLite
+AUTH_SQLITE_POOL = int(os.getenv('AUTH_SQLITE_POOL', '8'))
+
+# Escritura diferida de security_logs
+SECURITY_LOG_FLUSH_INTERVAL = 0.2  # segundos
+SECURITY_LOG_FLUSH_SIZE = 50
+SECURITY_LOG_MAX_BATCH = 150  # 6 parámetros por fila, bajo el límite de 999 de SQLite
+SECURITY_LOG_SYNC_ACTIONS = {'login_blocked'}
+
+# SQL de las rutas calientes: mismo texto en cada llamada para que
+# el caché de sentencias de sqlite3 reutilice la sentencia preparada
+SQLITE_CACHED_STATEMENTS = 256
+
+# Argon2id: coste de tiempo calibrado al arrancar hacia este presupuesto
+ARGON2_TARGET_MS = float(os.getenv('ARGON2_TARGET_MS', '50'))
+ARGON2_MEMORY_COST = 65536  # KiB
+ARGON2_MIN_TIME_COST = 2  # línea base; la calibración solo puede subirla
+ARGON2_MAX_TIME_COST = 10
+ARGON2_CALIBRATION_RUNS = 3  # se toma el mejor tiempo para ignorar muestras ruidosas
+ARGON2_PREFIX = '$argon2'
+
+SQL_INSERT_USER = """
+    INSERT INTO users (username, email, password_hash, salt, role, company)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+# Dos búsquedas puntuales por índice en vez de un OR sobre dos columnas
+SQL_SELECT_LOGIN_USER = """
+    SELECT * FROM users WHERE username = ? AND is_active = 1
+    UNION ALL
+    SELECT * FROM users WHERE email = ? AND is_active = 1
+    LIMIT 1
+"""
+SQL_INCREMENT_FAILED_ATTEMPTS = """
+    UPDATE users 
+    SET failed_login_attempts = failed_login_attempts + 1
+    WHERE id = ?
+"""
+SQL_RESET_FAILED_ATTEMPTS = """
+    UPDATE users 
+    SET failed_login_attempts = 0, last_login = CURRENT_TIMESTAMP
+    WHERE id = ?
+"""
+SQL_INSERT_SESSION = """
+    INSERT INTO active_sessions (user_id, session_token, ip_address, user_agent, expires_at)
+    VALUES (?, ?, ?, ?, ?)
+"""
+SQL_UPDATE_PASSWORD_HASH = """
+    UPDATE users 
+    SET password_hash = ?, salt = ?, updated_at = CURRENT_TIMESTAMP
+    WHERE id = ?
+"""
+SQL_INSERT_REFRESH_TOKEN = """
+    INSERT INTO refresh_tokens (user_id, token, expires_at)
+    VALUES (?, ?, ?)
+"""
 
 # Clave de encriptación para datos sensibles
 ENCRYPTION_KEY = os.getenv('ENCRYPTION_KEY', Fernet.generate_key())
 cipher_suite = Fernet(ENCRYPTION_KEY)
 
+# Clave AES-256-GCM para contenido de archivos, derivada una sola vez
+FILE_NONCE_SIZE = 12
+_file_key = HKDF(
+    algorithm=hashes.SHA256(),
+    length=32,
+    salt=None,
+    info=b'integra-mind client_files',
+).derive(base64.urlsafe_b64decode(ENCRYPTION_KEY))
+file_cipher = AESGCM(_file_key)
+
+# Caché LRU de tokens ya verificados: digest -> (exp, payload)
+_token_cache = OrderedDict()
+_token_cache_lock = threading.Lock()
+
+
+def _token_cache_key(token):
+    """Clave corta para no guardar tokens en claro como claves"""
+    return hashlib.blake2b(token.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def _token_cache_get(key):
+    """Devuelve el payload cacheado si el token aún no expiró"""
+    with _token_cache_lock:
+        entry = _token_cache.get(key)
+        if entry is None:
+            return None
+        exp, payload = entry
+        if exp <= time.time():
+            del _token_cache[key]
+            return None
+        _token_cache.move_to_end(key)
+        return dict(payload)
+
+
+def _token_cache_put(key, payload):
+    """Guarda un payload verificado, desalojando el menos usado si está lleno"""
+    exp = payload.get('exp')
+    if exp is None:
+        return
+    with _token_cache_lock:
+        _token_cache[key] = (exp, payload)
+        _token_cache.move_to_end(key)
+        while len(_token_cache) > JWT_CACHE_SIZE:
+            _token_cache.popitem(last=False)
+
+
+def _token_cache_discard(key):
+    with _token_cache_lock:
+        _token_cache.pop(key, None)
+
+
+# Pool para derivar bloques PBKDF2 en paralelo (pbkdf2_hmac libera el GIL)
+_kdf_executor = None
+_kdf_executor_lock = threading.Lock()
+
+
+def _get_kdf_executor():
+    global _kdf_executor
+    with _kdf_executor_lock:
+        if _kdf_executor is None:
+            _kdf_executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix='pbkdf2')
+        return _kdf_executor
+
+
+def derive_key(password, salt, key_len=32, iterations=100000):
+    """
+    Deriva una clave de key_len bytes con PBKDF2-SHA256.
+    
+    Hasta 32 bytes equivale a pbkdf2_hmac(..., dklen=key_len). Para claves
+    más largas cada bloque de 32 bytes es un PBKDF2 independiente sobre
+    salt || INT(i), calculado en paralelo; el resultado no coincide byte a
+    byte con una sola llamada de PBKDF2 con dklen > 32.
+    """
+    if isinstance(password, str):
+        password = password.encode('utf-8')
+    if isinstance(salt, str):
+        salt = salt.encode('utf-8')
+    
+    if key_len <= 32:
+        return pbkdf2_hmac('sha256', password, salt, iterations, key_len)
+    
+    def block(i):
+        return pbkdf2_hmac('sha256', password, salt + struct.pack('>I', i), iterations, 32)
+    
+    n_blocks = math.ceil(key_len / 32)
+    blocks = _get_kdf_executor().map(block, range(1, n_blocks + 1))
+    return b''.join(blocks)[:key_len]
+
+
+_password_hasher = None
+_password_hasher_lock = threading.Lock()
+
+
+def _calibrate_argon2_time_cost():
+    """Mayor time_cost cuyo hash cabe en ARGON2_TARGET_MS (mínimo ARGON2_MIN_TIME_COST)"""
+    if os.getenv('ARGON2_TIME_COST'):
+        return int(os.getenv('ARGON2_TIME_COST'))
+    time_cost = ARGON2_MIN_TIME_COST
+    for candidate in range(ARGON2_MIN_TIME_COST + 1, ARGON2_MAX_TIME_COST + 1):
+        hasher = argon2.PasswordHasher(time_cost=candidate, memory_cost=ARGON2_MEMORY_COST, parallelism=1)
+        best = float('inf')
+        for _ in range(ARGON2_CALIBRATION_RUNS):
+            start = time.perf_counter()
+            hasher.hash('calibration')
+            best = min(best, time.perf_counter() - start)
+        if best * 1000 > ARGON2_TARGET_MS:
+            break
+        time_cost = candidate
+    return time_cost
+
+
+def _get_password_hasher():
+    """PasswordHasher de Argon2id, o None si argon2-cffi no está instalado"""
+    global _password_hasher
+    if argon2 is None:
+        return None
+    with _password_hasher_lock:
+        if _password_hasher is None:
+            _password_hasher = argon2.PasswordHasher(
+                time_cost=_calibrate_argon2_time_cost(),
+                memory_cost=ARGON2_MEMORY_COST,
+                parallelism=1
+            )
+        return _password_hasher
+
+
+class _ConnectionPool:
+    """Pool de conexiones SQLite en modo WAL: 1 escritora + N lectoras"""
+    
+    def __init__(self, db_path, size=AUTH_SQLITE_POOL):
+        self.db_path = db_path
+        self._readers = queue.Queue()
+        for _ in range(max(1, size)):
+            self._readers.put(self._connect())
+        # SQLite admite un único escritor: una conexión dedicada protegida por lock
+        self._writer = self._connect()
+        self._writer_lock = threading.RLock()
+    
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.db_path,
+            check_same_thread=False,
+            isolation_level=None,
+            cached_statements=SQLITE_CACHED_STATEMENTS
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=30000")
+        return conn
+    
+    @contextmanager
+    def get(self, write=False):
+        """Presta una conexión del pool (la escritora si write=True)"""
+        if write:
+            with self._writer_lock:
+                yield self._writer
+            return
+        
+        conn = self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put(conn)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _get_pool(db_path):
+    """Un pool compartido por archivo de base de datos"""
+    with _pools_lock:
+        pool = _pools.get(db_path)
+        if pool is None:
+            pool = _pools[db_path] = _ConnectionPool(db_path)
+        return pool
+
+
+class _SecurityLogBuffer:
+    """Acumula eventos de seguridad y los inserta en lotes multi-fila"""
+    
+    _COLUMNS = "(user_id, action, ip_address, user_agent, success, details)"
+    
+    def __init__(self, pool):
+        self.pool = pool
+        self._events = deque()
+        self._wake = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._sql_cache = {}
+        atexit.register(self.flush)
+    
+    def append(self, row):
+        """Encola un evento (deque.append es atómico)"""
+        self._events.append(row)
+        if self._thread is None:
+            self._start()
+        if len(self._events) >= SECURITY_LOG_FLUSH_SIZE:
+            self._wake.set()
+    
+    def _start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='security-log-writer', daemon=True)
+                self._thread.start()
+    
+    def _run(self):
+        while True:
+            self._wake.wait(SECURITY_LOG_FLUSH_INTERVAL)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error logging security event: {e}")
+    
+    def _insert_sql(self, n):
+        """INSERT multi-fila, construido una vez por tamaño de lote"""
+        sql = self._sql_cache.get(n)
+        if sql is None:
+            values = ", ".join(["(?, ?, ?, ?, ?, ?)"] * n)
+            sql = self._sql_cache[n] = f"INSERT INTO security_logs {self._COLUMNS} VALUES {values}"
+        return sql
+    
+    def write(self, rows):
+        """Inserta filas de inmediato en una sola transacción"""
+        with self.pool.get(write=True) as conn:
+            conn.execute("BEGIN")
+            try:
+                for i in range(0, len(rows), SECURITY_LOG_MAX_BATCH):
+                    batch = rows[i:i + SECURITY_LOG_MAX_BATCH]
+                    conn.execute(self._insert_sql(len(batch)), [v for row in batch for v in row])
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+    
+    def flush(self):
+        """Vacía el buffer en la base de datos"""
+        rows = []
+        while self._events:
+            try:
+                rows.append(self._events.popleft())
+            except IndexError:
+                break
+        if rows:
+            self.write(rows)
+
+
+_log_buffers = {}
+
+
+def _get_log_buffer(pool):
+    """Un buffer de logs compartido por pool"""
+    with _pools_lock:
+        buffer = _log_buffers.get(pool.db_path)
+        if buffer is None:
+            buffer = _log_buffers[pool.db_path] = _SecurityLogBuffer(pool)
+        return buffer
+
+
 class AuthSystem:
     """Sistema de autenticación y autorización"""
     
     def __init__(self, db_path='users.sqlite'):
         self.db_path = db_path
+        self.pool = _get_pool(db_path)
+        self.security_logs = _get_log_buffer(self.pool)
         self.init_database()
     
     def init_database(self):
         """Inicializa las tablas de seguridad"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self.pool.get(write=True) as conn:
+            self._create_tables(conn.cursor())
+        
+        print("✅ Base de datos de seguridad inicializada")
+    
+    def _create_tables(self, cursor):
+        """Crea las tablas si no existen"""
         
         # Tabla de usuarios con campos de seguridad
         cursor.execute("""
@@ -131,30 +480,55 @@ class AuthSystem:
             )
         """)
         
-        conn.commit()
-        conn.close()
-        
-        print("✅ Base de datos de seguridad inicializada")
+        # Índices de consulta (username, email y los tokens ya tienen
+        # índice implícito por sus restricciones UNIQUE)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_security_logs_user_created
+            ON security_logs(user_id, created_at DESC)
+        """)
     
     def hash_password(self, password, salt=None):
-        """Hashea una contraseña con salt"""
+        """
+        Hashea una contraseña con salt.
+        
+        Sin salt y con argon2-cffi instalado genera un hash Argon2id (la sal va
+        dentro del hash y se devuelve salt=''); si no, PBKDF2-SHA256 en hex.
+        """
         if salt is None:
+            hasher = _get_password_hasher()
+            if hasher is not None:
+                return hasher.hash(password), ''
             salt = secrets.token_hex(32)
         
+        return self._pbkdf2(password, salt).hex(), salt
+    
+    @staticmethod
+    def _pbkdf2(password, salt):
+        """Deriva el hash crudo (bytes) de una contraseña"""
         # Usar PBKDF2 con SHA256 (más seguro que SHA256 simple)
-        pwd_hash = hashlib.pbkdf2_hmac(
+        return pbkdf2_hmac(
             'sha256',
             password.encode('utf-8'),
             salt.encode('utf-8'),
             100000  # 100,000 iteraciones
         )
-        
-        return pwd_hash.hex(), salt
     
     def verify_password(self, password, password_hash, salt):
-        """Verifica una contraseña"""
-        new_hash, _ = self.hash_password(password, salt)
-        return new_hash == password_hash
+        """Verifica una contraseña en tiempo constante"""
+        if password_hash.startswith(ARGON2_PREFIX):
+            hasher = _get_password_hasher()
+            if hasher is None:
+                return False
+            try:
+                return hasher.verify(password_hash, password)
+            except (argon2.exceptions.VerificationError, argon2.exceptions.InvalidHashError):
+                return False
+        
+        try:
+            expected = bytes.fromhex(password_hash)
+        except (TypeError, ValueError):
+            return False
+        return hmac.compare_digest(self._pbkdf2(password, salt), expected)
     
     def create_user(self, username, email, password, role='viewer', company=None):
         """Crea un nuevo usuario"""
@@ -166,17 +540,10 @@ class AuthSystem:
             # Hashear contraseña
             pwd_hash, salt = self.hash_password(password)
             
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                INSERT INTO users (username, email, password_hash, salt, role, company)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (username, email, pwd_hash, salt, role, company))
-            
-            user_id = cursor.lastrowid
-            conn.commit()
-            conn.close()
+            with self.pool.get(write=True) as conn:
+                cursor = conn.cursor()
+                cursor.execute(SQL_INSERT_USER, (username, email, pwd_hash, salt, role, company))
+                user_id = cursor.lastrowid
             
             # Log de seguridad
             self.log_security_event(user_id, 'user_created', success=True)
@@ -190,50 +557,40 @@ class AuthSystem:
     
     def authenticate_user(self, username, password, ip_address=None, user_agent=None):
         """Autentica un usuario y genera tokens JWT"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
         # Buscar usuario
-        cursor.execute("""
-            SELECT * FROM users 
-            WHERE (username = ? OR email = ?) AND is_active = 1
-        """, (username, username))
-        
-        user = cursor.fetchone()
+        with self.pool.get() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
+            cursor.execute(SQL_SELECT_LOGIN_USER, (username, username))
+            user = cursor.fetchone()
         
         if not user:
             self.log_security_event(None, 'login_failed', ip_address, user_agent, False, 'User not found')
-            conn.close()
             return {'success': False, 'error': 'Credenciales inválidas'}
         
         # Verificar intentos fallidos (bloqueo temporal)
         if user['failed_login_attempts'] >= 5:
             self.log_security_event(user['id'], 'login_blocked', ip_address, user_agent, False, 'Too many attempts')
-            conn.close()
             return {'success': False, 'error': 'Cuenta bloqueada temporalmente. Contacte al administrador.'}
         
-        # Verificar contraseña
+        # Verificar contraseña (fuera del lock de escritura)
         if not self.verify_password(password, user['password_hash'], user['salt']):
             # Incrementar intentos fallidos
-            cursor.execute("""
-                UPDATE users 
-                SET failed_login_attempts = failed_login_attempts + 1
-                WHERE id = ?
-            """, (user['id'],))
-            conn.commit()
+            with self.pool.get(write=True) as conn:
+                conn.execute(SQL_INCREMENT_FAILED_ATTEMPTS, (user['id'],))
             
             self.log_security_event(user['id'], 'login_failed', ip_address, user_agent, False, 'Invalid password')
-            conn.close()
             return {'success': False, 'error': 'Credenciales inválidas'}
         
         # Login exitoso - resetear intentos fallidos
-        cursor.execute("""
-            UPDATE users 
-            SET failed_login_attempts = 0, last_login = CURRENT_TIMESTAMP
-            WHERE id = ?
-        """, (user['id'],))
-        conn.commit()
+        with self.pool.get(write=True) as conn:
+            conn.execute(SQL_RESET_FAILED_ATTEMPTS, (user['id'],))
+        
+        # Migración transparente de hashes PBKDF2 antiguos a Argon2id
+        if not user['password_hash'].startswith(ARGON2_PREFIX) and _get_password_hasher() is not None:
+            new_hash, new_salt = self.hash_password(password)
+            with self.pool.get(write=True) as conn:
+                conn.execute(SQL_UPDATE_PASSWORD_HASH, (new_hash, new_salt, user['id']))
         
         # Generar tokens
         access_token = self.generate_access_token(user)
@@ -243,13 +600,8 @@ class AuthSystem:
         session_token = secrets.token_urlsafe(32)
         expires_at = datetime.now() + timedelta(hours=JWT_EXPIRATION_HOURS)
         
-        cursor.execute("""
-            INSERT INTO active_sessions (user_id, session_token, ip_address, user_agent, expires_at)
-            VALUES (?, ?, ?, ?, ?)
-        """, (user['id'], session_token, ip_address, user_agent, expires_at))
-        
-        conn.commit()
-        conn.close()
+        with self.pool.get(write=True) as conn:
+            conn.execute(SQL_INSERT_SESSION, (user['id'], session_token, ip_address, user_agent, expires_at))
         
         self.log_security_event(user['id'], 'login_success', ip_address, user_agent, True)
         
@@ -285,42 +637,37 @@ class AuthSystem:
         token = secrets.token_urlsafe(32)
         expires_at = datetime.now() + timedelta(days=REFRESH_TOKEN_DAYS)
         
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            INSERT INTO refresh_tokens (user_id, token, expires_at)
-            VALUES (?, ?, ?)
-        """, (user_id, token, expires_at))
-        
-        conn.commit()
-        conn.close()
+        with self.pool.get(write=True) as conn:
+            conn.execute(SQL_INSERT_REFRESH_TOKEN, (user_id, token, expires_at))
         
         return token
     
-    def verify_token(self, token):
-        """Verifica un token JWT"""
+    @staticmethod
+    def verify_token(token):
+        """Verifica un token JWT (no usa la base de datos)"""
+        key = _token_cache_key(token)
+        payload = _token_cache_get(key)
+        if payload is not None:
+            return {'valid': True, 'payload': payload}
+        
         try:
             payload = jwt.decode(token, SECRET_KEY, algorithms=[JWT_ALGORITHM])
+            _token_cache_put(key, payload)
             return {'valid': True, 'payload': payload}
         except jwt.ExpiredSignatureError:
+            _token_cache_discard(key)
             return {'valid': False, 'error': 'Token expirado'}
         except jwt.InvalidTokenError:
             return {'valid': False, 'error': 'Token inválido'}
     
     def log_security_event(self, user_id, action, ip_address=None, user_agent=None, success=True, details=None):
-        """Registra un evento de seguridad"""
+        """Registra un evento de seguridad (en diferido, salvo acciones críticas)"""
+        row = (user_id, action, ip_address, user_agent, 1 if success else 0, details)
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                INSERT INTO security_logs (user_id, action, ip_address, user_agent, success, details)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (user_id, action, ip_address, user_agent, 1 if success else 0, details))
-            
-            conn.commit()
-            conn.close()
+            if action in SECURITY_LOG_SYNC_ACTIONS:
+                self.security_logs.write([row])
+            else:
+                self.security_logs.append(row)
         except Exception as e:
             print(f"Error logging security event: {e}")
     
@@ -328,13 +675,35 @@ class AuthSystem:
         """Encripta datos sensibles"""
         if isinstance(data, str):
             data = data.encode('utf-8')
-        return cipher_suite.encrypt(data).decode('utf-8')
+        return self.encrypt_bytes(data).decode('utf-8')
     
     def decrypt_data(self, encrypted_data):
         """Desencripta datos"""
         if isinstance(encrypted_data, str):
             encrypted_data = encrypted_data.encode('utf-8')
-        return cipher_suite.decrypt(encrypted_data).decode('utf-8')
+        return self.decrypt_bytes(encrypted_data).decode('utf-8')
+    
+    @staticmethod
+    def encrypt_bytes(data):
+        """Encripta bytes con Fernet sin conversiones a str"""
+        return cipher_suite.encrypt(data)
+    
+    @staticmethod
+    def decrypt_bytes(token):
+        """Desencripta un token Fernet y devuelve bytes"""
+        return cipher_suite.decrypt(token)
+    
+    @staticmethod
+    def encrypt_file_content(data):
+        """Encripta el contenido de un archivo con AES-GCM (nonce || cifrado+tag)"""
+        nonce = os.urandom(FILE_NONCE_SIZE)
+        return nonce + file_cipher.encrypt(nonce, data, None)
+    
+    @staticmethod
+    def decrypt_file_content(blob):
+        """Desencripta contenido producido por encrypt_file_content"""
+        nonce, ciphertext = blob[:FILE_NONCE_SIZE], blob[FILE_NONCE_SIZE:]
+        return file_cipher.decrypt(nonce, ciphertext, None)
 
 
 # Decorador para proteger rutas
@@ -351,9 +720,8 @@ def require_auth(roles=None):
             
             token = auth_header.split(' ')[1]
             
-            # Verificar token
-            auth_system = AuthSystem()
-            result = auth_system.verify_token(token)
+            # Verificar token (sin crear una instancia ni abrir SQLite)
+            result = AuthSystem.verify_token(token)
             
             if not result['valid']:
                 return jsonify({'error': result['error']}), 401
@@ -6,12 +6,61 @@ import os
 import json
 import hashlib
 import shutil
+import sqlite3
+import threading
+import atexit
+import tempfile
+import time
 from typing import Dict, List, Optional, Tuple
 from datetime import datetime
 import logging
 
+try:
+    import orjson  # type: ignore
+except ImportError:  # pragma: no cover
+    orjson = None
+
 logger = logging.getLogger(__name__)
 
+# Debounce before mirroring metadata changes to the JSON backup
+BACKUP_DEBOUNCE_SECONDS = 0.5
+
+# How long get_statistics may serve a cached result
+STATS_CACHE_SECONDS = 5.0
+
+# Read size for the pre-3.11 hashing fallback
+HASH_BUFFER_SIZE = 1 << 20
+
+# Bytes sampled from each end of a file for the quick dedup fingerprint
+FINGERPRINT_SAMPLE_SIZE = 64 * 1024
+
+# Chunk size for copy_file_range and the buffered copy fallback
+COPY_CHUNK_SIZE = 1 << 20
+
+
+def _copy_file(src: str, dst: str):
+    """
+    Copy a file inside the kernel when possible, then copy its metadata.
+    
+    Uses os.copy_file_range (Linux 4.5+, reflinks on CoW filesystems) and
+    falls back to a 1 MiB buffered copy on unsupported platforms.
+    """
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        copied = False
+        if hasattr(os, 'copy_file_range'):
+            try:
+                while os.copy_file_range(fsrc.fileno(), fdst.fileno(), COPY_CHUNK_SIZE):
+                    pass
+                copied = True
+            except OSError:
+                # e.g. EXDEV/ENOSYS/EINVAL: restart with the portable path
+                fsrc.seek(0)
+                fdst.seek(0)
+                fdst.truncate()
+        if not copied:
+            shutil.copyfileobj(fsrc, fdst, COPY_CHUNK_SIZE)
+    shutil.copystat(src, dst)
+
 
 class AssetManager:
     """Manages generated and uploaded media assets for the Universal Platform."""
@@ -24,21 +73,57 @@ class AssetManager:
         'audio': ['.mp3', '.wav', '.ogg']
     }
     
-    def __init__(self, storage_dir: str = 'assets'):
+    TYPE_SUBDIRS = {
+        'image': 'images',
+        'video': 'videos',
+        '360_video': '360_videos',
+        '3d_model': '3d_models',
+        'audio': 'audio'
+    }
+    
+    def __init__(
+        self,
+        storage_dir: str = 'assets',
+        trust_fingerprint: bool = False,
+        fuse_hash_and_copy: bool = True
+    ):
         """
         Initialize Asset Manager.
         
         Args:
             storage_dir: Base directory for asset storage
+            trust_fingerprint: Treat a quick fingerprint match as a duplicate
+                without confirming it with a full SHA256
+            fuse_hash_and_copy: Hash and copy likely-new files in a single read
         """
         self.storage_dir = storage_dir
+        self.trust_fingerprint = trust_fingerprint
+        self.fuse_hash_and_copy = fuse_hash_and_copy
+        
+        # Reverse lookup for type detection; first listed type wins (.mp4 -> video)
+        self._ext_to_type: Dict[str, str] = {}
+        for asset_type, extensions in self.SUPPORTED_TYPES.items():
+            for ext in extensions:
+                self._ext_to_type.setdefault(ext, asset_type)
+        self.db_path = os.path.join(storage_dir, 'assets_metadata.db')
+        # Legacy metadata store, now only used for import and backup export
         self.metadata_file = os.path.join(storage_dir, 'assets_metadata.json')
         
         # Create storage structure
         self._init_storage()
         
-        # Load metadata
-        self.metadata = self._load_metadata()
+        # Open metadata database
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._init_db()
+        self._import_legacy_metadata()
+        
+        # JSON backup mirror, rewritten only when dirty and debounced
+        self._dirty = False
+        self._save_timer: Optional[threading.Timer] = None
+        self._stats_cache: Optional[Tuple[float, Dict]] = None
+        atexit.register(self.flush_metadata)
     
     def _init_storage(self):
         """Create storage directory structure."""
@@ -48,45 +133,207 @@ class AssetManager:
             path = os.path.join(self.storage_dir, subdir)
             os.makedirs(path, exist_ok=True)
     
-    def _load_metadata(self) -> Dict:
-        """Load asset metadata from JSON file."""
-        if os.path.exists(self.metadata_file):
+    def _init_db(self):
+        """Create metadata tables and indexes."""
+        with self._lock, self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS assets (
+                    id TEXT PRIMARY KEY,
+                    type TEXT,
+                    filename TEXT,
+                    path TEXT,
+                    url TEXT,
+                    domain TEXT,
+                    experience_id TEXT,
+                    size INTEGER,
+                    created_at TEXT,
+                    custom_metadata TEXT,
+                    fingerprint TEXT
+                )
+            """)
+            columns = {r['name'] for r in self._conn.execute("PRAGMA table_info(assets)")}
+            if 'fingerprint' not in columns:
+                self._conn.execute("ALTER TABLE assets ADD COLUMN fingerprint TEXT")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS bundles (
+                    id TEXT PRIMARY KEY,
+                    name TEXT,
+                    assets TEXT,
+                    created_at TEXT
+                )
+            """)
+            # Generation prompt (SHA-256) -> asset, so repeated prompts skip the backend
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS prompt_cache (
+                    prompt_hash TEXT PRIMARY KEY,
+                    asset_id TEXT,
+                    created_at TEXT
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_assets_type ON assets(type)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_assets_domain ON assets(domain)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_assets_experience ON assets(experience_id)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_assets_created ON assets(created_at DESC)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_assets_fingerprint ON assets(fingerprint)")
+    
+    def _import_legacy_metadata(self):
+        """Import assets_metadata.json into the database on first run."""
+        if not os.path.exists(self.metadata_file):
+            return
+        with self._lock:
+            if self._conn.execute("SELECT 1 FROM assets LIMIT 1").fetchone():
+                return
             try:
                 with open(self.metadata_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                    legacy = json.load(f)
             except Exception as e:
                 logger.error(f"Error loading metadata: {e}")
-                return {'assets': {}, 'version': '1.0'}
-        return {'assets': {}, 'version': '1.0'}
+                return
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO assets VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [self._asset_to_row(a) for a in legacy.get('assets', {}).values()]
+                )
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO bundles VALUES (?, ?, ?, ?)",
+                    [self._bundle_to_row(b) for b in legacy.get('bundles', {}).values()]
+                )
+        logger.info(f"Imported legacy metadata from {self.metadata_file}")
+    
+    @staticmethod
+    def _asset_to_row(asset: Dict) -> Tuple:
+        return (
+            asset['id'], asset.get('type'), asset.get('filename'), asset.get('path'),
+            asset.get('url'), asset.get('domain'), asset.get('experience_id'),
+            asset.get('size'), asset.get('created_at'),
+            json.dumps(asset.get('custom_metadata') or {}, ensure_ascii=False),
+            asset.get('fingerprint')
+        )
     
-    def _save_metadata(self):
-        """Save asset metadata to JSON file."""
+    @staticmethod
+    def _row_to_asset(row: sqlite3.Row) -> Dict:
+        asset = dict(row)
+        asset['custom_metadata'] = json.loads(asset['custom_metadata'] or '{}')
+        return asset
+    
+    @staticmethod
+    def _bundle_to_row(bundle: Dict) -> Tuple:
+        return (bundle['id'], bundle.get('name'), json.dumps(bundle.get('assets', [])), bundle.get('created_at'))
+    
+    @staticmethod
+    def _row_to_bundle(row: sqlite3.Row) -> Dict:
+        bundle = dict(row)
+        bundle['assets'] = json.loads(bundle['assets'] or '[]')
+        return bundle
+    
+    def _save_metadata(self, path: str):
+        """Write a JSON snapshot of all metadata in the legacy file format."""
+        with self._lock:
+            assets = {r['id']: self._row_to_asset(r) for r in self._conn.execute("SELECT * FROM assets")}
+            bundles = {r['id']: self._row_to_bundle(r) for r in self._conn.execute("SELECT * FROM bundles")}
+        snapshot = {'assets': assets, 'bundles': bundles, 'version': '1.0'}
+        
+        # Write to a temp file and rename so readers never see a torn file
+        tmp_path = path + '.tmp'
+        if orjson is not None:
+            with open(tmp_path, 'wb') as f:
+                f.write(orjson.dumps(snapshot, option=orjson.OPT_INDENT_2))
+        else:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    
+    def _mark_dirty(self):
+        """Record a metadata change: drop cached stats, schedule a JSON backup."""
+        with self._lock:
+            self._dirty = True
+            self._stats_cache = None
+            if self._save_timer is None:
+                self._save_timer = threading.Timer(BACKUP_DEBOUNCE_SECONDS, self.flush_metadata)
+                self._save_timer.daemon = True
+                self._save_timer.start()
+    
+    def flush_metadata(self):
+        """Write the JSON backup now if metadata changed since the last write."""
+        with self._lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
+            if not self._dirty:
+                return
+            self._dirty = False
+        self.export_metadata()
+    
+    def export_metadata(self, path: Optional[str] = None) -> bool:
+        """
+        Export metadata to JSON for backups.
+        
+        Args:
+            path: Destination file (defaults to assets_metadata.json)
+            
+        Returns:
+            True if exported, False otherwise
+        """
         try:
-            with open(self.metadata_file, 'w', encoding='utf-8') as f:
-                json.dump(self.metadata, f, indent=2, ensure_ascii=False)
+            self._save_metadata(path or self.metadata_file)
+            return True
         except Exception as e:
             logger.error(f"Error saving metadata: {e}")
+            return False
+    
+    def _find_by_fingerprint(self, fingerprint: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id FROM assets WHERE fingerprint = ? LIMIT 1", (fingerprint,)
+            ).fetchone()
+        return row['id'] if row else None
+    
+    def _has_asset(self, asset_id: str) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM assets WHERE id = ?", (asset_id,)).fetchone() is not None
     
     def _get_file_hash(self, file_path: str) -> str:
         """Generate SHA256 hash of file for deduplication."""
-        sha256 = hashlib.sha256()
         try:
-            with open(file_path, 'rb') as f:
-                for chunk in iter(lambda: f.read(8192), b''):
+            with open(file_path, 'rb', buffering=0) as f:
+                if hasattr(hashlib, 'file_digest'):  # Python 3.11+
+                    return hashlib.file_digest(f, 'sha256').hexdigest()
+                sha256 = hashlib.sha256()
+                for chunk in iter(lambda: f.read(HASH_BUFFER_SIZE), b''):
                     sha256.update(chunk)
-            return sha256.hexdigest()
+                return sha256.hexdigest()
         except Exception as e:
             logger.error(f"Error hashing file: {e}")
             return ""
     
+    def _hash_and_copy(self, src: str, dst: str) -> str:
+        """Copy src to dst while hashing it, reading the source only once."""
+        sha256 = hashlib.sha256()
+        with open(src, 'rb', buffering=0) as fsrc, open(dst, 'wb') as fdst:
+            buf = bytearray(COPY_CHUNK_SIZE)
+            view = memoryview(buf)
+            while True:
+                n = fsrc.readinto(buf)
+                if not n:
+                    break
+                sha256.update(view[:n])
+                fdst.write(view[:n])
+        return sha256.hexdigest()
+    
+    def _quick_fingerprint(self, file_path: str) -> str:
+        """Cheap dedup key: file size plus BLAKE2b of the first and last 64 KiB."""
+        size = os.path.getsize(file_path)
+        digest = hashlib.blake2b(digest_size=16)
+        with open(file_path, 'rb') as f:
+            digest.update(f.read(FINGERPRINT_SAMPLE_SIZE))
+            if size > FINGERPRINT_SAMPLE_SIZE:
+                f.seek(max(FINGERPRINT_SAMPLE_SIZE, size - FINGERPRINT_SAMPLE_SIZE))
+                digest.update(f.read(FINGERPRINT_SAMPLE_SIZE))
+        return f"{size}:{digest.hexdigest()}"
+    
     def _detect_asset_type(self, file_path: str) -> Optional[str]:
         """Detect asset type from file extension."""
-        ext = os.path.splitext(file_path)[1].lower()
-        
-        for asset_type, extensions in self.SUPPORTED_TYPES.items():
-            if ext in extensions:
-                return asset_type
-        return None
+        return self._ext_to_type.get(os.path.splitext(file_path)[1].lower())
     
     def store_asset(
         self, 
@@ -112,43 +359,64 @@ class AssetManager:
         if not os.path.exists(file_path):
             raise FileNotFoundError(f"File not found: {file_path}")
         
+        ext = os.path.splitext(file_path)[1]
+        
         # Detect type if not provided
         if asset_type is None:
-            asset_type = self._detect_asset_type(file_path)
+            asset_type = self._ext_to_type.get(ext.lower())
             if asset_type is None:
                 raise ValueError(f"Unsupported file type: {file_path}")
         
-        # Generate hash for deduplication
-        file_hash = self._get_file_hash(file_path)
-        if not file_hash:
-            raise ValueError("Could not generate file hash")
-        
-        # Check if asset already exists
-        if file_hash in self.metadata['assets']:
-            logger.info(f"Asset already exists: {file_hash}")
-            return file_hash
+        # Quick pre-check against known assets before hashing the whole file
+        fingerprint = self._quick_fingerprint(file_path)
+        candidate = self._find_by_fingerprint(fingerprint)
+        if candidate and self.trust_fingerprint:
+            logger.info(f"Asset already exists: {candidate}")
+            return candidate
         
         # Determine storage subdirectory
-        subdir_map = {
-            'image': 'images',
-            'video': 'videos',
-            '360_video': '360_videos',
-            '3d_model': '3d_models',
-            'audio': 'audio'
-        }
-        subdir = subdir_map.get(asset_type, 'images')
-        
-        # Generate filename with hash
-        ext = os.path.splitext(file_path)[1]
-        filename = f"{file_hash}{ext}"
-        dest_path = os.path.join(self.storage_dir, subdir, filename)
+        subdir = self.TYPE_SUBDIRS.get(asset_type, 'images')
         
-        # Copy file
-        try:
-            shutil.copy2(file_path, dest_path)
-        except Exception as e:
-            logger.error(f"Error copying file: {e}")
-            raise
+        if candidate is None and self.fuse_hash_and_copy:
+            # Likely new: hash while copying into temp/, then move into place
+            fd, tmp_path = tempfile.mkstemp(suffix=ext, dir=os.path.join(self.storage_dir, 'temp'))
+            os.close(fd)
+            try:
+                file_hash = self._hash_and_copy(file_path, tmp_path)
+                if self._has_asset(file_hash):
+                    os.remove(tmp_path)
+                    logger.info(f"Asset already exists: {file_hash}")
+                    return file_hash
+                filename = f"{file_hash}{ext}"
+                dest_path = os.path.join(self.storage_dir, subdir, filename)
+                os.replace(tmp_path, dest_path)
+                shutil.copystat(file_path, dest_path)
+            except Exception as e:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                logger.error(f"Error copying file: {e}")
+                raise
+        else:
+            # Generate hash for deduplication
+            file_hash = self._get_file_hash(file_path)
+            if not file_hash:
+                raise ValueError("Could not generate file hash")
+            
+            # Check if asset already exists
+            if self._has_asset(file_hash):
+                logger.info(f"Asset already exists: {file_hash}")
+                return file_hash
+            
+            # Generate filename with hash
+            filename = f"{file_hash}{ext}"
+            dest_path = os.path.join(self.storage_dir, subdir, filename)
+            
+            # Copy file
+            try:
+                _copy_file(file_path, dest_path)
+            except Exception as e:
+                logger.error(f"Error copying file: {e}")
+                raise
         
         # Store metadata
         asset_meta = {
@@ -161,11 +429,16 @@ class AssetManager:
             'experience_id': experience_id,
             'size': os.path.getsize(dest_path),
             'created_at': datetime.now().isoformat(),
-            'custom_metadata': metadata or {}
+            'custom_metadata': metadata or {},
+            'fingerprint': fingerprint
         }
         
-        self.metadata['assets'][file_hash] = asset_meta
-        self._save_metadata()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO assets VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                self._asset_to_row(asset_meta)
+            )
+        self._mark_dirty()
         
         logger.info(f"Stored asset: {file_hash} ({asset_type})")
         return file_hash
@@ -180,7 +453,26 @@ class AssetManager:
         Returns:
             Asset metadata dictionary or None
         """
-        return self.metadata['assets'].get(asset_id)
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM assets WHERE id = ?", (asset_id,)).fetchone()
+        return self._row_to_asset(row) if row else None
+    
+    def get_prompt_asset(self, prompt_hash: str) -> Optional[str]:
+        """Return the asset generated for a prompt hash, if it still exists."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT p.asset_id FROM prompt_cache p JOIN assets a ON a.id = p.asset_id "
+                "WHERE p.prompt_hash = ?", (prompt_hash,)
+            ).fetchone()
+        return row['asset_id'] if row else None
+    
+    def set_prompt_asset(self, prompt_hash: str, asset_id: str):
+        """Record the asset generated for a prompt hash."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO prompt_cache VALUES (?, ?, ?)",
+                (prompt_hash, asset_id, datetime.now().isoformat())
+            )
     
     def get_asset_url(self, asset_id: str) -> Optional[str]:
         """Get the URL for an asset."""
@@ -206,25 +498,29 @@ class AssetManager:
         Returns:
             List of asset metadata dictionaries
         """
-        results = []
-        
-        for asset_id, asset in self.metadata['assets'].items():
-            # Apply filters
-            if asset_type and asset.get('type') != asset_type:
-                continue
-            if domain and asset.get('domain') != domain:
-                continue
-            if experience_id and asset.get('experience_id') != experience_id:
-                continue
-            
-            results.append(asset)
-            
-            if len(results) >= limit:
-                break
-        
-        # Sort by creation date (newest first)
-        results.sort(key=lambda x: x.get('created_at', ''), reverse=True)
-        return results
+        clauses = []
+        params: List = []
+        
+        # Apply filters
+        if asset_type:
+            clauses.append("type = ?")
+            params.append(asset_type)
+        if domain:
+            clauses.append("domain = ?")
+            params.append(domain)
+        if experience_id:
+            clauses.append("experience_id = ?")
+            params.append(experience_id)
+        
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        params.append(limit)
+        
+        # Newest first
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT * FROM assets {where} ORDER BY created_at DESC LIMIT ?", params
+            ).fetchall()
+        return [self._row_to_asset(r) for r in rows]
     
     def delete_asset(self, asset_id: str) -> bool:
         """
@@ -249,8 +545,10 @@ class AssetManager:
             return False
         
         # Remove from metadata
-        del self.metadata['assets'][asset_id]
-        self._save_metadata()
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM assets WHERE id = ?", (asset_id,))
+            self._conn.execute("DELETE FROM prompt_cache WHERE asset_id = ?", (asset_id,))
+        self._mark_dirty()
         
         logger.info(f"Deleted asset: {asset_id}")
         return True
@@ -306,39 +604,48 @@ class AssetManager:
         }
         
         # Store bundle in metadata
-        if 'bundles' not in self.metadata:
-            self.metadata['bundles'] = {}
-        
-        self.metadata['bundles'][bundle_id] = bundle_meta
-        self._save_metadata()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO bundles VALUES (?, ?, ?, ?)",
+                self._bundle_to_row(bundle_meta)
+            )
+        self._mark_dirty()
         
         logger.info(f"Created bundle: {bundle_id} with {len(asset_ids)} assets")
         return bundle_id
     
     def get_bundle(self, bundle_id: str) -> Optional[Dict]:
         """Get bundle metadata."""
-        return self.metadata.get('bundles', {}).get(bundle_id)
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM bundles WHERE id = ?", (bundle_id,)).fetchone()
+        return self._row_to_bundle(row) if row else None
     
     def get_statistics(self) -> Dict:
-        """Get storage statistics."""
-        stats = {
-            'total_assets': len(self.metadata['assets']),
-            'by_type': {},
-            'by_domain': {},
-            'total_size_mb': 0
-        }
-        
-        for asset in self.metadata['assets'].values():
-            # Count by type
-            asset_type = asset.get('type', 'unknown')
-            stats['by_type'][asset_type] = stats['by_type'].get(asset_type, 0) + 1
+        """Get storage statistics (cached for a few seconds)."""
+        with self._lock:
+            cached = self._stats_cache
+            if cached and time.monotonic() - cached[0] < STATS_CACHE_SECONDS:
+                return self._copy_stats(cached[1])
             
-            # Count by domain
-            domain = asset.get('domain', 'general')
-            stats['by_domain'][domain] = stats['by_domain'].get(domain, 0) + 1
+            by_type = self._conn.execute(
+                "SELECT COALESCE(type, 'unknown'), COUNT(*) FROM assets GROUP BY 1"
+            ).fetchall()
+            by_domain = self._conn.execute(
+                "SELECT COALESCE(domain, 'general'), COUNT(*) FROM assets GROUP BY 1"
+            ).fetchall()
+            total, total_size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM assets"
+            ).fetchone()
             
-            # Sum size
-            stats['total_size_mb'] += asset.get('size', 0) / (1024 * 1024)
-        
-        stats['total_size_mb'] = round(stats['total_size_mb'], 2)
-        return stats
+            stats = {
+                'total_assets': total,
+                'by_type': dict(by_type),
+                'by_domain': dict(by_domain),
+                'total_size_mb': round(total_size / (1024 * 1024), 2)
+            }
+            self._stats_cache = (time.monotonic(), stats)
+        return self._copy_stats(stats)
+    
+    @staticmethod
+    def _copy_stats(stats: Dict) -> Dict:
+        return {**stats, 'by_type': dict(stats['by_type']), 'by_domain': dict(stats['by_domain'])}
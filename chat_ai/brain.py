@@ -3,10 +3,33 @@ RAG-style brain: index documents, retrieve, and answer queries using LLM if avai
 """
 from __future__ import annotations
 
-from typing import List, Dict, Optional, Any, Iterator, Tuple, Union
+from typing import List, Dict, Optional, Any, Iterator, AsyncIterator, Tuple, Union
 import os
+import asyncio
+import importlib.util
 import logging
 import json
+import re
+import functools
+import hashlib
+import itertools
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import numpy as np  # type: ignore
+except ImportError:  # pragma: no cover
+    np = None
+
+try:
+    import orjson  # type: ignore
+except ImportError:  # pragma: no cover
+    orjson = None
 
 from .data import load_text_file, load_csv, load_directory, prepare_documents
 from .embeddings import EmbeddingBackend
@@ -17,6 +40,320 @@ from .tools import ToolSystem
 
 logger = logging.getLogger(__name__)
 
+EMBEDDING_CACHE_FILE = "embeddings_cache.sqlite"
+# Keywords that route a question through chain-of-thought reasoning
+_COT_RE = re.compile(r"paso a paso|step by step|analiza|resuelve|complejo|razona", re.IGNORECASE)
+# Keywords that raise the importance of a stored user message
+_IMPORTANT_RE = re.compile(r"importante|recordar|siempre|preferencia", re.IGNORECASE)
+# Question routers, matched against the stripped, lowercased question
+_SMALLTALK_RE = re.compile(r"(?:hola|buenas|hello|hi|hey)(?: |$)")
+_DATETIME_RE = re.compile(r"\b(?:hora|fecha|d[ií]a|hoy)\b")
+
+# Worker threads for LLM-bound relation extraction during ingest
+REL_EXTRACT_WORKERS = max(1, int(os.getenv("REL_EXTRACT_WORKERS", "8")))
+
+# Connection pool size of the async OpenAI client
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+# Texts per encode_texts call during ingest; bounds peak memory of the model
+EMBED_BATCH_SIZE = max(1, int(os.getenv("EMBED_BATCH_SIZE", "64")))
+# Optional cross-encoder (e.g. "BAAI/bge-reranker-v2-m3") that reranks
+# RERANK_OVERSAMPLE * top_k dense candidates before they reach the prompt
+RERANKER_MODEL = os.getenv("RERANKER_MODEL")
+RERANK_OVERSAMPLE = max(1, int(os.getenv("RERANK_OVERSAMPLE", "5")))
+# Threads for lookups that ask() runs alongside retrieval (KG context)
+ASK_POOL_WORKERS = max(1, int(os.getenv("ASK_POOL_WORKERS", "4")))
+# Questions shorter than this skip the coherence check against the previous one
+COHERENCE_MIN_CHARS = 8
+# New history (chars) tolerated after a cached summary before summarizing again
+HISTORY_RESUMMARIZE_CHARS = int(os.getenv("HISTORY_RESUMMARIZE_CHARS", "400"))
+
+
+# Tokenizer and sentence splitter shared by the extractive and coherence fallbacks
+_TOKEN_RE = re.compile(r"[a-zA-ZáéíóúñÁÉÍÓÚÑ0-9]+")
+_SENT_RE = re.compile(r"(?<=[\.\!\?])\s+")
+_NON_WORD_RE = re.compile(r"\W+")
+
+# Words ignored when matching a question against retrieved sentences
+_STOP = frozenset({
+    'el','la','los','las','un','una','unos','unas','de','del','a','y','o','u','en','con','por','para','es','son','al','se','su','sus','que','qué','como','cómo','cuando','cuándo','donde','dónde','si','sí','no','lo','le','les','ya','más','menos','muy','esto','esta','estas','estos','ese','esa','eso','esas','esos','también','pero','porque','sobre','entre'
+})
+
+
+def _content_terms(text: str) -> List[str]:
+    """Lowercased tokens of ``text`` minus stop words and single characters."""
+    tokens = _TOKEN_RE.findall(text.lower())
+    return [t for t in tokens if t not in _STOP and len(t) > 1]
+
+
+@functools.lru_cache(maxsize=2)
+def _load_cross_encoder(model_name: str):
+    """Load a CrossEncoder once per process and model name."""
+    from sentence_transformers import CrossEncoder  # type: ignore
+
+    return CrossEncoder(model_name)
+
+
+@functools.lru_cache(maxsize=2)
+def _langsmith_client(api_key: str):
+    """Create a LangSmith client once per process and API key.
+
+    langsmith (and its pydantic/httpx dependencies) is only imported here,
+    on the background recording thread, so startup never pays for it.
+    """
+    import langsmith  # type: ignore
+
+    return langsmith.Client(api_key=api_key)
+
+
+def _record_langsmith_run(api_key: str, question: str, context: str, answer: str) -> None:
+    """Record an answered turn as a LangSmith run; meant to run off the request path."""
+    try:
+        client = _langsmith_client(api_key)
+        run_id = str(uuid.uuid4())
+        # Build a compact inputs/outputs object
+        inputs = {
+            'question': question,
+            'context_snippet': (context[:1000] + '...') if context else '',
+        }
+        client.create_run(id=run_id, name=f"chat-run-{run_id[:8]}", inputs=inputs,
+                          outputs={'answer': answer}, run_type='llm')
+        logger.debug(f"Recorded LangSmith run {run_id}")
+    except ImportError:
+        logger.debug("langsmith not installed; LangSmith run not recorded")
+    except Exception:
+        logger.exception("Failed to create LangSmith run")
+
+
+_RAG_SYSTEM_PROMPT = (
+    "Eres un asistente útil. Usa estrictamente el CONTEXTO para responder. "
+    "Si la respuesta no está en el contexto, responde: 'No encontré esa información'. "
+)
+# Prompt skeleton: (key, header, included even when empty), in prompt order:
+# relevant memory -> history -> KG -> context -> references -> question
+_PROMPT_SECTIONS: Tuple[Tuple[str, str, bool], ...] = (
+    ("relevant_memory", "MEMORIA RELEVANTE (conversaciones pasadas)", False),
+    ("history", "HISTORIAL RECIENTE", False),
+    ("kg", "GRAFO DE CONOCIMIENTO (relaciones causales)", False),
+    ("context", "CONTEXTO", True),
+    ("references", "REFERENCIAS", False),
+    ("question", "PREGUNTA", True),
+)
+_PROMPT_TRAILER = "Responde de forma breve y precisa en español. Cita las referencias usando [n] si aplican."
+
+
+def _build_prompt(values: Dict[str, str]) -> str:
+    """Fill the RAG prompt skeleton.
+
+    Headers and bodies are joined once, so large bodies (context, history)
+    are copied into the prompt a single time.
+    """
+    parts: List[str] = []
+    for key, header, always in _PROMPT_SECTIONS:
+        body = values.get(key) or ""
+        if body or always:
+            parts.extend((header, ":\n", body, "\n\n"))
+    parts.append(_PROMPT_TRAILER)
+    return "".join(parts)
+
+
+def _context_and_references(retrieved: List[Dict[str, str]]) -> Tuple[str, str]:
+    """Join chunk texts into the prompt context and number the references, in one pass."""
+    ctx_parts: List[str] = []
+    ref_lines: List[str] = []
+    for i, r in enumerate(retrieved, start=1):
+        text = r.get("text")
+        if text:
+            ctx_parts.append(text)
+        src = r.get("source") or r.get("id") or ""
+        url = r.get("url") or r.get("source_url") or ""
+        ref_lines.append(f"[{i}] {src}" + (f" - {url}" if url else ""))
+    return "\n\n".join(ctx_parts), "\n".join(ref_lines)
+
+
+def _history_line(message: Dict[str, str]) -> str:
+    role = (message.get("role") or "").lower()
+    content = message.get("content") or ""
+    if role in ("user", "usuario"):
+        return f"Usuario: {content}"
+    if role in ("assistant", "asistente"):
+        return f"Asistente: {content}"
+    if role == "system":
+        return f"Sistema: {content}"
+    # generic
+    return f"{role.capitalize()}: {content}"
+
+
+def _token_signature(text: str) -> int:
+    """1024-bit set of hashed tokens, packed in an int.
+
+    Intersections and unions become bitwise ops on one int. Colliding tokens
+    slightly inflate the overlap, which is fine for a coherence heuristic.
+    """
+    sig = 0
+    for tok in _TOKEN_RE.findall((text or "").lower()):
+        sig |= 1 << (hash(tok) & 1023)
+    return sig
+
+
+def _stable_doc_id(source: str, text: str) -> str:
+    """Deterministic document id (Python's hash() is salted per process)."""
+    return f"{source}_{hashlib.blake2b(text.encode('utf-8'), digest_size=8).hexdigest()}"
+
+
+def _json_dumps(obj: Any) -> str:
+    """Serialize to a JSON string, with orjson when available."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+        except TypeError:
+            pass  # e.g. integers beyond 64 bits; let json handle or raise
+    return json.dumps(obj, ensure_ascii=False)
+
+
+def _json_loads(data: str) -> Any:
+    """Parse a JSON string, with orjson when available."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _first_projection(retrieved: List[Dict[str, str]]) -> Optional[Dict[str, Any]]:
+    """Parsed Experience Object of the best-ranked experience chunk, if any."""
+    for r in retrieved:
+        if r.get('is_experience') == 'true' and r.get('experience_json'):
+            try:
+                return _json_loads(r['experience_json'])
+            except Exception as e:
+                logger.debug(f"Error loading experience JSON: {e}")
+    return None
+
+
+def _batched(items, n: int):
+    """Yield successive lists of at most ``n`` items."""
+    it = iter(items)
+    while batch := list(itertools.islice(it, n)):
+        yield batch
+
+
+def _coerce(X):
+    """Return embeddings as a C-contiguous float32 array (what FAISS expects).
+
+    No copy is made when the input already has that layout.
+    """
+    if np is None:
+        return X
+    return np.ascontiguousarray(X, dtype=np.float32)
+
+
+class _SimpleEmbedder:
+    """Very small embedding fallback using token counts.
+
+    Not semantically rich but allows similarity-based retrieval
+    and relatedness checks without heavy native dependencies.
+    """
+    backend_name = 'simple'
+    # Deleting vowels via str.translate counts them in C
+    _STRIP_VOWELS = str.maketrans('', '', 'aeiouáéíóú')
+
+    def encode_texts(self, texts):
+        out = []
+        for t in texts:
+            s = (t or '')
+            lowered = s.lower()
+            # features: length, word count, vowel count
+            vowels = len(lowered) - len(lowered.translate(self._STRIP_VOWELS))
+            out.append((len(s), len(s.split()), vowels))
+        if np is None:
+            return [list(row) for row in out]
+        return np.array(out, dtype=np.float32).reshape(len(out), 3)
+
+    def encode_query(self, q):
+        return self.encode_texts([q])[0]
+
+
+class _TTLCache:
+    """Small thread-safe LRU mapping whose entries expire ``ttl`` seconds after insertion."""
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._data: "OrderedDict[Any, Tuple[float, Any]]" = OrderedDict()
+        # Concurrent ask calls (aask) and the _ask_pool worker share the cache
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            expires, value = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def __setitem__(self, key, value) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + self._ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self._maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+class _EmbeddingCache:
+    """Content-addressed embedding store persisted next to the index.
+
+    Rows are keyed by BLAKE2b of ``namespace + text`` where the namespace
+    identifies the backend and model, so vectors from different models
+    never collide. Vectors are stored as raw float32 bytes.
+    """
+
+    # Stay well below SQLite's host-parameter limit on older builds
+    _LOOKUP_BATCH = 500
+
+    def __init__(self, path: str, namespace: str) -> None:
+        self._namespace = namespace
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (hash TEXT PRIMARY KEY, vec BLOB NOT NULL)"
+        )
+        self._conn.commit()
+
+    def key(self, text: str) -> str:
+        return hashlib.blake2b((self._namespace + text).encode("utf-8"), digest_size=16).hexdigest()
+
+    def get_many(self, hashes: List[str]) -> Dict[str, Any]:
+        found: Dict[str, Any] = {}
+        unique = list(dict.fromkeys(hashes))
+        with self._lock:
+            for start in range(0, len(unique), self._LOOKUP_BATCH):
+                batch = unique[start:start + self._LOOKUP_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT hash, vec FROM embeddings WHERE hash IN ({placeholders})", batch
+                ).fetchall()
+                for h, blob in rows:
+                    found[h] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def put_many(self, pairs) -> None:
+        rows = [(h, np.asarray(v, dtype=np.float32).tobytes()) for h, v in pairs]
+        if not rows:
+            return
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (hash, vec) VALUES (?, ?)", rows
+                )
+
 
 class LLMClient:
     """Lightweight LLM wrapper with OpenAI support and a safe fallback."""
@@ -24,7 +361,13 @@ class LLMClient:
     def __init__(self) -> None:
         self._mode = "fallback"
         self._client = None
+        # Async client is built lazily on first achat(), per event loop
+        self._aclient = None
+        self._aclient_loop = None
+        # tiktoken encoder, loaded on first truncation (False if unavailable)
+        self._enc = None
         api_key = os.getenv("OPENAI_API_KEY")
+        self._api_key = api_key
         # Allow overriding preferred provider via env var (values: 'openai' or 'huggingface')
         preferred = (os.getenv("PREFERRED_LLM") or os.getenv("LLM_PROVIDER") or "").lower()
 
@@ -42,28 +385,7 @@ class LLMClient:
         if preferred == "huggingface" and self._hf_key:
             self._mode = "huggingface"
         elif preferred == "openai" and api_key:
-            try:
-                import openai  # type: ignore
-                # Support both pre-1.0 and v1+ openai python libs
-                if hasattr(openai, "OpenAI"):
-                    # Newer openai client (v1+)
-                    try:
-                        self._client = openai.OpenAI(api_key=api_key)
-                        self._client_type = "openai_v1"
-                    except Exception as e:
-                        logger.warning(f"Failed to initialize OpenAI client with new API: {e}")
-                        # fallback to module-level usage if construction fails
-                        openai.api_key = api_key
-                        self._client = openai
-                        self._client_type = "openai_legacy"
-                else:
-                    openai.api_key = api_key
-                    self._client = openai
-                    self._client_type = "openai_legacy"
-                self._mode = "openai"
-            except Exception as e:
-                logger.warning(f"Failed to load OpenAI legacy client: {e}")
-                self._mode = "fallback"
+            self._mode = self._openai_mode()
         elif preferred == "langsmith" and self._langsmith_key:
             self._mode = "langsmith"
         elif preferred == "ollama" and self._ollama_model_name:
@@ -73,25 +395,7 @@ class LLMClient:
         else:
             # Default behaviour: prefer OpenAI if key present, otherwise HF, then LangSmith if present
             if api_key:
-                try:
-                    import openai  # type: ignore
-                    if hasattr(openai, "OpenAI"):
-                        try:
-                            self._client = openai.OpenAI(api_key=api_key)
-                            self._client_type = "openai_v1"
-                        except Exception as e:
-                            logger.warning(f"Failed to initialize OpenAI client with new API: {e}")
-                            openai.api_key = api_key
-                            self._client = openai
-                            self._client_type = "openai_legacy"
-                    else:
-                        openai.api_key = api_key
-                        self._client = openai
-                        self._client_type = "openai_legacy"
-                    self._mode = "openai"
-                except Exception as e:
-                    logger.warning(f"Failed to load OpenAI legacy client: {e}")
-                    self._mode = "fallback"
+                self._mode = self._openai_mode()
             elif self._hf_key:
                 self._mode = "huggingface"
             elif self._langsmith_key:
@@ -103,6 +407,40 @@ class LLMClient:
                 # If an Ollama model name is present, use Ollama mode
                 self._mode = "ollama"
 
+    @staticmethod
+    def _openai_mode() -> str:
+        # find_spec checks availability without paying the import cost up front
+        if importlib.util.find_spec("openai") is None:
+            logger.warning("OPENAI_API_KEY is set but the openai package is not installed")
+            return "fallback"
+        return "openai"
+
+    def _get_openai_client(self):
+        """Import openai and build the client on first use."""
+        if self._client is None and self._mode == "openai":
+            try:
+                import openai  # type: ignore
+                # Support both pre-1.0 and v1+ openai python libs
+                if hasattr(openai, "OpenAI"):
+                    # Newer openai client (v1+)
+                    try:
+                        self._client = openai.OpenAI(api_key=self._api_key)
+                        self._client_type = "openai_v1"
+                    except Exception as e:
+                        logger.warning(f"Failed to initialize OpenAI client with new API: {e}")
+                        # fallback to module-level usage if construction fails
+                        openai.api_key = self._api_key
+                        self._client = openai
+                        self._client_type = "openai_legacy"
+                else:
+                    openai.api_key = self._api_key
+                    self._client = openai
+                    self._client_type = "openai_legacy"
+            except Exception as e:
+                logger.warning(f"Failed to load OpenAI legacy client: {e}")
+                self._mode = "fallback"
+        return self._client
+
     def chat(self, prompt: str, system: Optional[str] = None, stream: bool = False) -> Union[str, Iterator[str]]:
         # Local llama-cpp path (on-device inference)
         if self._mode == "local" and self._local_model_path:
@@ -140,7 +478,7 @@ class LLMClient:
                 logger.exception("Local Llama model invocation failed; falling back")
 
         # OpenAI path (if available)
-        if self._mode == "openai" and self._client is not None:
+        if self._mode == "openai" and self._get_openai_client() is not None:
             try:
                 # Build messages correctly: optional system message, then user prompt
                 messages = []
@@ -242,6 +580,78 @@ class LLMClient:
             return _gen_fallback()
         return msg
 
+    def _get_async_client(self):
+        """Return an ``openai.AsyncOpenAI`` bound to the running event loop.
+
+        httpx connection pools cannot be shared across loops, so the client is
+        rebuilt if achat() is called from a different loop.
+        """
+        loop = asyncio.get_running_loop()
+        if self._aclient is None or self._aclient_loop is not loop:
+            import openai  # type: ignore
+            kwargs: Dict[str, Any] = {"api_key": self._api_key}
+            try:
+                import httpx  # type: ignore
+                kwargs["http_client"] = httpx.AsyncClient(
+                    http2=importlib.util.find_spec("h2") is not None,
+                    limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS),
+                )
+            except ImportError:
+                pass  # openai falls back to its own default pool
+            self._aclient = openai.AsyncOpenAI(**kwargs)
+            self._aclient_loop = loop
+        return self._aclient
+
+    async def achat(self, prompt: str, system: Optional[str] = None, stream: bool = False) -> Union[str, AsyncIterator[str]]:
+        """Async counterpart of :meth:`chat`.
+
+        OpenAI v1 requests go through a pooled ``AsyncOpenAI`` client so
+        concurrent calls share connections. Other modes run the synchronous
+        ``chat`` in a worker thread.
+        """
+        if self._mode == "openai" and self._get_openai_client() is not None and getattr(self, "_client_type", None) == "openai_v1":
+            try:
+                messages = []
+                if system:
+                    messages.append({"role": "system", "content": system})
+                messages.append({"role": "user", "content": prompt})
+                resp = await self._get_async_client().chat.completions.create(
+                    model=os.getenv("OPENAI_MODEL", "gpt-3.5-turbo"),
+                    messages=messages,
+                    temperature=float(os.getenv("OPENAI_TEMPERATURE", "0.2")),
+                    stream=stream
+                )
+                if stream:
+                    async def _agen_v1():
+                        async for chunk in resp:
+                            content = chunk.choices[0].delta.content
+                            if content:
+                                yield content
+                    return _agen_v1()
+                try:
+                    return resp.choices[0].message.content.strip()
+                except Exception:
+                    return str(resp)
+            except Exception:
+                logger.exception("Async OpenAI chat failed; falling back to sync chat")
+
+        result = await asyncio.to_thread(self.chat, prompt, system, stream)
+        if not stream:
+            return result
+
+        async def _agen_sync():
+            if isinstance(result, str):
+                yield result
+                return
+            sentinel = object()
+            while True:
+                # Pull each chunk in a thread so blocking backends don't stall the loop
+                chunk = await asyncio.to_thread(next, result, sentinel)
+                if chunk is sentinel:
+                    break
+                yield chunk
+        return _agen_sync()
+
     def summarize(self, text: str, max_chars: int = 800) -> str:
         """Try to produce a short summary of `text` using the available LLMs.
 
@@ -249,15 +659,39 @@ class LLMClient:
         """
         if not text:
             return ""
+        # Already short enough: no LLM round-trip needed
+        if len(text) <= max_chars:
+            return text
         system = "Resume brevemente el historial de conversación en pocas líneas en español."
         try:
             summary = self.chat(prompt=text, system=system)
             if summary:
-                return summary[:max_chars]
+                return self._truncate(summary, max_chars)
         except Exception:
             logger.exception("Summarization via LLM failed")
         # fallback: truncate
-        return (text[:max_chars] + "...") if len(text) > max_chars else text
+        return self._truncate(text, max_chars) + "..."
+
+    def _get_encoder(self):
+        if self._enc is None:
+            try:
+                import tiktoken  # type: ignore
+                self._enc = tiktoken.get_encoding("cl100k_base")
+            except Exception:
+                self._enc = False
+        return self._enc
+
+    def _truncate(self, text: str, max_chars: int) -> str:
+        """Cut `text` to at most `max_chars`, on a token boundary when tiktoken is installed."""
+        if len(text) <= max_chars:
+            return text
+        head = text[:max_chars]
+        enc = self._get_encoder()
+        if not enc:
+            return head
+        # The last token of the slice may be cut mid-way; drop it
+        tokens = enc.encode(head)
+        return enc.decode(tokens[:-1]) if len(tokens) > 1 else head
 
     @property
     def mode_name(self) -> str:
@@ -265,42 +699,13 @@ class LLMClient:
 
 
 class Brain:
-    def __init__(self, model_name: str = "all-MiniLM-L6-v2", storage_dir: Optional[str] = None, prefer_faiss: bool = True, user_id: str = "anonymous", db_path: str = None) -> None:
-        # Initialize embedder (Lazy / Safe Mode)
-        # Force simple embedder for now to avoid hangs if model download fails
-        self.embedder = None 
-        # If embedder initialization failed (heavy deps missing), provide a
-        # lightweight fallback embedder so the service remains responsive.
+    def __init__(self, model_name: str = "all-MiniLM-L6-v2", storage_dir: Optional[str] = None, prefer_faiss: bool = True, user_id: str = "anonymous", db_path: str = None, index_type: Optional[str] = None, reranker_model: Optional[str] = None) -> None:
+        # Fall back to a lightweight embedder if heavy deps are missing so
+        # the service remains responsive.
         try:
             self.embedder = EmbeddingBackend(model_name=model_name)
         except Exception:
             logger.exception("Failed to initialize EmbeddingBackend, falling back to simple embedder.")
-            self.embedder = None
-        
-        # If embedder initialization failed (heavy deps missing), provide a
-        # lightweight fallback embedder so the service remains responsive.
-        if getattr(self, 'embedder', None) is None:
-            class _SimpleEmbedder:
-                """Very small embedding fallback using token counts.
-
-                Not semantically rich but allows similarity-based retrieval
-                and relatedness checks without heavy native dependencies.
-                """
-                backend_name = 'simple'
-
-                def encode_texts(self, texts):
-                    out = []
-                    for t in texts:
-                        s = (t or '')
-                        # features: length, vowel count, word count
-                        words = s.split()
-                        vowels = sum(1 for c in s.lower() if c in 'aeiouáéíóú')
-                        out.append([len(s), len(words), vowels])
-                    return out
-
-                def encode_query(self, q):
-                    return self.encode_texts([q])[0]
-
             self.embedder = _SimpleEmbedder()
         
         # Initialize LLM client
@@ -315,29 +720,28 @@ class Brain:
         self.cot_reasoner = ChainOfThoughtReasoner(self.llm)
         self.consistency_checker = ConsistencyChecker(self.llm)
         self.tool_system = ToolSystem()
+        # Tool detection only depends on the lowercased question
+        self._detect_tool_cached = functools.lru_cache(maxsize=256)(
+            lambda q_lower: self.tool_system.detect_tool(q_lower, self.llm)
+        )
         
-        # Initialize Knowledge Graph (inspired by "The Reality Weaver")
-        try:
-            from .knowledge_graph import KnowledgeGraph
-            from .relation_extractor import RelationExtractor
-            kg_db_path = os.path.join(storage_dir, 'knowledge_graph.db') if storage_dir else 'knowledge_graph.db'
-            self.knowledge_graph = KnowledgeGraph(db_path=kg_db_path)
-            self.relation_extractor = RelationExtractor(self.knowledge_graph, self.llm)
-            logger.info("Knowledge Graph initialized")
-        except Exception as e:
-            logger.warning(f"Failed to initialize Knowledge Graph: {e}")
-            self.knowledge_graph = None
-            self.relation_extractor = None
+        # Knowledge Graph (inspired by "The Reality Weaver") is opened on first use
+        self._kg_db_path = os.path.join(storage_dir, 'knowledge_graph.db') if storage_dir else 'knowledge_graph.db'
+        self._knowledge_graph = None
+        self._relation_extractor = None
+        self._kg_initialized = False
+        self._kg_lock = threading.Lock()
         
         # Choose store (import lazily to avoid heavy deps at module import time)
+        self._index_type = index_type
         try:
             from .vector_store import InMemoryVectorStore, FaissVectorStore  # local import
             self.store = None
             if prefer_faiss:
-                try:
-                    import faiss  # type: ignore  # noqa: F401
-                    self.store = FaissVectorStore()
-                except Exception:
+                # FaissVectorStore imports faiss itself on first add
+                if importlib.util.find_spec("faiss") is not None:
+                    self.store = FaissVectorStore(index_type=index_type)
+                else:
                     self.store = InMemoryVectorStore()
             else:
                 self.store = InMemoryVectorStore()
@@ -353,52 +757,157 @@ class Brain:
                     return []
             self.store = _StubStore()
 
+        # Persistent embedding cache: only for deterministic backends. TF-IDF
+        # vectors depend on the fitted vocabulary and cannot be reused.
+        self._embedding_cache: Optional[_EmbeddingCache] = None
+        if storage_dir and np is not None and getattr(self.embedder, "backend_name", None) == "sentence_transformers":
+            try:
+                os.makedirs(storage_dir, exist_ok=True)
+                namespace = f"{self.embedder.backend_name}:{model_name}\x00"
+                self._embedding_cache = _EmbeddingCache(os.path.join(storage_dir, EMBEDDING_CACHE_FILE), namespace)
+            except Exception as e:
+                logger.warning(f"Embedding cache disabled: {e}")
+
         # Track original doc chunks for retrieval output
         self._corpus_texts: List[str] = []
         self._corpus_metas: List[Dict[str, str]] = []
+        # chunk id -> text, kept in sync with the corpus lists for O(1) lookup
+        self._id_to_text: Dict[str, str] = {}
+        # ids of raw documents already ingested, used to skip duplicates
+        self._doc_ids: set = set()
         self._storage_dir = storage_dir
         # Autoload if storage given
         if self._storage_dir:
             self.load_index(self._storage_dir)
         
-        # Simple in-memory cache for retrieval: {query: results}
-        self._retrieve_cache = {}
+        # LRU cache for retrieval: {(query, top_k): results}
+        self._retrieve_cache: "OrderedDict[Tuple[str, int], List[Dict[str, str]]]" = OrderedDict()
         self._cache_max_size = 100
+        # Guards _retrieve_cache: aask runs retrieve on worker threads
+        self._retrieve_lock = threading.Lock()
+        # Query embeddings depend only on the query text, so memoize them
+        # separately to skip the model call when only top_k changes. The
+        # coherence check in ask() reads the same memo.
+        self._encode_query_cached = functools.lru_cache(maxsize=512)(self._encode_query_normed)
+        # Solution paths found in the KG, keyed by (normalized question, max_depth).
+        # Rephrased questions often normalize to the same key.
+        self._kg_cache = _TTLCache(maxsize=256, ttl=300)
+        # Background lookups that overlap with retrieval in ask()
+        self._ask_pool = ThreadPoolExecutor(max_workers=ASK_POOL_WORKERS, thread_name_prefix="brain-ask")
+        # Cross-encoder is loaded on the first question, if configured
+        self._reranker_model = reranker_model or RERANKER_MODEL
+        self._reranker = None
+        # Rendered lines of the memory window, valid up to memory version _hist_version
+        self._hist_lines: List[str] = []
+        self._hist_version = 0
+        self._hist_lock = threading.Lock()
+        # (memory version, summary) of the last summarized history
+        self._history_summary: Optional[Tuple[int, str]] = None
+
+
+    def _ensure_kg(self) -> None:
+        if self._kg_initialized:
+            return
+        with self._kg_lock:
+            if self._kg_initialized:
+                return
+            try:
+                from .knowledge_graph import KnowledgeGraph
+                from .relation_extractor import RelationExtractor
+                self._knowledge_graph = KnowledgeGraph(db_path=self._kg_db_path)
+                self._relation_extractor = RelationExtractor(self._knowledge_graph, self.llm)
+                logger.info("Knowledge Graph initialized")
+            except Exception as e:
+                logger.warning(f"Failed to initialize Knowledge Graph: {e}")
+                self._knowledge_graph = None
+                self._relation_extractor = None
+            self._kg_initialized = True
+
+    @property
+    def knowledge_graph(self):
+        self._ensure_kg()
+        return self._knowledge_graph
+
+    @knowledge_graph.setter
+    def knowledge_graph(self, value) -> None:
+        self._knowledge_graph = value
+        self._kg_initialized = True
+
+    @property
+    def relation_extractor(self):
+        self._ensure_kg()
+        return self._relation_extractor
 
+    @relation_extractor.setter
+    def relation_extractor(self, value) -> None:
+        self._relation_extractor = value
+        self._kg_initialized = True
 
     def ingest_files(self, paths: List[str], chunk_chars: int = 800, overlap: int = 150) -> int:
         """Ingest a mix of files or directories."""
+        return self.bulk_ingest(paths, chunk_chars=chunk_chars, overlap=overlap)
+
+    def bulk_ingest(self, paths: List[str], chunk_chars: int = 800, overlap: int = 150) -> int:
+        """Load every file/directory in ``paths`` and index them in one pass.
+
+        Prefer this over calling ``ingest_files`` once per file: the vector
+        store gets a single ``add`` (and IVF indexes train on the whole
+        batch) and the index is persisted once.
+        """
+        # Text files are streamed into chunks instead of read whole
         raw_docs: List[Dict[str, str]] = []
         for p in paths:
             if os.path.isdir(p):
-                raw_docs.extend(load_directory(p))
+                raw_docs.extend(load_directory(p, stream=True))
             elif os.path.isfile(p):
                 lower = os.path.basename(p).lower()
                 if lower.endswith('.txt'):
-                    raw_docs.extend(load_text_file(p))
+                    raw_docs.extend(load_text_file(p, stream=True))
                 elif lower.endswith('.csv'):
                     raw_docs.extend(load_csv(p))
-        prepared = prepare_documents(raw_docs, max_chars=chunk_chars, overlap=overlap)
+        texts, metas = self._prepare_docs(raw_docs, chunk_chars, overlap)
+        return self._flush(texts, metas)
 
+    @staticmethod
+    def _prepare_docs(raw_docs: List[Dict[str, str]], chunk_chars: int, overlap: int) -> Tuple[List[str], List[Dict[str, str]]]:
+        """Chunk raw documents into parallel lists of texts and metadata."""
+        prepared = prepare_documents(raw_docs, max_chars=chunk_chars, overlap=overlap)
         texts = [d["text"] for d in prepared]
-        # Only fit corpus for backends that require training (e.g., TF-IDF)
+        metas = [{k: v for k, v in d.items() if k != "text"} for d in prepared]
+        return texts, metas
+
+    def _flush(self, texts: List[str], metas: List[Dict[str, str]]) -> int:
+        """Embed prepared chunks, add them to the store in one call and persist."""
+        if not texts:
+            return 0
+        # For TF-IDF, fitting incrementally is required. For pre-trained models (sentence-transformers)
+        # fitting is unnecessary and expensive; skip it.
         try:
             if getattr(self.embedder, "backend_name", None) == "tfidf":
-                self.embedder.fit_corpus(texts)
+                corpus_for_fit = [*self._corpus_texts, *texts]
+                if corpus_for_fit:
+                    self.embedder.fit_corpus(corpus_for_fit)
         except Exception:
-            logger.exception("Error fitting embedder corpus during ingest_files; continuing with encode.")
+            logger.exception("Error fitting embedder corpus during ingest; continuing with encode.")
 
-        X = self.embedder.encode_texts(texts)
+        try:
+            X = self._encode_texts(texts)
+        except Exception:
+            logger.exception("Error encoding texts during ingest")
+            raise
 
-        metas = [{k: v for k, v in d.items() if k != "text"} for d in prepared]
+        # Trainable indexes (IVF) learn their quantizer from the whole batch
+        if hasattr(self.store, 'train') and getattr(self.store, 'size', 0) == 0:
+            self.store.train(X)
         self.store.add(embeddings=X, metas=metas)
-
         self._corpus_texts.extend(texts)
         self._corpus_metas.extend(metas)
+        self._index_texts(texts, metas)
+        self._invalidate_caches()
         # persist if configured
         if self._storage_dir:
             self.save_index(self._storage_dir)
-        return len(prepared)
+        return len(texts)
 
     def ingest_raw(self, docs: List[Dict[str, str]], chunk_chars: int = 800, overlap: int = 150) -> int:
         """Ingest already-provided raw documents.
@@ -412,6 +921,7 @@ class Brain:
         # Pre-process to detect Experience Objects and flatten them for embedding,
         # while keeping the rich structure in metadata.
         processed_docs = []
+        batch_ids = set()
         for d in docs:
             if 'sensory_data' in d or 'action_plan' in d:
                 # It's an Experience Object
@@ -421,94 +931,268 @@ class Brain:
                 sensory = d.get('sensory_data', {})
                 actions = d.get('action_plan', [])
                 
-                text_repr = f"EXPERIENCE: {title}\nCONTEXT: {context}\n"
+                parts = [f"EXPERIENCE: {title}", f"CONTEXT: {context}"]
                 if sensory:
-                    text_repr += f"SENSORY: {json.dumps(sensory, ensure_ascii=False)}\n"
+                    parts.append(f"SENSORY: {_json_dumps(sensory)}")
                 if actions:
-                    text_repr += f"ACTIONS: {json.dumps(actions, ensure_ascii=False)}\n"
+                    parts.append(f"ACTIONS: {_json_dumps(actions)}")
+                parts.append("")
                 
                 # Store the full object in metadata as a JSON string
                 d_copy = d.copy()
-                d_copy['text'] = text_repr
+                d_copy['text'] = "\n".join(parts)
                 d_copy['is_experience'] = 'true'
-                d_copy['experience_json'] = json.dumps(d, ensure_ascii=False)
-                processed_docs.append(d_copy)
+                d_copy['experience_json'] = _json_dumps(d)
             else:
                 # Standard doc
-                processed_docs.append(d)
+                d_copy = d.copy()
 
-        prepared = prepare_documents(processed_docs, max_chars=chunk_chars, overlap=overlap)
-        texts = [d["text"] for d in prepared]
+            doc_id = d_copy.get('id') or _stable_doc_id(d_copy.get('source', 'unknown'), d_copy.get('text', ''))
+            if doc_id in self._doc_ids or doc_id in batch_ids:
+                # Already ingested: skip extraction and re-embedding
+                continue
+            batch_ids.add(doc_id)
+            d_copy['doc_id'] = doc_id
+            processed_docs.append(d_copy)
+
+        if not processed_docs:
+            return 0
+
+        texts, metas = self._prepare_docs(processed_docs, chunk_chars, overlap)
         
         # Extract relations to Knowledge Graph (if available)
-        if self.relation_extractor:
-            for d in processed_docs:
+        extractor = self.relation_extractor
+        if extractor:
+            def _extract(d):
                 try:
                     if 'sensory_data' in d or 'action_plan' in d:
                         # Experience Object - extract rich relations
-                        self.relation_extractor.extract_from_experience_object(d)
+                        extractor.extract_from_experience_object(d)
                     elif 'text' in d:
                         # Standard document - extract relations from text
                         source = d.get('source', 'unknown')
-                        doc_id = d.get('id') or f"{source}_{hash(d.get('text', '')) % 1000000}"
-                        self.relation_extractor.extract_from_text(d.get('text', ''), source, doc_id)
+                        extractor.extract_from_text(d.get('text', ''), source, d['doc_id'])
                 except Exception as e:
                     logger.warning(f"Error extracting relations: {e}")
+
+            # Each extraction is usually an LLM round-trip, so overlap them.
+            # A local llama.cpp model is not thread-safe: keep it serial.
+            workers = 1 if self.llm.mode_name == "local" else min(REL_EXTRACT_WORKERS, len(processed_docs))
+            # All KG writes of this ingest share one connection and commit
+            with extractor.kg.batch():
+                if workers > 1:
+                    with ThreadPoolExecutor(max_workers=workers) as pool:
+                        list(pool.map(_extract, processed_docs))
+                else:
+                    for d in processed_docs:
+                        _extract(d)
+            self._kg_cache.clear()
         
-        # For TF-IDF, fitting incrementally is required. For pre-trained models (sentence-transformers)
-        # fitting is unnecessary and expensive; skip it.
-        try:
-            if getattr(self.embedder, "backend_name", None) == "tfidf":
-                corpus_for_fit = [*self._corpus_texts, *texts]
-                if corpus_for_fit:
-                    self.embedder.fit_corpus(corpus_for_fit)
-        except Exception:
-            logger.exception("Error fitting embedder corpus during ingest_raw; continuing with encode.")
+        return self._flush(texts, metas)
+
+    def _encode_texts(self, texts: List[str]):
+        """Encode corpus texts, reusing cached vectors and embedding only misses."""
+        cache = self._embedding_cache
+        if cache is None or not texts:
+            return _coerce(self._embed_batched(texts))
+
+        keys = [cache.key(t) for t in texts]
+        vectors = cache.get_many(keys)
+        miss_idx = [i for i, k in enumerate(keys) if k not in vectors]
+        if miss_idx:
+            fresh = np.asarray(self._embed_batched([texts[i] for i in miss_idx]), dtype=np.float32)
+            new_pairs = [(keys[i], row) for i, row in zip(miss_idx, fresh)]
+            cache.put_many(new_pairs)
+            vectors.update(new_pairs)
+        logger.debug(f"Embedding cache: {len(texts) - len(miss_idx)} hits, {len(miss_idx)} misses")
+        return _coerce(np.vstack([vectors[k] for k in keys]))
+
+    def _render_history(self) -> str:
+        """Render the memory window as prompt lines, formatting only new messages.
+
+        Old messages never change, so their lines are kept between turns and
+        only dropped once the memory trims them.
+        """
+        with self._hist_lock:
+            messages = self.memory.get()
+            version = getattr(self.memory, "version", None)
+            lines = self._hist_lines
+            new = version - self._hist_version if version is not None else -1
+            if 0 <= new <= len(messages) and len(lines) + new >= len(messages):
+                if new:
+                    lines.extend(_history_line(m) for m in messages[len(messages) - new:])
+                del lines[:len(lines) - len(messages)]
+            else:
+                lines[:] = [_history_line(m) for m in messages]
+            self._hist_version = version or 0
+            return "\n".join(lines).strip()
 
-        try:
-            X = self.embedder.encode_texts(texts)
-        except Exception:
-            logger.exception("Error encoding texts during ingest_raw")
-            raise
-            
-        metas = [{k: v for k, v in d.items() if k != "text"} for d in prepared]
-        self.store.add(embeddings=X, metas=metas)
-        self._corpus_texts.extend(texts)
-        self._corpus_metas.extend(metas)
-        if self._storage_dir:
-            self.save_index(self._storage_dir)
-        return len(prepared)
+    def _summarize_history(self, memory_text: str) -> str:
+        """Summarize the rendered history, reusing the previous summary when possible.
 
-    def retrieve(self, query: str, top_k: int = 4) -> List[Dict[str, str]]:
-        cache_key = f"{query}::{top_k}"
-        if cache_key in self._retrieve_cache:
-            return self._retrieve_cache[cache_key]
+        Messages added since the last summary are appended verbatim until
+        they reach HISTORY_RESUMMARIZE_CHARS; only then is the LLM asked again.
+        """
+        version = getattr(self.memory, "version", None)
+        cached = self._history_summary
+        if version is not None and cached is not None:
+            summary_version, summary = cached
+            new = version - summary_version
+            with self._hist_lock:
+                tail_lines = self._hist_lines[len(self._hist_lines) - new:] if new else []
+                aligned = self._hist_version == version and 0 <= new <= len(self._hist_lines)
+            if aligned:
+                tail = "\n".join(tail_lines)
+                if len(tail) < HISTORY_RESUMMARIZE_CHARS:
+                    return f"Resumen del historial:\n{summary}" + (f"\n{tail}" if tail else "")
+        summary = self.llm.summarize(memory_text, max_chars=700)
+        if version is not None:
+            self._history_summary = (version, summary)
+        return f"Resumen del historial:\n{summary}"
+
+    def _encode_query_normed(self, text: str):
+        """Encode one text as a unit-length float32 vector, so cosine is a plain dot product."""
+        raw = self.embedder.encode_query(text)
+        vec = _coerce(raw)
+        norm = np.linalg.norm(vec) + 1e-12
+        if isinstance(raw, np.ndarray) and np.may_share_memory(vec, raw):
+            # float32 output is used as-is: don't scale the backend's array
+            return vec / norm
+        # _coerce already made a private float32 copy; scale it in place
+        vec /= norm
+        return vec
+
+    def _find_solution_paths(self, question: str, max_depth: int = 3) -> List[Dict[str, Any]]:
+        key = (_NON_WORD_RE.sub(" ", question.lower()).strip(), max_depth)
+        paths = self._kg_cache.get(key)
+        if paths is None:
+            paths = self.knowledge_graph.find_solution_path(question, max_depth=max_depth)
+            self._kg_cache[key] = paths
+        return paths
+
+    def _invalidate_caches(self) -> None:
+        """Drop memoized query embeddings and results after the corpus changes.
+
+        TF-IDF refits on ingest, so even cached query vectors go stale.
+        """
+        self._encode_query_cached.cache_clear()
+        with self._retrieve_lock:
+            self._retrieve_cache.clear()
+
+    def _index_texts(self, texts: List[str], metas: List[Dict[str, str]]) -> None:
+        for text, meta in zip(texts, metas):
+            # setdefault keeps the first chunk on duplicate ids, as the old scan did
+            self._id_to_text.setdefault(meta.get("id"), text)
+            doc_id = meta.get("doc_id")
+            if doc_id:
+                self._doc_ids.add(doc_id)
+
+    def _embed_batched(self, texts: List[str]):
+        """Call the backend in EMBED_BATCH_SIZE slices and stack the results."""
+        if np is None or len(texts) <= EMBED_BATCH_SIZE:
+            return self.embedder.encode_texts(texts)
+        return np.vstack([
+            np.asarray(self.embedder.encode_texts(batch))
+            for batch in _batched(texts, EMBED_BATCH_SIZE)
+        ])
 
-        q = self.embedder.encode_query(query)
+    def retrieve(self, query: str, top_k: int = 4) -> List[Dict[str, str]]:
+        cache_key = (query, top_k)
+        with self._retrieve_lock:
+            cached = self._retrieve_cache.get(cache_key)
+            if cached is not None:
+                self._retrieve_cache.move_to_end(cache_key)
+        if cached is not None:
+            # Copies: callers may modify results without corrupting the cache
+            return [dict(item) for item in cached]
+
+        q = self._encode_query_cached(query)
         results = self.store.search(q, top_k=top_k)
         enriched: List[Dict[str, str]] = []
         for meta, score in results:
-            # Find corresponding text by id
-            text = ""
-            try:
-                # id is source::chunk_i; find first match
-                idx = next(i for i, m in enumerate(self._corpus_metas) if m.get("id") == meta.get("id"))
-                text = self._corpus_texts[idx]
-            except StopIteration:
-                text = ""
+            text = self._id_to_text.get(meta.get("id"), "")
             enriched.append({
                 **meta,
                 "score": f"{score:.4f}",
                 "text": text,
             })
         
-        # Update cache
-        if len(self._retrieve_cache) > self._cache_max_size:
-            self._retrieve_cache.pop(next(iter(self._retrieve_cache)))
-        self._retrieve_cache[cache_key] = enriched
+        # Update cache, evicting the least recently used entry
+        with self._retrieve_lock:
+            self._retrieve_cache[cache_key] = [dict(item) for item in enriched]
+            self._retrieve_cache.move_to_end(cache_key)
+            while len(self._retrieve_cache) > self._cache_max_size:
+                self._retrieve_cache.popitem(last=False)
         
         return enriched
 
+    def _get_reranker(self):
+        if self._reranker is None and self._reranker_model:
+            try:
+                self._reranker = _load_cross_encoder(self._reranker_model)
+            except Exception:
+                logger.exception(f"Failed to load reranker {self._reranker_model}; using dense ranking only.")
+                self._reranker_model = None
+        return self._reranker
+
+    def _kg_context(self, question: str) -> str:
+        """Knowledge Graph context for the prompt (inspired by "The Reality Weaver")."""
+        kg_context = ""
+        try:
+            # Try to find solution paths for problem-like questions
+            solution_paths = self._find_solution_paths(question, max_depth=3)
+            if solution_paths:
+                kg_lines = ["CAMINOS DE SOLUCIÓN ENCONTRADOS:"]
+                for i, path in enumerate(solution_paths[:2], 1):  # Top 2 paths
+                    kg_lines.append(f"\nCamino {i}:")
+                    for step in path.get("path", []):
+                        node_info = step.get("node", {})
+                        relation = step.get("relation", "")
+                        kg_lines.append(f"  {relation.upper()}: {node_info.get('label', '')} - {node_info.get('description', '')[:100]}")
+                kg_context = "\n".join(kg_lines)
+                logger.info(f"Found {len(solution_paths)} solution paths in Knowledge Graph")
+            
+            # Also find related nodes
+            problem_nodes = self.knowledge_graph.find_nodes(question, node_type="problem", limit=3)
+            if problem_nodes:
+                related_info = []
+                related_by_id = self.knowledge_graph.get_related_nodes_batch(
+                    [node.id for node in problem_nodes], direction="out"
+                )
+                for node in problem_nodes:
+                    related = related_by_id.get(node.id)
+                    if related:
+                        related_info.append(f"Problema: {node.label}")
+                        for target_node, edge in related[:3]:
+                            related_info.append(f"  → {edge.relation_type}: {target_node.label}")
+                if related_info:
+                    kg_context += "\n\nRELACIONES ENCONTRADAS:\n" + "\n".join(related_info)
+        except Exception as e:
+            logger.warning(f"Error using Knowledge Graph: {e}")
+        return kg_context
+
+    def _retrieve_reranked(self, query: str, top_k: int = 4) -> List[Dict[str, str]]:
+        """Retrieve an oversampled candidate set and keep the cross-encoder's top_k.
+
+        Without a configured reranker this is plain :meth:`retrieve`.
+        """
+        reranker = self._get_reranker()
+        if reranker is None:
+            return self.retrieve(query, top_k=top_k)
+        candidates = [c for c in self.retrieve(query, top_k=top_k * RERANK_OVERSAMPLE) if c.get("text")]
+        if len(candidates) <= 1:
+            return candidates[:top_k]
+        try:
+            # One predict call scores every pair in a single batched pass
+            scores = np.asarray(reranker.predict(
+                [(query, c["text"]) for c in candidates], batch_size=len(candidates)
+            ))
+        except Exception:
+            logger.exception("Reranking failed; using dense ranking.")
+            return candidates[:top_k]
+        order = np.argsort(-scores, kind="stable")[:top_k]
+        return [{**candidates[i], "rerank_score": f"{scores[i]:.4f}"} for i in order]
+
     def ask(self, question: str, top_k: int = 4, tone: str | None = None, prefs: Dict[str, str] | None = None, stream: bool = False, conversation_id: Optional[int] = None) -> Union[Dict[str, object], Tuple[Iterator[str], List[Dict[str, str]]]]:
         # Determine previous user message (if any) BEFORE recording current question
         try:
@@ -544,7 +1228,7 @@ class Brain:
 
         # --- ADVANCED INTELLIGENCE START ---
         # 1. Detect if a tool is needed
-        tool_needed = self.tool_system.detect_tool(question, self.llm)
+        tool_needed = self._detect_tool_cached(question.lower())
         if tool_needed:
             logger.info(f"Tool detected: {tool_needed}")
             tool_result = self.tool_system.use_tool(tool_needed, question, self.llm)
@@ -556,13 +1240,8 @@ class Brain:
                 answer = tool_result
                 # Save to memory
                 try:
-                    if hasattr(self.enhanced_memory, 'add'):
-                        self.enhanced_memory.add("user", question, conversation_id=conversation_id)
-                        self.enhanced_memory.add("assistant", answer, 
-                                               metadata={'tool_used': tool_needed},
-                                               conversation_id=conversation_id)
-                    else:
-                        self.memory.add("assistant", answer)
+                    self._remember(question, answer, conversation_id,
+                                   answer_metadata={'tool_used': tool_needed})
                 except Exception as e:
                     logger.warning(f"Failed to save direct answer to memory: {e}")
                 
@@ -590,13 +1269,8 @@ class Brain:
                 
                 # Save to memory
                 try:
-                    if hasattr(self.enhanced_memory, 'add'):
-                        self.enhanced_memory.add("user", question, conversation_id=conversation_id)
-                        self.enhanced_memory.add("assistant", answer, 
-                                               metadata={'tool_used': tool_needed, 'tool_output': tool_result[:500]},
-                                               conversation_id=conversation_id)
-                    else:
-                        self.memory.add("assistant", answer)
+                    self._remember(question, answer, conversation_id,
+                                   answer_metadata={'tool_used': tool_needed, 'tool_output': tool_result[:500]})
                 except Exception as e:
                     logger.warning(f"Failed to save tool synthesis to memory: {e}")
 
@@ -608,8 +1282,7 @@ class Brain:
 
         # 2. Detect if complex reasoning (CoT) is needed
         # Simple heuristic: "paso a paso", "explícame cómo", "resuelve", complex math/logic
-        is_complex = any(kw in question.lower() for kw in 
-                        ['paso a paso', 'step by step', 'analiza', 'resuelve', 'complejo', 'razona'])
+        is_complex = bool(_COT_RE.search(question))
         
         if is_complex and not stream: # CoT works best in non-streaming mode for now
             logger.info("Complex reasoning detected, using CoT")
@@ -619,13 +1292,8 @@ class Brain:
             
             # Save to memory with reasoning metadata
             try:
-                if hasattr(self.enhanced_memory, 'add'):
-                    self.enhanced_memory.add("user", question, conversation_id=conversation_id)
-                    self.enhanced_memory.add("assistant", answer, 
-                                           metadata={'reasoning': full_reasoning, 'is_cot': True},
-                                           conversation_id=conversation_id)
-                else:
-                    self.memory.add("assistant", answer)
+                self._remember(question, answer, conversation_id,
+                               answer_metadata={'reasoning': full_reasoning, 'is_cot': True})
             except Exception as e:
                 logger.warning(f"Failed to save CoT answer to memory: {e}")
                 
@@ -636,49 +1304,11 @@ class Brain:
             }
         # --- ADVANCED INTELLIGENCE END ---
 
-        # Use Knowledge Graph to enhance retrieval (inspired by "The Reality Weaver")
-        kg_context = ""
-        if self.knowledge_graph:
-            try:
-                # Try to find solution paths for problem-like questions
-                solution_paths = self.knowledge_graph.find_solution_path(question, max_depth=3)
-                if solution_paths:
-                    kg_lines = ["CAMINOS DE SOLUCIÓN ENCONTRADOS:"]
-                    for i, path in enumerate(solution_paths[:2], 1):  # Top 2 paths
-                        kg_lines.append(f"\nCamino {i}:")
-                        for step in path.get("path", []):
-                            node_info = step.get("node", {})
-                            relation = step.get("relation", "")
-                            kg_lines.append(f"  {relation.upper()}: {node_info.get('label', '')} - {node_info.get('description', '')[:100]}")
-                    kg_context = "\n".join(kg_lines)
-                    logger.info(f"Found {len(solution_paths)} solution paths in Knowledge Graph")
-                
-                # Also find related nodes
-                problem_nodes = self.knowledge_graph.find_nodes(question, node_type="problem", limit=3)
-                if problem_nodes:
-                    related_info = []
-                    for node in problem_nodes:
-                        related = self.knowledge_graph.get_related_nodes(node.id, direction="out")
-                        if related:
-                            related_info.append(f"Problema: {node.label}")
-                            for target_node, edge in related[:3]:
-                                related_info.append(f"  → {edge.relation_type}: {target_node.label}")
-                    if related_info:
-                        kg_context += "\n\nRELACIONES ENCONTRADAS:\n" + "\n".join(related_info)
-            except Exception as e:
-                logger.warning(f"Error using Knowledge Graph: {e}")
-
-        # We'll record the current user message into memory after we produce the answer
-        retrieved = self.retrieve(question, top_k=top_k)
         # Small-talk / greetings handler
         if self._is_smalltalk(question):
             answer = self._smalltalk_answer(question)
             try:
-                if hasattr(self.enhanced_memory, 'add'):
-                    self.enhanced_memory.add("user", question, conversation_id=conversation_id)
-                    self.enhanced_memory.add("assistant", answer, conversation_id=conversation_id)
-                else:
-                    self.memory.add("assistant", answer)
+                self._remember(question, answer, conversation_id)
             except Exception as e:
                 logger.warning(f"Failed to save smalltalk answer to memory: {e}")
             if stream:
@@ -690,11 +1320,7 @@ class Brain:
         if self._is_datetime_query(question):
             answer = self._datetime_answer()
             try:
-                if hasattr(self.enhanced_memory, 'add'):
-                    self.enhanced_memory.add("user", question, conversation_id=conversation_id)
-                    self.enhanced_memory.add("assistant", answer, conversation_id=conversation_id)
-                else:
-                    self.memory.add("assistant", answer)
+                self._remember(question, answer, conversation_id)
             except Exception as e:
                 logger.warning(f"Failed to save datetime answer to memory: {e}")
             if stream:
@@ -706,8 +1332,10 @@ class Brain:
         if not self._corpus_texts:
             answer = "Aún no tengo información indexada. Usa 'Agregar texto' para cargar contenido y preguntar sobre eso."
             try:
-                self.memory.add("user", question)
-                self.memory.add("assistant", answer)
+                self.memory.add_many([
+                    {"role": "user", "content": question},
+                    {"role": "assistant", "content": answer},
+                ])
             except Exception as e:
                 logger.warning(f"Failed to save no corpus answer to memory: {e}")
             if stream:
@@ -715,24 +1343,15 @@ class Brain:
                     yield answer
                 return _gen_no_corpus(), []
             return {"answer": answer, "references": [], "projection": None}
-        context = "\n\n".join([r.get("text", "") for r in retrieved if r.get("text")])
+        # The KG lookup is independent of retrieval: run it in the background
+        # and collect it when the prompt is built.
+        kg_future = self._ask_pool.submit(self._kg_context, question) if self.knowledge_graph else None
+        # We'll record the current user message into memory after we produce the answer
+        retrieved = self._retrieve_reranked(question, top_k=top_k)
+        context, references_text = _context_and_references(retrieved)
         # Build conversational history from memory (exclude current question) and inject into prompt so the LLM has context
         try:
-            mem_messages = self.memory.get()
-            history_lines: List[str] = []
-            for m in mem_messages:
-                role = (m.get("role") or "").lower()
-                content = m.get("content") or ""
-                if role in ("user", "usuario"):
-                    history_lines.append(f"Usuario: {content}")
-                elif role in ("assistant", "asistente"):
-                    history_lines.append(f"Asistente: {content}")
-                elif role == "system":
-                    history_lines.append(f"Sistema: {content}")
-                else:
-                    # generic
-                    history_lines.append(f"{role.capitalize()}: {content}")
-            memory_text = "\n".join(history_lines).strip()
+            memory_text = self._render_history()
         except Exception:
             logger.exception("Failed to build memory history; continuing without it")
             memory_text = ""
@@ -743,27 +1362,18 @@ class Brain:
             or a simple token-overlap fallback."""
             if not a or not b:
                 return True, 1.0
+            # Repeated or very short follow-ups ("¿y eso?") count as related;
+            # embedding similarity is unreliable on a couple of words anyway.
+            if a == b or len(b.strip()) < COHERENCE_MIN_CHARS:
+                return True, 1.0
             try:
-                # Try embeddings-based similarity
-                vecs = self.embedder.encode_texts([a, b])
-                # attempt numpy operations if available
-                try:
-                    import numpy as _np
-                    v0 = _np.asarray(vecs[0], dtype=_np.float32)
-                    v1 = _np.asarray(vecs[1], dtype=_np.float32)
-                    denom = (_np.linalg.norm(v0) * _np.linalg.norm(v1)) + 1e-8
-                    sim = float(float(_np.dot(v0, v1)) / denom)
-                except Exception as e:
-                    logger.warning(f"Failed embeddings-based similarity calculation; falling back: {e}")
-                    # vecs may be plain python lists
-                    v0 = list(vecs[0])
-                    v1 = list(vecs[1])
-                    dot = sum(x * y for x, y in zip(v0, v1))
-                    import math
-                    norm0 = math.sqrt(sum(x * x for x in v0))
-                    norm1 = math.sqrt(sum(x * x for x in v1))
-                    denom = (norm0 * norm1) + 1e-8
-                    sim = float(dot / denom)
+                # Try embeddings-based similarity. Retrieval has already encoded
+                # `b`, and `a` (normally last turn's question) is usually still
+                # memoized, so this rarely calls the model.
+                v0 = self._encode_query_cached(a)
+                v1 = self._encode_query_cached(b)
+                # unit vectors: cosine is just the dot product
+                sim = float(v0 @ v1)
                 # clamp
                 sim = max(min(sim, 1.0), -1.0)
                 return (sim >= 0.30, sim)
@@ -771,16 +1381,13 @@ class Brain:
                 logger.warning(f"Failed token-Jaccard similarity calculation; falling back: {e}")
                 # fallback: simple token-Jaccard
                 try:
-                    import re
-                    def tokens(s: str):
-                        return set(re.findall(r"[a-zA-ZáéíóúñÁÉÍÓÚÑ0-9]+", (s or "").lower()))
-                    t0 = tokens(a)
-                    t1 = tokens(b)
-                    if not t0 or not t1:
+                    s0 = _token_signature(a)
+                    s1 = _token_signature(b)
+                    if not s0 or not s1:
                         return True, 0.0
-                    inter = t0 & t1
-                    union = t0 | t1
-                    j = len(inter) / (len(union) + 1e-9)
+                    inter = bin(s0 & s1).count("1")
+                    union = bin(s0 | s1).count("1")
+                    j = inter / (union + 1e-9)
                     return (j >= 0.20, float(j))
                 except Exception:
                     return True, 0.0
@@ -798,7 +1405,6 @@ class Brain:
             wiki = fetch_wikipedia_answer(question, lang="es")
             if wiki and wiki.get("extract"):
                 wiki_used = True
-                context = wiki.get("extract", "")
                 # also add as a reference
                 retrieved = [{
                     'id': f"wikipedia::{wiki.get('title','')}",
@@ -808,6 +1414,7 @@ class Brain:
                     'score': '1.0000',
                     'url': wiki.get('url','')
                 }]
+                context, references_text = _context_and_references(retrieved)
                 # learn: ingest the extract into vector store so future queries retrieve it locally
                 try:
                     self.ingest_raw([
@@ -832,16 +1439,12 @@ class Brain:
             except Exception as e:
                 logger.warning(f"Failed to process user preferences: {e}")
 
-        system = (
-            "Eres un asistente útil. Usa estrictamente el CONTEXTO para responder. "
-            "Si la respuesta no está en el contexto, responde: 'No encontré esa información'. "
-            + tone_text + extra_prefs
-        )
+        system = _RAG_SYSTEM_PROMPT + tone_text + extra_prefs
         # If memory is long, attempt to summarize it with LLM to keep prompt concise
-        if memory_text and len(memory_text) > 1200:
+        # (not needed when the history is dropped below anyway)
+        if memory_text and len(memory_text) > 1200 and not coherence_note:
             try:
-                summary = self.llm.summarize(memory_text, max_chars=700)
-                memory_text = f"Resumen del historial:\n{summary}"
+                memory_text = self._summarize_history(memory_text)
             except Exception:
                 logger.exception("Memory summarization failed; using full memory_text")
 
@@ -850,36 +1453,16 @@ class Brain:
             # omit memory_text to avoid confusing the LLM with irrelevant history
             memory_text = ""
 
-        # Build references list (numbered) for the LLM to cite
-        references_text = ""
-        if retrieved:
-            ref_lines: List[str] = []
-            for i, r in enumerate(retrieved, start=1):
-                src = r.get("source") or r.get("id") or ""
-                url = r.get("url") or r.get("source_url") or ""
-                ref_lines.append(f"[{i}] {src}" + (f" - {url}" if url else ""))
-            references_text = "\n".join(ref_lines)
-
-        # Compose final prompt: relevant memory (if any) -> history (if any) -> context -> references -> question
-        prompt_parts: List[str] = []
-        
-        # Add relevant long-term memory context if available
-        if relevant_memory_context:
-            prompt_parts.append(f"MEMORIA RELEVANTE (conversaciones pasadas):\n{relevant_memory_context}")
-        
-        if memory_text:
-            prompt_parts.append(f"HISTORIAL RECIENTE:\n{memory_text}")
-        
         # Add Knowledge Graph context if available (inspired by "The Reality Weaver")
-        if kg_context:
-            prompt_parts.append(f"GRAFO DE CONOCIMIENTO (relaciones causales):\n{kg_context}")
-        
-        prompt_parts.append(f"CONTEXTO:\n{context}")
-        if references_text:
-            prompt_parts.append(f"REFERENCIAS:\n{references_text}")
-        prompt_parts.append(f"PREGUNTA:\n{question}")
-        prompt_parts.append("Responde de forma breve y precisa en español. Cita las referencias usando [n] si aplican.")
-        prompt = "\n\n".join(prompt_parts)
+        kg_context = kg_future.result() if kg_future is not None else ""
+        prompt = _build_prompt({
+            "relevant_memory": relevant_memory_context,
+            "history": memory_text,
+            "kg": kg_context,
+            "context": context,
+            "references": references_text,
+            "question": question,
+        })
 
         if self.llm.mode_name in ("openai", "huggingface", "ollama", "local"):
             try:
@@ -904,37 +1487,8 @@ class Brain:
                         finally:
                             # Save to memory after streaming completes
                             try:
-                                full_answer = "".join(collected)
-                                
-                                if hasattr(self.enhanced_memory, 'add'):
-                                    # Calculate importance
-                                    importance = 0.5
-                                    if len(question) > 100:
-                                        importance += 0.1
-                                    
-                                    self.enhanced_memory.add(
-                                        "user", 
-                                        question, 
-                                        conversation_id=conversation_id,
-                                        importance=min(importance, 1.0)
-                                    )
-                                    
-                                    final_answer = full_answer
-                                    if coherence_note:
-                                        final_answer = f"Nota: tu pregunta no parece relacionada con la anterior. {full_answer}"
-                                    
-                                    self.enhanced_memory.add(
-                                        "assistant", 
-                                        final_answer,
-                                        metadata={'streaming': True},
-                                        conversation_id=conversation_id,
-                                        importance=0.6
-                                    )
-                                else:
-                                    self.memory.add("user", question)
-                                    if coherence_note:
-                                        full_answer = f"Nota: tu pregunta no parece relacionada con la anterior. {full_answer}"
-                                    self.memory.add("assistant", full_answer)
+                                self._save_turn(question, "".join(collected), conversation_id,
+                                                coherence_note, {'streaming': True})
                             except Exception:
                                 logger.exception("Failed to save streaming conversation to memory")
                     
@@ -956,156 +1510,130 @@ class Brain:
                 if a_norm.startswith("(fallback)") or len(a_norm) < 20:
                     logger.info("LLM produced fallback/short output; using extractive fallback")
                     answer = self._extractive_answer(question, retrieved)
-                # if LLM accidentally echoed the prompt (long substring present), fallback
-                elif len(prompt) > 0 and a_norm and (a_norm in prompt or prompt[:80] in a_norm):
+                # if LLM accidentally echoed the prompt, fallback. Echoes start at (or
+                # just after) the prompt's beginning, so only bounded prefixes are compared.
+                elif len(prompt) > 0 and a_norm and (prompt.startswith(a_norm[:200]) or prompt[:80] in a_norm[:400]):
                     logger.info("LLM echoed prompt; using extractive fallback")
                     answer = self._extractive_answer(question, retrieved)
         except Exception:
             logger.exception("Failed to validate LLM output; using it as-is")
         # Ensure we record the user's question and the assistant answer in memory
         try:
-            # Before saving to memory, attempt to record the run in LangSmith (if configured)
-            try:
-                if getattr(self.llm, '_langsmith_key', None):
-                    try:
-                        import uuid
-                        rs = None
-                        import langsmith  # type: ignore
-                        Client = getattr(langsmith, 'Client', None)
-                        if Client:
-                            client = Client(api_key=getattr(self.llm, '_langsmith_key'))
-                            run_id = str(uuid.uuid4())
-                            # Build a compact inputs/outputs object
-                            inputs = {
-                                'question': question,
-                                'context_snippet': (context[:1000] + '...') if context else '',
-                            }
-                            outputs = {
-                                'answer': answer if isinstance(answer, str) else str(answer)
-                            }
-                            try:
-                                client.create_run(id=run_id, name=f"chat-run-{run_id[:8]}", inputs=inputs, outputs=outputs, run_type='llm')
-                                try:
-                                    # try to obtain a human-friendly URL for the run; may not be supported
-                                    if hasattr(client, 'get_run_url'):
-                                        rs = client.get_run_url(run_id)
-                                except Exception:
-                                    rs = None
-                                # attach reference url to answer metadata by injecting a short note (not to memory content)
-                                if rs:
-                                    # store run url in a lightweight place in the returned references
-                                    if isinstance(retrieved, list):
-                                        retrieved.insert(0, {'id': f'langsmith://{run_id}', 'source': 'LangSmith', 'url': rs, 'score': '1.0000', 'text': ''})
-                            except Exception:
-                                logger.exception("Failed to create LangSmith run")
-                    except Exception:
-                        logger.debug("LangSmith instrumentation skipped (init failed)", exc_info=True)
-            except Exception:
-                logger.exception("Unexpected error while trying to record run in LangSmith")
+            # Record the run in LangSmith (if configured) without delaying the answer
+            api_key = getattr(self.llm, '_langsmith_key', None)
+            if api_key:
+                threading.Thread(
+                    target=_record_langsmith_run,
+                    args=(api_key, question, context, answer if isinstance(answer, str) else str(answer)),
+                    daemon=True,
+                ).start()
 
             # Save to enhanced memory with metadata
             try:
-                if hasattr(self.enhanced_memory, 'add'):
-                    # Calculate importance based on question complexity
-                    importance = 0.5
-                    if len(question) > 100:
-                        importance += 0.1
-                    if any(kw in question.lower() for kw in ['importante', 'recordar', 'siempre', 'preferencia']):
-                        importance += 0.2
-                    
-                    self.enhanced_memory.add(
-                        "user", 
-                        question, 
-                        conversation_id=conversation_id,
-                        importance=min(importance, 1.0)
-                    )
-                    
-                    # If coherence_note, prepend a short human-friendly note to the assistant's reply
-                    final_answer = answer
-                    if coherence_note:
-                        final_answer = f"Nota: tu pregunta no parece relacionada con la anterior. {answer}"
-                    
-                    self.enhanced_memory.add(
-                        "assistant", 
-                        final_answer,
-                        metadata={
-                            'has_references': len(retrieved) > 0,
-                            'wiki_used': wiki_used,
-                            'num_references': len(retrieved)
-                        },
-                        conversation_id=conversation_id,
-                        importance=0.6  # Assistant responses slightly more important
-                    )
-                else:
-                    # Fallback to old memory
-                    self.memory.add("user", question)
-                    if coherence_note:
-                        answer = f"Nota: tu pregunta no parece relacionada con la anterior. {answer}"
-                    self.memory.add("assistant", answer)
+                self._save_turn(question, answer, conversation_id, coherence_note, {
+                    'has_references': len(retrieved) > 0,
+                    'wiki_used': wiki_used,
+                    'num_references': len(retrieved)
+                })
             except Exception:
                 logger.exception("Failed to save conversation to memory")
         except Exception:
             logger.exception("Failed to save conversation to memory")
 
-        # Check for Experience Objects in retrieved docs to return as "projection"
-        projection = None
-        for r in retrieved:
-            if r.get('is_experience') == 'true' and r.get('experience_json'):
-                try:
-                    projection = json.loads(r.get('experience_json'))
-                    # Only return the top relevant projection
-                    break
-                except Exception as e:
-                    logger.debug(f"Error loading experience JSON: {e}")
-
         return {
             "answer": answer,
             "references": retrieved,
-            "projection": projection
+            "projection": _first_projection(retrieved)
         }
 
+    def _remember(self, question: str, answer: str, conversation_id: Optional[int] = None,
+                  question_importance: float = 0.5, answer_metadata: Optional[Dict[str, Any]] = None,
+                  answer_importance: float = 0.5) -> None:
+        """Store a question/answer exchange with a single memory write."""
+        self.enhanced_memory.add_many([
+            {"role": "user", "content": question, "conversation_id": conversation_id,
+             "importance": question_importance},
+            {"role": "assistant", "content": answer, "metadata": answer_metadata,
+             "conversation_id": conversation_id, "importance": answer_importance},
+        ])
+
+    def _save_turn(self, question: str, answer: str, conversation_id: Optional[int] = None,
+                   coherence_note: str = "", metadata: Optional[Dict[str, Any]] = None) -> None:
+        """Store an answered RAG turn, shared by the streaming and non-streaming paths."""
+        # Calculate importance based on question complexity
+        importance = 0.5
+        if len(question) > 100:
+            importance += 0.1
+        if _IMPORTANT_RE.search(question):
+            importance += 0.2
+        # If coherence_note, prepend a short human-friendly note to the assistant's reply
+        if coherence_note:
+            answer = f"Nota: tu pregunta no parece relacionada con la anterior. {answer}"
+        self._remember(
+            question, answer, conversation_id,
+            question_importance=min(importance, 1.0),
+            answer_metadata=metadata,
+            answer_importance=0.6  # Assistant responses slightly more important
+        )
+
+    async def aask(self, question: str, **kwargs: Any) -> Union[Dict[str, object], Tuple[Iterator[str], List[Dict[str, str]]]]:
+        """Run :meth:`ask` in a worker thread so several questions can be
+        awaited together (e.g. with ``asyncio.gather``) without blocking the loop.
+        """
+        return await asyncio.to_thread(self.ask, question, **kwargs)
+
     def _extractive_answer(self, question: str, contexts: List[Dict[str, str]]) -> str:
         """Build a concise answer by selecting the most relevant sentences from retrieved contexts.
 
         This is a lightweight heuristic fallback when no LLM is available.
         """
-        import re
-        from collections import Counter
-
-        def normalize(text: str) -> List[str]:
-            tokens = re.findall(r"[a-zA-ZáéíóúñÁÉÍÓÚÑ0-9]+", text.lower())
-            stop = {
-                'el','la','los','las','un','una','unos','unas','de','del','a','y','o','u','en','con','por','para','es','son','al','se','su','sus','que','qué','como','cómo','cuando','cuándo','donde','dónde','si','sí','no','lo','le','les','ya','más','menos','muy','esto','esta','estas','estos','ese','esa','eso','esas','esos','también','pero','porque','sobre','entre'
-            }
-            return [t for t in tokens if t not in stop and len(t) > 1]
-
-        q_terms = set(normalize(question))
+        q_terms = set(_content_terms(question))
         if not q_terms:
             return "No encontré esa información."
 
-        candidate_sentences: List[tuple[float, str]] = []
-        for r in contexts:
-            text = r.get('text', '') or ''
-            # split into sentences
-            sentences = re.split(r"(?<=[\.\!\?])\s+", text)
-            for s in sentences:
-                terms = set(normalize(s))
-                if not terms:
-                    continue
+        # split into sentences
+        sentences = [
+            s.strip()
+            for r in contexts
+            for s in _SENT_RE.split(r.get('text', '') or '')
+        ]
+        # Sentence indices with some overlap, best score first (ties keep text order)
+        try:
+            from sklearn.feature_extraction.text import CountVectorizer  # type: ignore
+        except ImportError:
+            CountVectorizer = None
+        if CountVectorizer is not None:
+            # Binary sentence x term matrix: overlap with the question is one
+            # sparse mat-vec product instead of a set intersection per sentence.
+            vectorizer = CountVectorizer(analyzer=_content_terms, binary=True)
+            try:
+                M = vectorizer.fit_transform(sentences)
+            except ValueError:  # no sentence has a content term
+                return "No encontré esa información."
+            overlap = (M @ vectorizer.transform([question]).T).toarray().ravel()
+            n_terms = np.asarray(M.sum(axis=1)).ravel()
+            candidates = np.flatnonzero(overlap)
+            scores = overlap[candidates] / (len(q_terms) ** 0.5 * np.sqrt(n_terms[candidates]))
+            ranked = candidates[np.argsort(-scores, kind="stable")].tolist()
+        else:
+            scored: List[tuple[float, int]] = []
+            for i, s in enumerate(sentences):
+                terms = set(_content_terms(s))
                 overlap = len(q_terms & terms)
                 if overlap == 0:
                     continue
-                score = overlap / (len(q_terms) ** 0.5 * len(terms) ** 0.5)
-                candidate_sentences.append((score, s.strip()))
+                scored.append((overlap / (len(q_terms) ** 0.5 * len(terms) ** 0.5), i))
+            scored.sort(key=lambda x: x[0], reverse=True)
+            ranked = [i for _, i in scored]
 
-        if not candidate_sentences:
+        if not ranked:
             return "No encontré esa información."
 
         # pick top few sentences and assemble a brief answer
-        candidate_sentences.sort(key=lambda x: x[0], reverse=True)
         selected = []
         used = set()
-        for _, s in candidate_sentences[:8]:
+        for i in ranked[:8]:
+            s = sentences[i]
             if s in used:
                 continue
             used.add(s)
@@ -1117,30 +1645,23 @@ class Brain:
 
     def _is_smalltalk(self, question: str) -> bool:
         q = (question or "").strip().lower()
-        greetings = ["hola", "buenas", "hello", "hi", "hey"]
-        return any(q == g or q.startswith(g + " ") for g in greetings)
+        return bool(_SMALLTALK_RE.match(q))
 
     def _smalltalk_answer(self, question: str) -> str:
         return "¡Hola! ¿En qué puedo ayudarte? Puedes agregar texto y hacer preguntas sobre eso."
 
     def _is_datetime_query(self, question: str) -> bool:
         q = (question or "").strip().lower()
-        keywords = [
-            "hora", "qué hora", "que hora", "qué fecha", "que fecha",
-            "fecha", "día", "que dia", "qué día", "hoy", "dia de hoy"
-        ]
-        return any(k in q for k in keywords)
+        return bool(_DATETIME_RE.search(q))
 
     def _datetime_answer(self) -> str:
-        from datetime import datetime
-        import time as _time
         # Map Spanish names manually to avoid system locale dependency
         dias = ["lunes", "martes", "miércoles", "jueves", "viernes", "sábado", "domingo"]
         meses = ["enero", "febrero", "marzo", "abril", "mayo", "junio", "julio", "agosto", "septiembre", "octubre", "noviembre", "diciembre"]
         now = datetime.now()
         dia_semana = dias[now.weekday()]
         mes_nombre = meses[now.month - 1]
-        tz = " ".join([p for p in _time.tzname if p]) or ""
+        tz = " ".join([p for p in time.tzname if p]) or ""
         fecha = f"{dia_semana.capitalize()}, {now.day} de {mes_nombre} de {now.year}"
         hora = now.strftime("%H:%M:%S")
         return f"Hoy es {fecha}. La hora actual es {hora} ({tz})."
@@ -1154,7 +1675,6 @@ class Brain:
         except Exception as e:
             logger.error(f"Failed to save vector store: {e}")
         # Save corpus texts and metas
-        import json
         data = {
             'texts': self._corpus_texts,
             'metas': self._corpus_metas,
@@ -1170,7 +1690,6 @@ class Brain:
         except Exception as e:
             logger.error(f"Failed to load vector store: {e}")
         # Load corpus
-        import json
         path = os.path.join(directory, 'corpus.json')
         if os.path.isfile(path):
             try:
@@ -1182,6 +1701,9 @@ class Brain:
                 logger.error(f"Failed to load corpus from {path}: {e}")
                 self._corpus_texts = []
                 self._corpus_metas = []
+            self._id_to_text = {}
+            self._doc_ids = set()
+            self._index_texts(self._corpus_texts, self._corpus_metas)
 
     def remove_sources(self, patterns: List[str]) -> int:
         """Remove all chunks whose meta['source'] matches any pattern.
@@ -1217,6 +1739,9 @@ class Brain:
         # Rebuild store from kept items
         self._corpus_texts = keep_texts
         self._corpus_metas = keep_metas
+        self._id_to_text = {}
+        self._doc_ids = set()
+        self._index_texts(keep_texts, keep_metas)
         # Refit embedder (only if backend requires fitting, e.g., TF-IDF)
         X = None
         try:
@@ -1225,7 +1750,7 @@ class Brain:
                     # TF-IDF needs a refit on the full corpus
                     self.embedder.fit_corpus(keep_texts)
                 # In all cases we need embeddings/representations for the store
-                X = self.embedder.encode_texts(keep_texts)
+                X = self._encode_texts(keep_texts)
             else:
                 X = None
         except Exception:
@@ -1236,12 +1761,13 @@ class Brain:
         try:
             from .vector_store import FaissVectorStore, InMemoryVectorStore  # reimport types
             # keep same type
-            self.store = FaissVectorStore() if hasattr(self.store, 'save') and type(self.store).__name__ == 'FaissVectorStore' else InMemoryVectorStore()
+            self.store = FaissVectorStore(index_type=self._index_type) if hasattr(self.store, 'save') and type(self.store).__name__ == 'FaissVectorStore' else InMemoryVectorStore()
         except Exception as e:
             logger.error(f"Failed to recreate store after removing sources: {e}")
 
         if X is not None and len(keep_metas) == (X.shape[0] if hasattr(X, 'shape') else len(keep_texts)):
             self.store.add(X, keep_metas)  # type: ignore[arg-type]
+        self._invalidate_caches()
 
         if self._storage_dir:
             self.save_index(self._storage_dir)
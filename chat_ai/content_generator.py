@@ -5,11 +5,39 @@ Generates images, videos, and animations for Experience Objects
 import os
 import json
 import asyncio
+import functools
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Optional, Any
 import logging
 
+try:
+    import numpy as np  # type: ignore
+except ImportError:  # pragma: no cover
+    np = None
+
 logger = logging.getLogger(__name__)
 
+# Max concurrent calls to the image backend (match the provider's rate limit)
+IMAGE_GEN_CONCURRENCY = max(1, int(os.getenv("IMAGE_GEN_CONCURRENCY", "4")))
+# Optional sentence-transformers model for semantic prompt cache hits (off when unset)
+PROMPT_CACHE_MODEL = os.getenv("PROMPT_CACHE_MODEL")
+# Min cosine similarity between prompts for a semantic cache hit
+PROMPT_CACHE_SIMILARITY = float(os.getenv("PROMPT_CACHE_SIMILARITY", "0.95"))
+
+
+@functools.lru_cache(maxsize=1)
+def _detect_backends_cached() -> Dict[str, bool]:
+    """Detect available content generation backends once per process."""
+    return {
+        'internal_image': True,  # Always available (uses generate_image tool)
+        'runway': os.getenv('RUNWAY_API_KEY') is not None,
+        'luma': os.getenv('LUMA_API_KEY') is not None,
+        'stability': os.getenv('STABILITY_API_KEY') is not None,
+        'replicate': os.getenv('REPLICATE_API_TOKEN') is not None
+    }
+
 
 class ContentGenerator:
     """Generates multi-modal content for experiences using AI and procedural methods."""
@@ -23,31 +51,125 @@ class ContentGenerator:
         'hologram': 'generate_hologram_data'
     }
     
-    def __init__(self, asset_manager=None, image_generator=None):
+    # Domain-specific image prompt parts: (prefix, step label)
+    PROMPT_TEMPLATES = {
+        'medical': ("Medical illustration: ", "Step"),
+        'architecture': ("Architectural visualization: ", "Phase"),
+        'engineering': ("Technical diagram: ", "Step"),
+        'legal': ("Professional diagram: ", "Step"),
+        'government': ("Policy visualization: ", "Step"),
+        'general': ("", "Step")
+    }
+    
+    # Domain-specific style guidelines for image generation
+    DOMAIN_STYLES = {
+        'medical': "Clinical photography style with proper medical lighting, sterile environment, anatomical accuracy, professional medical illustration quality.",
+        'architecture': "Professional architectural rendering, clean lines, realistic materials, proper lighting and shadows, blueprint aesthetic.",
+        'engineering': "Technical illustration style, precise measurements, cross-sections visible, engineering diagram quality, CAD-like precision.",
+        'legal': "Professional business style, clean and formal, document-like presentation, corporate aesthetic.",
+        'government': "Institutional style, formal and authoritative, clear and accessible, public service aesthetic.",
+        'general': "Clear, professional, and informative visual style."
+    }
+    
+    def __init__(
+        self,
+        asset_manager=None,
+        image_generator=None,
+        max_concurrency: Optional[int] = None,
+        semantic_cache_model: Optional[str] = None
+    ):
         """
         Initialize Content Generator.
         
         Args:
             asset_manager: AssetManager instance for storing generated content
             image_generator: Optional custom image generation function
+            max_concurrency: Max simultaneous image generations (default IMAGE_GEN_CONCURRENCY)
+            semantic_cache_model: Embedding model that lets near-identical prompts
+                reuse an asset (default PROMPT_CACHE_MODEL; exact matches only if unset)
         """
         self.asset_manager = asset_manager
         self.image_generator = image_generator
+        self.max_concurrency = max(1, max_concurrency or IMAGE_GEN_CONCURRENCY)
+        # Shared by every thread of this generator, so nested batches stay within the limit
+        self._generation_slots = threading.BoundedSemaphore(self.max_concurrency)
+        
+        # Prompt -> asset cache: exact SHA-256 tier (persisted by the asset
+        # manager) and an optional in-memory semantic tier
+        self._cache_lock = threading.Lock()
+        self._exact_cache: Dict[str, str] = {}
+        self._sem_model = self._load_semantic_model(semantic_cache_model or PROMPT_CACHE_MODEL)
+        self._sem_vectors = None  # (n, dim) L2-normalized prompt embeddings
+        self._sem_assets: List[str] = []
+        # Prompts being generated right now: key -> event set when done
+        self._inflight: Dict[str, threading.Event] = {}
         
         # Check for available generation backends
         self.available_backends = self._detect_backends()
         logger.info(f"Content Generator initialized with backends: {self.available_backends}")
     
     def _detect_backends(self) -> Dict[str, bool]:
-        """Detect available content generation backends."""
-        backends = {
-            'internal_image': True,  # Always available (uses generate_image tool)
-            'runway': os.getenv('RUNWAY_API_KEY') is not None,
-            'luma': os.getenv('LUMA_API_KEY') is not None,
-            'stability': os.getenv('STABILITY_API_KEY') is not None,
-            'replicate': os.getenv('REPLICATE_API_TOKEN') is not None
-        }
-        return backends
+        """Detect available content generation backends (env read once per process)."""
+        # Copy so callers may adjust their instance without affecting others
+        return dict(_detect_backends_cached())
+    
+    @staticmethod
+    def _load_semantic_model(model_name: Optional[str]):
+        """Load the embedding model for semantic cache hits, or None."""
+        if not model_name or np is None:
+            return None
+        try:
+            from .embeddings import _load_sentence_transformer
+            return _load_sentence_transformer(model_name)
+        except Exception as e:
+            logger.warning(f"Semantic prompt cache disabled ({model_name}): {e}")
+            return None
+    
+    def _lookup_cached_asset(self, key: str, prompt: str):
+        """
+        Find an asset already generated for this prompt.
+        
+        Returns:
+            (asset_id or None, prompt embedding or None for reuse on a miss)
+        """
+        asset_id = self._exact_cache.get(key)
+        if asset_id:
+            return asset_id, None
+        if self.asset_manager and hasattr(self.asset_manager, 'get_prompt_asset'):
+            asset_id = self.asset_manager.get_prompt_asset(key)
+            if asset_id:
+                self._exact_cache[key] = asset_id
+                return asset_id, None
+        if self._sem_model is None:
+            return None, None
+        
+        vector = np.asarray(
+            self._sem_model.encode(prompt, show_progress_bar=False, normalize_embeddings=True),
+            dtype=np.float32
+        )
+        with self._cache_lock:
+            vectors, assets = self._sem_vectors, self._sem_assets
+        if vectors is not None:
+            scores = vectors @ vector
+            best = int(np.argmax(scores))
+            if scores[best] >= PROMPT_CACHE_SIMILARITY:
+                self._exact_cache[key] = assets[best]
+                return assets[best], None
+        return None, vector
+    
+    def _cache_asset(self, key: str, asset_id: str, vector=None):
+        """Remember the asset generated for a prompt in every cache tier."""
+        self._exact_cache[key] = asset_id
+        if self.asset_manager and hasattr(self.asset_manager, 'set_prompt_asset'):
+            self.asset_manager.set_prompt_asset(key, asset_id)
+        if vector is not None:
+            with self._cache_lock:
+                # Replace (not grow in place) so concurrent lookups see a consistent pair
+                if self._sem_vectors is None:
+                    self._sem_vectors = vector[None, :]
+                else:
+                    self._sem_vectors = np.vstack([self._sem_vectors, vector])
+                self._sem_assets = self._sem_assets + [asset_id]
     
     def generate_for_experience(
         self, 
@@ -94,12 +216,11 @@ class ContentGenerator:
         experience: Dict
     ) -> Dict[str, List[str]]:
         """Generate static images for each step."""
-        asset_ids = []
-        
         # Get domain-specific styling
         style_prompt = self._get_domain_style(domain)
         context = experience.get('title', 'Procedure')
         
+        prompts = []
         for i, step in enumerate(steps):
             # Extract step description
             if isinstance(step, dict):
@@ -108,31 +229,48 @@ class ContentGenerator:
                 step_desc = str(step)
             
             # Build generation prompt
-            prompt = self._build_image_prompt(
+            prompts.append(self._build_image_prompt(
                 context=context,
                 step_description=step_desc,
                 step_number=i + 1,
                 domain=domain,
                 style=style_prompt
-            )
-            
-            # Generate image
+            ))
+        
+        # Progress is logged about every tenth step; failures are reported once
+        failures = []  # (step_index, error); list.append is thread-safe
+        log_every = max(1, len(prompts) // 10)
+        log_progress = logger.isEnabledFor(logging.INFO)
+        
+        def _generate(i: int) -> Optional[str]:
             try:
                 asset_id = self._generate_single_image(
-                    prompt=prompt,
+                    prompt=prompts[i],
                     domain=domain,
                     experience_id=experience.get('id', 'unknown'),
                     step_index=i
                 )
-                
-                if asset_id:
-                    asset_ids.append(asset_id)
-                    logger.info(f"Generated image for step {i+1}/{len(steps)}")
-                
             except Exception as e:
-                logger.error(f"Error generating image for step {i}: {e}")
+                failures.append((i, e))
+                return None
+            if log_progress and asset_id and (i + 1) % log_every == 0:
+                logger.info(f"Generated image for step {i+1}/{len(steps)}")
+            return asset_id
+        
+        # Each generation is an independent backend call, so overlap them;
+        # map() keeps the results in step order
+        workers = min(self.max_concurrency, len(prompts))
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(_generate, range(len(prompts))))
+        else:
+            results = [_generate(i) for i in range(len(prompts))]
         
-        return {'images': asset_ids}
+        if failures:
+            details = "; ".join(f"step {i}: {e}" for i, e in sorted(failures, key=lambda f: f[0]))
+            logger.error(f"Error generating images for {len(failures)}/{len(steps)} steps: {details}")
+        
+        return {'images': [asset_id for asset_id in results if asset_id]}
     
     def _generate_animated_sequence(
         self,
@@ -186,10 +324,48 @@ class ContentGenerator:
         Returns:
             Asset ID or None
         """
+        # Reuse the asset of an identical (or, if enabled, near-identical) prompt
+        key = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+        cached_id, vector = self._lookup_cached_asset(key, prompt)
+        if cached_id:
+            logger.debug(f"Prompt cache hit: {cached_id}")
+            return cached_id
+        
+        # Identical prompts requested concurrently (e.g. the same step in several
+        # experiences of a batch) are generated once; the others wait for it
+        with self._cache_lock:
+            cached_id = self._exact_cache.get(key)
+            event = self._inflight.get(key)
+            leader = cached_id is None and event is None
+            if leader:
+                event = self._inflight[key] = threading.Event()
+        if cached_id:
+            return cached_id
+        if not leader:
+            event.wait()
+            return self._exact_cache.get(key)
+        try:
+            return self._run_generator(prompt, domain, experience_id, step_index, key, vector)
+        finally:
+            with self._cache_lock:
+                del self._inflight[key]
+            event.set()
+    
+    def _run_generator(
+        self,
+        prompt: str,
+        domain: str,
+        experience_id: str,
+        step_index: int,
+        key: str,
+        vector=None
+    ) -> Optional[str]:
+        """Call the image backend for a prompt and cache the stored asset."""
         # Use custom generator if provided
         if self.image_generator:
             try:
-                image_path = self.image_generator(prompt)
+                with self._generation_slots:
+                    image_path = self.image_generator(prompt)
                 
                 # Store in asset manager if available
                 if self.asset_manager and os.path.exists(image_path):
@@ -202,6 +378,8 @@ class ContentGenerator:
                             'prompt': prompt[:200]
                         }
                     )
+                    if asset_id:
+                        self._cache_asset(key, asset_id, vector)
                     return asset_id
                 
             except Exception as e:
@@ -220,39 +398,12 @@ class ContentGenerator:
         style: str
     ) -> str:
         """Build a detailed prompt for image generation."""
-        
-        # Domain-specific prompt templates
-        templates = {
-            'medical': "Medical illustration: {context}. Step {step_number}: {step_description}. {style}",
-            'architecture': "Architectural visualization: {context}. Phase {step_number}: {step_description}. {style}",
-            'engineering': "Technical diagram: {context}. Step {step_number}: {step_description}. {style}",
-            'legal': "Professional diagram: {context}. Step {step_number}: {step_description}. {style}",
-            'government': "Policy visualization: {context}. Step {step_number}: {step_description}. {style}",
-            'general': "{context}. Step {step_number}: {step_description}. {style}"
-        }
-        
-        template = templates.get(domain, templates['general'])
-        
-        return template.format(
-            context=context,
-            step_number=step_number,
-            step_description=step_description,
-            style=style
-        )
+        prefix, label = self.PROMPT_TEMPLATES.get(domain, self.PROMPT_TEMPLATES['general'])
+        return f"{prefix}{context}. {label} {step_number}: {step_description}. {style}"
     
     def _get_domain_style(self, domain: str) -> str:
         """Get domain-specific style guidelines for image generation."""
-        
-        styles = {
-            'medical': "Clinical photography style with proper medical lighting, sterile environment, anatomical accuracy, professional medical illustration quality.",
-            'architecture': "Professional architectural rendering, clean lines, realistic materials, proper lighting and shadows, blueprint aesthetic.",
-            'engineering': "Technical illustration style, precise measurements, cross-sections visible, engineering diagram quality, CAD-like precision.",
-            'legal': "Professional business style, clean and formal, document-like presentation, corporate aesthetic.",
-            'government': "Institutional style, formal and authoritative, clear and accessible, public service aesthetic.",
-            'general': "Clear, professional, and informative visual style."
-        }
-        
-        return styles.get(domain, styles['general'])
+        return self.DOMAIN_STYLES.get(domain, self.DOMAIN_STYLES['general'])
     
     def generate_step_video(
         self,
@@ -326,16 +477,27 @@ class ContentGenerator:
         Returns:
             Dictionary mapping experience IDs to generated content
         """
-        results = {}
-        
-        for exp in experiences:
+        def _generate(exp: Dict) -> Dict:
             exp_id = exp.get('id', exp.get('title', 'unknown'))
             try:
                 content = self.generate_for_experience(exp, domain)
-                results[exp_id] = content
                 logger.info(f"Generated content for experience: {exp_id}")
+                return content
             except Exception as e:
                 logger.error(f"Error generating content for {exp_id}: {e}")
-                results[exp_id] = {'error': str(e)}
+                return {'error': str(e)}
+        
+        # Experiences run concurrently too; the backend limit is enforced
+        # per image call by _generation_slots
+        workers = min(self.max_concurrency, len(experiences))
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                contents = list(pool.map(_generate, experiences))
+        else:
+            contents = [_generate(exp) for exp in experiences]
+        
+        results = {}
+        for exp, content in zip(experiences, contents):
+            results[exp.get('id', exp.get('title', 'unknown'))] = content
         
         return results
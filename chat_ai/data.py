@@ -4,10 +4,37 @@ Utilities to load plain text and CSV files into a list of documents (text chunks
 from __future__ import annotations
 import os
 import csv
-from typing import List, Dict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Iterable, Iterator
 
+# Characters read per block when a text file is streamed into chunks
+TEXT_READ_SIZE = 64 * 1024
 
-def load_text_file(path: str) -> List[Dict[str,str]]:
+# Threads reading files in load_directory (file reads are I/O-bound)
+LOAD_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
+
+class TextFileStream:
+    """Lazy text of a file: iterating it reads the file in blocks.
+
+    Lets prepare_documents chunk a large file without holding all of it in memory.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def __iter__(self) -> Iterator[str]:
+        with open(self.path, 'r', encoding='utf-8') as f:
+            yield from iter(lambda: f.read(TEXT_READ_SIZE), '')
+
+
+def load_text_file(path: str, stream: bool = False) -> List[Dict[str,str]]:
+    """Load a text file as one document.
+
+    With ``stream=True`` the 'text' is a TextFileStream read only while chunking.
+    """
+    if stream:
+        return [{'source': os.path.basename(path), 'text': TextFileStream(path)}]
     with open(path, 'r', encoding='utf-8') as f:
         text = f.read()
     return [{'source': os.path.basename(path), 'text': text}]
@@ -15,50 +42,89 @@ def load_text_file(path: str) -> List[Dict[str,str]]:
 
 def load_csv(path: str, text_col: str = None) -> List[Dict[str,str]]:
     docs = []
+    source = os.path.basename(path)
     with open(path, 'r', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
+        # Rows are read as plain lists (no per-row dict); blank lines are skipped
+        reader = csv.reader(f)
+        header = next(reader, [])
         if text_col is None:
-            # try to find a text-y column
+            # try to find a text-y column: concatenate the non-empty fields
             for row in reader:
-                combined = ' '.join([v for v in row.values() if v])
-                docs.append({'source': os.path.basename(path), 'text': combined})
+                if row:
+                    docs.append({'source': source, 'text': ' '.join(filter(None, row))})
         else:
+            # Same values DictReader gave: the last column with that name wins,
+            # short rows give None and an unknown column ''
+            idx = max((i for i, name in enumerate(header) if name == text_col), default=None)
             for row in reader:
-                docs.append({'source': os.path.basename(path), 'text': row.get(text_col, '')})
+                if row:
+                    if idx is None:
+                        text = ''
+                    else:
+                        text = row[idx] if idx < len(row) else None
+                    docs.append({'source': source, 'text': text})
     return docs
 
 
 def chunk_text(text: str, max_chars: int = 1000, overlap: int = 200) -> List[str]:
     if not text:
         return []
-    chunks = []
-    start = 0
-    while start < len(text):
-        end = min(start + max_chars, len(text))
-        chunks.append(text[start:end])
-        start = max(start + max_chars - overlap, end)
-        if start >= len(text):
-            break
-    return chunks
-
-
-def load_directory(directory: str) -> List[Dict[str, str]]:
+    # Chunk starts form an arithmetic progression. Each chunk starts no
+    # earlier than the previous one ended, so a positive overlap does not apply.
+    step = max(max_chars, max_chars - overlap)
+    return [text[start:start + max_chars] for start in range(0, len(text), step)]
+
+
+def iter_chunks(blocks: Iterable[str], max_chars: int = 1000, overlap: int = 200) -> Iterator[str]:
+    """Chunk text arriving in blocks; yields the same chunks as chunk_text.
+
+    Only about max_chars plus one block is buffered at a time.
+    """
+    step = max(max_chars, max_chars - overlap)
+    buf = ''
+    skip = 0  # characters still to drop between chunks
+    for block in blocks:
+        if skip:
+            dropped = min(skip, len(block))
+            block = block[dropped:]
+            skip -= dropped
+        buf += block
+        pos = 0
+        while not skip and len(buf) - pos >= max_chars:
+            yield buf[pos:pos + max_chars]
+            pos += step
+            if pos > len(buf):
+                skip = pos - len(buf)
+                pos = len(buf)
+        buf = buf[pos:]
+    if buf and not skip:
+        yield buf
+
+
+def load_directory(directory: str, stream: bool = False) -> List[Dict[str, str]]:
     """Load all .txt and .csv files in a directory into document dicts.
 
     For CSV files, this uses the auto-detect behavior from load_csv (concatenate all columns),
-    which is a robust default when a text column name is unknown.
+    which is a robust default when a text column name is unknown. ``stream`` is passed
+    to load_text_file.
     """
-    docs: List[Dict[str, str]] = []
-    for filename in os.listdir(directory):
-        path = os.path.join(directory, filename)
-        if not os.path.isfile(path):
-            continue
-        lower = filename.lower()
-        if lower.endswith('.txt'):
-            docs.extend(load_text_file(path))
-        elif lower.endswith('.csv'):
-            docs.extend(load_csv(path))
-    return docs
+    def _load(entry: os.DirEntry) -> List[Dict[str, str]]:
+        if entry.name.lower().endswith('.txt'):
+            return load_text_file(entry.path, stream=stream)
+        return load_csv(entry.path)
+
+    # scandir reports the file type without an extra stat per file
+    with os.scandir(directory) as it:
+        entries = [e for e in it if e.name.lower().endswith(('.txt', '.csv')) and e.is_file()]
+
+    # Files are independent, so read them concurrently; map() keeps listing order
+    workers = min(LOAD_WORKERS, len(entries))
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            loaded = list(pool.map(_load, entries))
+    else:
+        loaded = [_load(e) for e in entries]
+    return [doc for docs in loaded for doc in docs]
 
 
 def prepare_documents(
@@ -74,11 +140,15 @@ def prepare_documents(
     for doc_idx, doc in enumerate(raw_docs):
         source = doc.get('source', f'doc_{doc_idx}')
         text = doc.get('text', '')
+        if isinstance(text, str):
+            pieces = chunk_text(text, max_chars=max_chars, overlap=overlap)
+        else:
+            # Streamed text (e.g. TextFileStream): chunk it as it is read
+            pieces = iter_chunks(text, max_chars=max_chars, overlap=overlap)
         
         # Extract extra metadata (everything except 'source' and 'text')
         extra_metadata = {k: v for k, v in doc.items() if k not in {'source', 'text'}}
         
-        pieces = chunk_text(text, max_chars=max_chars, overlap=overlap)
         for i, piece in enumerate(pieces):
             chunk_data = {
                 'id': f"{source}::chunk_{i}",
@@ -89,4 +159,4 @@ def prepare_documents(
             # Preserve all extra metadata in each chunk
             chunk_data.update(extra_metadata)
             prepared.append(chunk_data)
-    return prepared
\ No newline at end of file
+    return prepared
\ No newline at end of file
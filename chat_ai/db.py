@@ -6,8 +6,15 @@ Maneja conexiones a PostgreSQL y SQLite con soporte para migración gradual
 from __future__ import annotations
 
 import os
+import re
+import atexit
+import uuid
+import time
 import logging
-from typing import Optional, Any, Dict, List
+import functools
+import threading
+import weakref
+from typing import Optional, Any, Dict, List, Iterator
 from contextlib import contextmanager
 import sqlite3
 
@@ -16,8 +23,8 @@ logger = logging.getLogger(__name__)
 # Intentar imports opcionales
 try:
     import psycopg2
-    from psycopg2.extras import RealDictCursor, Json
-    from psycopg2.pool import SimpleConnectionPool
+    from psycopg2.extras import RealDictCursor, Json, execute_values
+    from psycopg2.pool import ThreadedConnectionPool
     HAS_POSTGRES = True
 except ImportError:
     HAS_POSTGRES = False
@@ -33,6 +40,60 @@ except ImportError:
     logger.warning("SQLAlchemy not installed. ORM support disabled.")
 
 
+# Filas por sentencia INSERT multi-fila en execute_many (PostgreSQL)
+EXECUTE_VALUES_PAGE_SIZE = 500
+
+# TTL (segundos) de consultas de esquema cacheadas (get_table_exists/get_table_count)
+TABLE_INFO_TTL = 300.0
+# Máximo de resultados guardados en la caché de consultas
+QUERY_CACHE_MAX_ENTRIES = 256
+
+# PRAGMAs aplicados una vez a cada conexión SQLite (WAL: lectores concurrentes)
+_SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL;"
+    "PRAGMA synchronous=NORMAL;"
+    "PRAGMA temp_store=MEMORY;"
+    "PRAGMA mmap_size=268435456;"
+    "PRAGMA cache_size=-65536;"
+)
+
+# Cláusula "VALUES (%s, %s, ...)" de un INSERT de una sola fila
+_VALUES_ROW_RE = re.compile(r"\bVALUES\s*\((?:\s*%s\s*,)*\s*%s\s*\)", re.IGNORECASE)
+
+
+class _ThreadSQLiteConnection:
+    """
+    Conexión SQLite de un hilo; se cierra sola cuando el hilo termina
+    
+    Solo el threading.local del hilo la referencia: al terminar el hilo
+    se libera y weakref.finalize cierra la conexión.
+    """
+    
+    def __init__(self, db_path: str):
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row  # Return dict-like rows
+        self.conn.executescript(_SQLITE_PRAGMAS)
+        self._finalizer = weakref.finalize(self, self.conn.close)
+    
+    def close(self):
+        self._finalizer()
+
+
+@functools.lru_cache(maxsize=1024)
+def _sqlite_query(query: str) -> str:
+    """Traducir placeholders %s a ? (SQLite), una sola vez por texto de query"""
+    return query.replace('%s', '?')
+
+
+@functools.lru_cache(maxsize=256)
+def _values_query(query: str) -> Optional[str]:
+    """INSERT ... VALUES (%s, ...) reescrito como VALUES %s para execute_values, o None"""
+    if query.lstrip()[:6].upper() != 'INSERT':
+        return None
+    rewritten, n = _VALUES_ROW_RE.subn('VALUES %s', query)
+    return rewritten if n == 1 else None
+
+
 class DatabaseConfig:
     """Configuración de base de datos desde variables de entorno"""
     
@@ -72,10 +133,21 @@ class DatabaseManager:
     
     def __init__(self, config: Optional[DatabaseConfig] = None):
         self.config = config or DatabaseConfig()
-        self._pg_pool: Optional[SimpleConnectionPool] = None
+        self._pg_pool: Optional[ThreadedConnectionPool] = None
         self._sqlalchemy_engine = None
         self._sqlalchemy_session_factory = None
         
+        # Caché de lecturas: (query, params) -> (expira_en, filas)
+        self._query_cache: Dict[tuple, tuple] = {}
+        self._query_cache_lock = threading.Lock()
+        
+        # Una conexión SQLite por hilo, reutilizada entre llamadas y cerrada al
+        # terminar el hilo (el servidor Flask crea un hilo por petición)
+        self._sqlite_local = threading.local()
+        self._sqlite_conns: "weakref.WeakSet[_ThreadSQLiteConnection]" = weakref.WeakSet()
+        self._sqlite_conns_lock = threading.Lock()
+        atexit.register(self._close_sqlite)
+        
         if self.config.use_postgres:
             self._init_postgres()
         else:
@@ -87,7 +159,8 @@ class DatabaseManager:
             raise RuntimeError("psycopg2 not installed. Install with: pip install psycopg2-binary")
         
         try:
-            self._pg_pool = SimpleConnectionPool(
+            # ThreadedConnectionPool: getconn/putconn seguros entre hilos del servidor
+            self._pg_pool = ThreadedConnectionPool(
                 self.config.pool_min_size,
                 self.config.pool_max_size,
                 host=self.config.pg_host,
@@ -122,11 +195,14 @@ class DatabaseManager:
         else:
             engine_url = f"sqlite:///{self.config.sqlite_db_path}"
         
+        # Las conexiones SQLite del pool pasan de un hilo a otro
+        connect_args = {} if self.config.use_postgres else {'check_same_thread': False}
         self._sqlalchemy_engine = create_engine(
             engine_url,
             poolclass=QueuePool,
             pool_size=self.config.pool_max_size,
             max_overflow=5,
+            connect_args=connect_args,
             echo=False  # Set True for SQL debugging
         )
         
@@ -155,17 +231,40 @@ class DatabaseManager:
             finally:
                 self._pg_pool.putconn(conn)
         else:
-            # SQLite fallback
-            conn = sqlite3.connect(self.config.sqlite_db_path)
-            conn.row_factory = sqlite3.Row  # Return dict-like rows
+            # SQLite fallback: conexión del hilo, se mantiene abierta
+            conn = self._sqlite_connection()
             try:
                 yield conn
                 conn.commit()
             except Exception as e:
                 conn.rollback()
                 raise
-            finally:
-                conn.close()
+    
+    def _sqlite_connection(self) -> sqlite3.Connection:
+        """
+        Conexión SQLite del hilo actual, abierta y configurada una sola vez
+        
+        Anidar get_connection en un mismo hilo comparte la conexión (y su transacción).
+        """
+        holder = getattr(self._sqlite_local, 'holder', None)
+        if holder is None:
+            holder = _ThreadSQLiteConnection(self.config.sqlite_db_path)
+            self._sqlite_local.holder = holder
+            with self._sqlite_conns_lock:
+                self._sqlite_conns.add(holder)
+        return holder.conn
+    
+    def _close_sqlite(self):
+        """Cerrar las conexiones SQLite abiertas por todos los hilos"""
+        with self._sqlite_conns_lock:
+            holders = list(self._sqlite_conns)
+            self._sqlite_conns = weakref.WeakSet()
+            self._sqlite_local = threading.local()
+        for holder in holders:
+            try:
+                holder.close()
+            except Exception as e:
+                logger.debug(f"Error closing SQLite connection: {e}")
     
     @contextmanager
     def get_dict_cursor(self):
@@ -230,16 +329,80 @@ class DatabaseManager:
                 cur.execute(query, params or ())
             else:
                 # SQLite uses ? placeholders
-                query_sqlite = query.replace('%s', '?')
-                cur.execute(query_sqlite, params or ())
+                cur.execute(_sqlite_query(query), params or ())
             
-            if cur.description:  # SELECT query
-                if self.config.use_postgres:
-                    return [dict(row) for row in cur.fetchall()]
-                else:
-                    return [dict(row) for row in cur.fetchall()]
+            if cur.description:  # SELECT query (or INSERT ... RETURNING)
+                rows = [dict(row) for row in cur.fetchall()]
             else:  # INSERT/UPDATE/DELETE
-                return []
+                rows = []
+        
+        # Una escritura puede dejar obsoleta cualquier lectura cacheada
+        if query.lstrip()[:6].upper() != 'SELECT':
+            self.clear_query_cache()
+        return rows
+    
+    def execute_query_cached(self, query: str, params: tuple = None, ttl: float = TABLE_INFO_TTL) -> List[Dict[str, Any]]:
+        """
+        Igual que execute_query, pero reutiliza el resultado durante ``ttl`` segundos
+        
+        Pensado para lecturas pequeñas y repetidas. Las escrituras hechas con
+        execute_query/execute_many vacían la caché; las hechas directamente con
+        get_connection no, así que el resultado puede quedar obsoleto hasta ``ttl``.
+        """
+        key = (query, tuple(params) if params else ())
+        now = time.monotonic()
+        with self._query_cache_lock:
+            hit = self._query_cache.get(key)
+        if hit is not None and hit[0] > now:
+            return [dict(row) for row in hit[1]]
+        
+        rows = self.execute_query(query, params)
+        with self._query_cache_lock:
+            if len(self._query_cache) >= QUERY_CACHE_MAX_ENTRIES:
+                # Descartar la entrada más antigua (orden de inserción)
+                self._query_cache.pop(next(iter(self._query_cache)))
+            self._query_cache[key] = (now + ttl, rows)
+        return [dict(row) for row in rows]
+    
+    def clear_query_cache(self):
+        """Vaciar la caché de execute_query_cached"""
+        with self._query_cache_lock:
+            self._query_cache.clear()
+    
+    def iter_query(self, query: str, params: tuple = None, batch_size: int = 1000) -> Iterator[Dict[str, Any]]:
+        """
+        Ejecutar un SELECT y recorrer sus resultados como dicts sin cargarlos todos
+        
+        En PostgreSQL usa un cursor con nombre (del lado del servidor); en SQLite
+        lee con fetchmany. Solo hay ``batch_size`` filas en memoria a la vez.
+        La conexión queda tomada hasta agotar (o cerrar) el iterador.
+        
+        Args:
+            query: SQL query with placeholders
+            params: Query parameters
+            batch_size: Rows fetched per round-trip
+        
+        Yields:
+            One dict per result row
+        """
+        with self.get_connection() as conn:
+            if self.config.use_postgres:
+                cur = conn.cursor(name=f"stream_{uuid.uuid4().hex}", cursor_factory=RealDictCursor)
+                cur.itersize = batch_size
+                try:
+                    cur.execute(query, params or ())
+                    for row in cur:
+                        yield dict(row)
+                finally:
+                    cur.close()
+            else:
+                cur = conn.execute(_sqlite_query(query), params or ())
+                try:
+                    while rows := cur.fetchmany(batch_size):
+                        for row in rows:
+                            yield dict(row)
+                finally:
+                    cur.close()
     
     def execute_many(self, query: str, params_list: List[tuple]) -> int:
         """
@@ -253,13 +416,26 @@ class DatabaseManager:
             Number of affected rows
         """
         with self.get_connection() as conn:
-            with conn.cursor() as cur:
-                if self.config.use_postgres:
-                    cur.executemany(query, params_list)
-                else:
-                    query_sqlite = query.replace('%s', '?')
-                    cur.executemany(query_sqlite, params_list)
-                return cur.rowcount
+            if self.config.use_postgres:
+                with conn.cursor() as cur:
+                    values_query = _values_query(query)
+                    if values_query is None:
+                        cur.executemany(query, params_list)
+                        total = cur.rowcount
+                    else:
+                        # INSERT multi-fila: un round-trip por página en vez de uno por fila
+                        rows = params_list if isinstance(params_list, (list, tuple)) else list(params_list)
+                        total = 0
+                        for start in range(0, len(rows), EXECUTE_VALUES_PAGE_SIZE):
+                            page = rows[start:start + EXECUTE_VALUES_PAGE_SIZE]
+                            execute_values(cur, values_query, page, page_size=len(page))
+                            total += cur.rowcount
+            else:
+                # Los cursores de sqlite3 no son context managers; todas las filas
+                # corren dentro de la transacción implícita de la conexión
+                total = conn.executemany(_sqlite_query(query), params_list).rowcount
+        self.clear_query_cache()
+        return total
     
     def get_table_exists(self, table_name: str) -> bool:
         """Verificar si una tabla existe"""
@@ -274,25 +450,22 @@ class DatabaseManager:
         else:
             query = """
                 SELECT name FROM sqlite_master 
-                WHERE type='table' AND name=?;
+                WHERE type='table' AND name=%s;
             """
         
-        with self.get_dict_cursor() as cur:
-            if self.config.use_postgres:
-                cur.execute(query, (table_name,))
-                return cur.fetchone()['exists']
-            else:
-                cur.execute(query, (table_name,))
-                return cur.fetchone() is not None
+        rows = self.execute_query_cached(query, (table_name,))
+        if self.config.use_postgres:
+            return rows[0]['exists']
+        return bool(rows)
     
     def get_table_count(self, table_name: str) -> int:
-        """Obtener número de registros en una tabla"""
+        """Obtener número de registros en una tabla (cacheado hasta TABLE_INFO_TTL)"""
         query = f"SELECT COUNT(*) as count FROM {table_name}"
-        result = self.execute_query(query)
+        result = self.execute_query_cached(query)
         return result[0]['count'] if result else 0
     
     def close(self):
-        """Cerrar pool de conexiones"""
+        """Cerrar pool de conexiones (closeall del pool PostgreSQL y conexiones SQLite)"""
         if self._pg_pool:
             self._pg_pool.closeall()
             logger.info("PostgreSQL connection pool closed")
@@ -300,6 +473,8 @@ class DatabaseManager:
         if self._sqlalchemy_engine:
             self._sqlalchemy_engine.dispose()
             logger.info("SQLAlchemy engine disposed")
+        
+        self._close_sqlite()
 
 
 # Instancia global (singleton pattern)
@@ -327,6 +502,11 @@ def execute_query(query: str, params: tuple = None) -> List[Dict[str, Any]]:
     return get_db_manager().execute_query(query, params)
 
 
+def iter_query(query: str, params: tuple = None, batch_size: int = 1000) -> Iterator[Dict[str, Any]]:
+    """Shortcut para recorrer resultados grandes de forma incremental"""
+    return get_db_manager().iter_query(query, params, batch_size)
+
+
 def execute_many(query: str, params_list: List[tuple]) -> int:
     """Shortcut para batch operations"""
     return get_db_manager().execute_many(query, params_list)
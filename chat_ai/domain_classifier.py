@@ -1,9 +1,93 @@
 """
 Domain Classifier - Detects user's domain from query context
 """
-from typing import Dict, List
+from types import MappingProxyType
+from typing import Dict, List, Tuple
+import functools
 import re
 
+try:
+    import ahocorasick  # type: ignore  # pyahocorasick
+except ImportError:  # pragma: no cover
+    ahocorasick = None
+
+
+@functools.lru_cache(maxsize=None)
+def _keyword_table(classifier_cls):
+    """
+    Flat keyword table of a classifier class, built once per class.
+    
+    Returns (domain names, domain weights, ((keyword, domain indices), ...)),
+    so scoring walks one tuple of unique keywords and a list of counters
+    instead of the nested DOMAINS dicts.
+    """
+    domains_config = classifier_cls.DOMAINS
+    keyword_domains: Dict[str, List[int]] = {}
+    for idx, config in enumerate(domains_config.values()):
+        for keyword in config['keywords']:
+            keyword_domains.setdefault(keyword, []).append(idx)
+    return (
+        tuple(domains_config),
+        tuple(config['weight'] for config in domains_config.values()),
+        tuple((keyword, tuple(idxs)) for keyword, idxs in keyword_domains.items()),
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _keyword_automaton(classifier_cls):
+    """
+    Aho-Corasick automaton over the keyword table of a classifier class.
+    
+    Each keyword maps to its (keyword, domain indices) table entry.
+    """
+    automaton = ahocorasick.Automaton()
+    for entry in _keyword_table(classifier_cls)[2]:
+        automaton.add_word(entry[0], entry)
+    automaton.make_automaton()
+    return automaton
+
+
+@functools.lru_cache(maxsize=1024)
+def _keyword_scores(classifier_cls, query_lower: str) -> Tuple[Tuple[str, float], ...]:
+    """
+    Keyword score of every domain for a lowercased query, in DOMAINS order.
+    
+    Memoized: the same queries recur (UI suggestions, retries, follow-ups).
+    Each keyword counts once per domain listing it.
+    """
+    names, weights, keywords = _keyword_table(classifier_cls)
+    if ahocorasick is not None:
+        # One pass over the query finds every keyword of every domain
+        matches = {entry for _, entry in _keyword_automaton(classifier_cls).iter(query_lower)}
+    else:
+        matches = [entry for entry in keywords if entry[0] in query_lower]
+    
+    hits = [0] * len(names)
+    for _, idxs in matches:
+        for idx in idxs:
+            hits[idx] += 1
+    return tuple(zip(names, (count * weight for count, weight in zip(hits, weights))))
+
+
+@functools.lru_cache(maxsize=1024)
+def _best_domain(classifier_cls, query_lower: str, previous_domain) -> str:
+    """
+    Highest-scoring domain for a lowercased query and previous-domain hint.
+    
+    Memoized on top of _keyword_scores so repeated queries skip the
+    boost and max as well.
+    """
+    # Score each domain based on keyword matches
+    scores = dict(_keyword_scores(classifier_cls, query_lower))
+    
+    # Boost previous domain if there's any match
+    if previous_domain in scores and scores[previous_domain] > 0:
+        scores[previous_domain] *= 1.5
+    
+    # Return domain with highest score, or 'general' if no matches
+    max_domain = max(scores.items(), key=lambda x: x[1])
+    return max_domain[0] if max_domain[1] > 0 else 'general'
+
 
 class DomainClassifier:
     """Detects and manages domain-specific configurations."""
@@ -123,6 +207,12 @@ class DomainClassifier:
             'system_instruction': 'You are a helpful, intelligent assistant capable of adapting to any topic. Provide clear, concise, and accurate information. If a specific domain becomes apparent, adapt your style accordingly.'
         }
     }
+    # Read-only views: get_domain_config hands these out, so callers
+    # cannot mutate the shared class-level configuration
+    DOMAIN_CONFIGS = MappingProxyType({
+        domain: MappingProxyType({**config, 'terminology': MappingProxyType(config['terminology'])})
+        for domain, config in DOMAIN_CONFIGS.items()
+    })
     
     def classify(self, query: str, context: Dict = None) -> str:
         """
@@ -135,31 +225,13 @@ class DomainClassifier:
         Returns:
             Domain name (e.g., 'medical', 'architecture')
         """
-        query_lower = query.lower()
-        scores = {}
-        
-        # Score each domain based on keyword matches
-        for domain, config in self.DOMAINS.items():
-            score = 0
-            for keyword in config['keywords']:
-                if keyword in query_lower:
-                    score += config['weight']
-            scores[domain] = score
-        
-        # Check context for domain hints
-        if context:
-            if 'domain' in context:
-                # Explicit domain from context
-                return context['domain']
-            if 'previous_domain' in context:
-                prev = context['previous_domain']
-                if prev in scores and scores[prev] > 0:
-                    # Boost previous domain if there's any match
-                    scores[prev] *= 1.5
+        # Explicit domain from context; the query does not need scoring
+        if context and 'domain' in context:
+            return context['domain']
         
-        # Return domain with highest score, or 'general' if no matches
-        max_domain = max(scores.items(), key=lambda x: x[1])
-        return max_domain[0] if max_domain[1] > 0 else 'general'
+        # Only the previous domain hint affects the result
+        previous_domain = context.get('previous_domain') if context else None
+        return _best_domain(type(self), query.lower(), previous_domain)
     
     def get_domain_config(self, domain: str) -> Dict:
         """
@@ -169,9 +241,11 @@ class DomainClassifier:
             domain: Domain name
             
         Returns:
-            Configuration dictionary with colors, terminology, etc.
+            Configuration dictionary with colors, terminology, etc. A plain,
+            JSON-serializable copy: changing it does not affect DOMAIN_CONFIGS.
         """
-        return self.DOMAIN_CONFIGS.get(domain, self.DOMAIN_CONFIGS['general'])
+        config = self.DOMAIN_CONFIGS.get(domain, self.DOMAIN_CONFIGS['general'])
+        return {**config, 'terminology': dict(config['terminology'])}
     
     def get_all_domains(self) -> List[str]:
         """Returns list of all supported domains."""
@@ -5,9 +5,23 @@ Pluggable embedding backend with graceful fallback:
 """
 from __future__ import annotations
 
+import functools
+import threading
 from typing import List, Optional
 
 
+@functools.lru_cache(maxsize=4)
+def _load_sentence_transformer(model_name: str):
+    """Load a SentenceTransformer once per process and model name.
+
+    Encoding does not mutate the model, so every backend (and every Brain)
+    using the same model can share it. Failures are not cached.
+    """
+    from sentence_transformers import SentenceTransformer  # type: ignore
+
+    return SentenceTransformer(model_name)
+
+
 class EmbeddingBackend:
     """Unified interface for text embeddings with optional training/fit."""
 
@@ -19,9 +33,7 @@ class EmbeddingBackend:
 
         # Try SentenceTransformers first
         try:
-            from sentence_transformers import SentenceTransformer  # type: ignore
-
-            self._model = SentenceTransformer(model_name)
+            self._model = _load_sentence_transformer(model_name)
             self._backend = "sentence_transformers"
         except Exception:
             # Fallback to TF-IDF
@@ -60,28 +72,49 @@ class EmbeddingBackend:
             import numpy as np  # type: ignore
             from sklearn.preprocessing import normalize  # type: ignore
 
+            # Stay sparse until the end and densify straight to float32: every
+            # consumer (FAISS, vector stores, memory blobs) needs dense float32
+            # rows, and float64 would double the size of the mostly-zero matrix.
             X = self._vectorizer.transform(texts)
-            X = normalize(X, norm="l2")
+            X = normalize(X, norm="l2").astype(np.float32, copy=False)
             return X.toarray() if hasattr(X, "toarray") else np.asarray(X)
         else:  # pragma: no cover
             raise RuntimeError("Embedding backend is not properly initialized")
 
+    def encode_one(self, text: str):
+        """Return the 1D embedding of a single text.
+
+        SentenceTransformer.encode accepts a bare string and returns a 1D
+        vector directly (it already runs in eval mode without gradients).
+        """
+        if self._backend == "sentence_transformers" and self._model is not None:
+            return self._model.encode(text, show_progress_bar=False, normalize_embeddings=True)
+        return self.encode_texts([text])[0]
+
     def encode_query(self, query: str):
-        return self.encode_texts([query])[0]
+        return self.encode_one(query)
 
 
 # Helper functions to keep backward compatibility with older modules
+_model_lock = threading.Lock()
+_model_instance: Optional[EmbeddingBackend] = None
+
+
 def get_model(model_name: str = "all-MiniLM-L6-v2") -> EmbeddingBackend:
     """Return a singleton EmbeddingBackend instance.
 
     The original codebase expected a ``get_model`` function that returned an
     object exposing ``encode`` and ``encode_query``.  The new
     :class:`EmbeddingBackend` already provides those methods, so this helper
-    simply creates and caches a single instance.
+    simply creates and caches a single instance.  Creation is guarded by a
+    lock so concurrent first calls (server threads) load the model once.
     """
-    if not hasattr(get_model, "_instance"):
-        get_model._instance = EmbeddingBackend(model_name=model_name)
-    return get_model._instance
+    global _model_instance
+    if _model_instance is None:
+        with _model_lock:
+            if _model_instance is None:
+                _model_instance = EmbeddingBackend(model_name=model_name)
+    return _model_instance
 
 
 def embed_texts(texts: List[str], model_name: str = "all-MiniLM-L6-v2"):
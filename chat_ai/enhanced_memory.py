@@ -4,13 +4,122 @@ Sistema de memoria mejorado con persistencia, búsqueda semántica y compresión
 from __future__ import annotations
 import sqlite3
 import json
-import pickle
+import re
+import struct
+import threading
+from contextlib import contextmanager
+from itertools import groupby
+from operator import itemgetter
 from typing import List, Dict, Optional, Any
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+import atexit
 import logging
+import os
+import weakref
+
+import numpy as np
+
+try:
+    import faiss  # type: ignore
+except ImportError:
+    faiss = None
 
 logger = logging.getLogger(__name__)
 
+# Índice ANN (cadena de faiss.index_factory) sobre toda la memoria del usuario;
+# vacío para usar solo el escaneo de los mensajes recientes
+MEMORY_ANN_INDEX = os.getenv("MEMORY_ANN_INDEX", "HNSW32")
+# Candidatos pedidos al índice por cada resultado (el filtro de importancia descarta algunos)
+MEMORY_ANN_OVERFETCH = 4
+
+# Configuración aplicada una sola vez a la conexión persistente
+_SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL;"
+    "PRAGMA synchronous=NORMAL;"
+    "PRAGMA temp_store=MEMORY;"
+)
+
+# Texto máximo por día que se envía al LLM al comprimir memoria antigua
+COMPRESSION_INPUT_CHARS = 20_000
+_SUMMARY_SEPARATOR = '\n---\n'
+
+# Palabras clave que elevan la importancia de un mensaje (una sola pasada)
+_KW_RE = re.compile(
+    r'importante|recordar|siempre|nunca|preferencia|'
+    r'me gusta|no me gusta|quiero|necesito'
+)
+
+
+# Formatos de blob versionados; los float32 crudos sin prefijo son anteriores
+_BLOB_FLOAT32 = b'\x01'  # float32 normalizado
+_BLOB_INT8 = 2           # int8 normalizado con escala por vector
+# Cabecera int8: versión, escala float32 y dimensión
+_INT8_HEADER = struct.Struct('<BfI')
+
+
+def _normalized(vec: np.ndarray) -> np.ndarray:
+    """Vector con norma L2 = 1 (los vectores nulos se dejan igual)"""
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm else vec
+
+
+def _quantize(vec: np.ndarray) -> bytes:
+    """Cuantizar un vector normalizado a int8 (escala = max|v| / 127)"""
+    scale = float(np.max(np.abs(vec))) / 127.0 if vec.size else 0.0
+    if scale:
+        values = np.round(vec / scale).astype(np.int8)
+    else:
+        values = np.zeros(vec.shape, dtype=np.int8)
+    return _INT8_HEADER.pack(_BLOB_INT8, scale, vec.shape[0]) + values.tobytes()
+
+
+def _embedding_to_blob(embedding) -> bytes:
+    """Serializar un embedding normalizado y cuantizado a int8"""
+    vec = np.asarray(embedding, dtype=np.float32).ravel()
+    return _quantize(_normalized(vec))
+
+
+def _is_current_blob(blob: bytes) -> bool:
+    """Blob en el formato actual (int8 con cabecera coherente con su longitud)"""
+    return (len(blob) >= _INT8_HEADER.size and blob[0] == _BLOB_INT8
+            and len(blob) == _INT8_HEADER.size + _INT8_HEADER.unpack_from(blob)[2])
+
+
+def _is_legacy_blob(blob: bytes) -> bool:
+    """Detectar embeddings antiguos guardados con pickle (protocolo 2+)"""
+    return len(blob) > 2 and blob[0] == 0x80 and 2 <= blob[1] <= 5 and blob[-1:] == b'.'
+
+
+def _blob_to_embedding(blob: bytes) -> np.ndarray:
+    """
+    Deserializar un embedding normalizado como float32
+    
+    Los blobs anteriores (float32 con o sin prefijo, o pickle) se
+    convierten y normalizan al leerlos.
+    """
+    if _is_current_blob(blob):
+        scale = _INT8_HEADER.unpack_from(blob)[1]
+        values = np.frombuffer(blob, dtype=np.int8, offset=_INT8_HEADER.size)
+        return values.astype(np.float32) * np.float32(scale)
+    if len(blob) % 4 == 1 and blob[:1] == _BLOB_FLOAT32:
+        return np.frombuffer(blob, dtype=np.float32, offset=1)
+    if _is_legacy_blob(blob):
+        import pickle
+        vec = np.asarray(pickle.loads(blob), dtype=np.float32).ravel()
+    else:
+        vec = np.frombuffer(blob, dtype=np.float32)
+    return _normalized(vec)
+
+
+def _flush_at_exit(memory_ref):
+    """Guardar al salir los mensajes en buffer de una memoria aún viva"""
+    memory = memory_ref()
+    if memory is not None:
+        try:
+            memory._flush()
+        except Exception as e:
+            logger.warning(f"Error guardando memoria pendiente al salir: {e}")
+
 
 class EnhancedMemory:
     """
@@ -23,7 +132,7 @@ class EnhancedMemory:
     """
     
     def __init__(self, db_path: str, embedder, user_id: str = "anonymous", 
-                 max_short_term: int = 20, llm_client=None):
+                 max_short_term: int = 20, llm_client=None, flush_threshold: int = 1):
         """
         Args:
             db_path: Ruta a la base de datos SQLite
@@ -31,26 +140,66 @@ class EnhancedMemory:
             user_id: ID del usuario
             max_short_term: Número máximo de mensajes en memoria corto plazo
             llm_client: Cliente LLM para resúmenes (opcional)
+            flush_threshold: Mensajes de add() acumulados antes de guardarlos
+                (1 = escritura inmediata; con más, llamar a close() al terminar)
         """
         self.db_path = db_path
         self.embedder = embedder
         self.user_id = user_id
         self.max_short_term = max_short_term
         self.llm_client = llm_client
+        self.flush_threshold = max(1, flush_threshold)
         
         # Memoria de corto plazo (en RAM)
         self.short_term: List[Dict[str, Any]] = []
         
+        # Conexión persistente compartida entre hilos (serializada con el lock)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.executescript(_SQLITE_PRAGMAS)
+        self._lock = threading.RLock()
+        
+        # Mensajes de add() pendientes de embedding e inserción
+        self._pending: List[tuple] = []
+        atexit.register(_flush_at_exit, weakref.ref(self))
+        
+        # Índice ANN en memoria, construido bajo demanda desde SQLite
+        self._ann_index = None
+        self._ann_last_id = 0
+        
         # Inicializar base de datos
         self._init_db()
         
         # Cargar memoria reciente
         self._load_recent_memory()
     
+    @contextmanager
+    def _connection(self):
+        """Acceso exclusivo a la conexión; revierte la transacción si hay error"""
+        with self._lock:
+            try:
+                yield self._conn
+            except Exception:
+                self._conn.rollback()
+                raise
+    
+    def __del__(self):
+        # Última oportunidad de guardar mensajes en buffer si no se llamó a close()
+        try:
+            self._flush()
+        except Exception:
+            pass
+    
+    def close(self):
+        """Guardar los mensajes pendientes y cerrar la conexión persistente"""
+        with self._lock:
+            self._flush()
+            # Actualiza las estadísticas del planificador solo si hacen falta
+            self._conn.execute("PRAGMA optimize")
+            self._conn.close()
+    
     def _init_db(self):
         """Inicializar tabla de memoria si no existe"""
-        conn = sqlite3.connect(self.db_path)
-        try:
+        with self._connection() as conn:
             cur = conn.cursor()
             cur.execute("""
                 CREATE TABLE IF NOT EXISTS long_term_memory (
@@ -80,15 +229,19 @@ class EnhancedMemory:
                 CREATE INDEX IF NOT EXISTS idx_memory_importance 
                 ON long_term_memory(importance_score DESC)
             """)
+            # Escaneo de get_relevant: recorre por fecha filtrando importancia
+            # en el propio índice, sin ordenar ni visitar filas sin embedding
+            cur.execute("""
+                CREATE INDEX IF NOT EXISTS idx_memory_relevant 
+                ON long_term_memory(user_id, timestamp DESC, importance_score)
+                WHERE embedding IS NOT NULL
+            """)
             
             conn.commit()
-        finally:
-            conn.close()
     
     def _load_recent_memory(self):
         """Cargar mensajes recientes en memoria de corto plazo"""
-        conn = sqlite3.connect(self.db_path)
-        try:
+        with self._connection() as conn:
             cur = conn.cursor()
             cur.execute("""
                 SELECT role, content, metadata, timestamp, importance_score
@@ -112,14 +265,17 @@ class EnhancedMemory:
                     'timestamp': timestamp,
                     'importance': importance
                 })
-        finally:
-            conn.close()
     
     def add(self, role: str, content: str, metadata: Optional[Dict] = None, 
             conversation_id: Optional[int] = None, importance: float = 0.5):
         """
         Agregar mensaje a memoria corto y largo plazo
         
+        Con flush_threshold > 1 el mensaje queda en un buffer y se guarda
+        junto con los siguientes (un solo encode_texts y una transacción) al
+        llegar al umbral, antes de cualquier lectura de la base de datos, al
+        cerrar o al salir del proceso.
+        
         Args:
             role: 'user' o 'assistant'
             content: Contenido del mensaje
@@ -127,50 +283,96 @@ class EnhancedMemory:
             conversation_id: ID de conversación (opcional)
             importance: Puntuación de importancia 0-1 (opcional)
         """
-        if not content or not content.strip():
-            return
+        self._queue([{'role': role, 'content': content, 'metadata': metadata,
+                      'conversation_id': conversation_id, 'importance': importance}])
+        if len(self._pending) >= self.flush_threshold:
+            self._flush()
+    
+    def add_many(self, entries: List[Dict[str, Any]]):
+        """
+        Agregar varios mensajes en una sola transacción
         
-        # Calcular importancia automáticamente si no se proporciona
-        if importance == 0.5:
-            importance = self._calculate_importance(role, content, metadata)
+        Args:
+            entries: Diccionarios con las claves de add(): role, content y
+                opcionalmente metadata, conversation_id, importance
+        """
+        self._queue(entries)
+        self._flush()
+    
+    def _queue(self, entries: List[Dict[str, Any]]):
+        """Encolar mensajes para guardar y agregarlos a memoria de corto plazo"""
+        entries = [e for e in entries if e.get('content') and e['content'].strip()]
+        if not entries:
+            return
         
-        # Generar embedding para búsqueda semántica
-        try:
-            embedding = self.embedder.encode_query(content)
-            embedding_blob = pickle.dumps(embedding)
-        except Exception as e:
-            logger.warning(f"Error generando embedding: {e}")
-            embedding_blob = None
+        # Misma forma que CURRENT_TIMESTAMP: conserva la hora real aunque se guarde después
+        created_at = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        recent = []
+        with self._lock:
+            for entry in entries:
+                metadata = entry.get('metadata')
+                importance = entry.get('importance', 0.5)
+                # Calcular importancia automáticamente si no se proporciona
+                if importance == 0.5:
+                    importance = self._calculate_importance(entry['role'], entry['content'], metadata)
+                
+                self._pending.append((entry.get('conversation_id'), entry['role'], entry['content'],
+                                      json.dumps(metadata) if metadata else None, importance, created_at))
+                
+                recent.append({
+                    'role': entry['role'],
+                    'content': entry['content'],
+                    'metadata': metadata or {},
+                    'timestamp': datetime.now().isoformat(),
+                    'importance': importance
+                })
+            
+            # Agregar a memoria de corto plazo y mantener su límite
+            self.short_term.extend(recent)
+            if len(self.short_term) > self.max_short_term:
+                del self.short_term[:len(self.short_term) - self.max_short_term]
+    
+    def _encode_contents(self, contents: List[str]) -> List[Optional[bytes]]:
+        """Embeddings de varios textos con una sola llamada al modelo"""
+        encode_texts = getattr(self.embedder, 'encode_texts', None)
+        if encode_texts is not None:
+            try:
+                return [_embedding_to_blob(vec) for vec in encode_texts(contents)]
+            except Exception as e:
+                logger.warning(f"Error generando embeddings en lote: {e}")
         
-        # Guardar en base de datos
-        conn = sqlite3.connect(self.db_path)
-        try:
-            cur = conn.cursor()
-            metadata_json = json.dumps(metadata) if metadata else None
+        # Embedders sin encode_texts (o lote fallido): uno por uno
+        blobs = []
+        for content in contents:
+            try:
+                blobs.append(_embedding_to_blob(self.embedder.encode_query(content)))
+            except Exception as e:
+                logger.warning(f"Error generando embedding: {e}")
+                blobs.append(None)
+        return blobs
+    
+    def _flush(self):
+        """Guardar los mensajes pendientes en una sola transacción"""
+        with self._lock:
+            pending, self._pending = self._pending, []
+            if not pending:
+                return
             
-            cur.execute("""
-                INSERT INTO long_term_memory 
-                (user_id, conversation_id, role, content, embedding, metadata, importance_score)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, (self.user_id, conversation_id, role, content, 
-                  embedding_blob, metadata_json, importance))
+            blobs = self._encode_contents([row[2] for row in pending])
+            rows = [
+                (self.user_id, conversation_id, role, content, blob, metadata_json, importance, created_at)
+                for (conversation_id, role, content, metadata_json, importance, created_at), blob
+                in zip(pending, blobs)
+            ]
             
-            conn.commit()
-        finally:
-            conn.close()
-        
-        # Agregar a memoria de corto plazo
-        self.short_term.append({
-            'role': role,
-            'content': content,
-            'metadata': metadata or {},
-            'timestamp': datetime.now().isoformat(),
-            'importance': importance
-        })
-        
-        # Mantener límite de memoria corto plazo
-        if len(self.short_term) > self.max_short_term:
-            self.short_term.pop(0)
+            with self._connection() as conn:
+                with conn:
+                    conn.executemany("""
+                        INSERT INTO long_term_memory 
+                        (user_id, conversation_id, role, content, embedding, metadata,
+                         importance_score, timestamp)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    """, rows)
         
         # Comprimir memoria antigua si es necesario
         self._compress_old_memory_if_needed()
@@ -197,15 +399,8 @@ class EnhancedMemory:
             importance += 0.1
         
         # Palabras clave importantes
-        important_keywords = [
-            'importante', 'recordar', 'siempre', 'nunca', 'preferencia',
-            'me gusta', 'no me gusta', 'quiero', 'necesito'
-        ]
-        content_lower = content.lower()
-        for keyword in important_keywords:
-            if keyword in content_lower:
-                importance += 0.15
-                break
+        if _KW_RE.search(content.lower()):
+            importance += 0.15
         
         # Metadata especial
         if metadata:
@@ -248,80 +443,144 @@ class EnhancedMemory:
             logger.warning(f"Error generando embedding de consulta: {e}")
             return []
         
+        query_vec = _normalized(np.asarray(query_embedding, dtype=np.float32).ravel())
+        
         # Buscar en base de datos
-        conn = sqlite3.connect(self.db_path)
-        try:
-            cur = conn.cursor()
-            cur.execute("""
-                SELECT id, role, content, metadata, timestamp, importance_score, embedding
-                FROM long_term_memory
-                WHERE user_id = ? AND importance_score >= ? AND embedding IS NOT NULL
-                ORDER BY timestamp DESC
-                LIMIT 100
-            """, (self.user_id, min_importance))
+        self._flush()
+        with self._connection() as conn:
+            # Candidatos del índice ANN; sin él, los 100 mensajes más recientes
+            rows = self._ann_candidates(conn, query_vec, limit, min_importance)
+            if rows is None:
+                cur = conn.cursor()
+                cur.execute("""
+                    SELECT id, role, content, metadata, timestamp, importance_score, embedding
+                    FROM long_term_memory
+                    WHERE user_id = ? AND importance_score >= ? AND embedding IS NOT NULL
+                    ORDER BY timestamp DESC
+                    LIMIT 100
+                """, (self.user_id, min_importance))
+                rows = cur.fetchall()
             
-            rows = cur.fetchall()
+            # Decodificar embeddings; se descartan los de dimensión distinta
+            candidates = []
+            vectors = []
+            migrated = []
+            for row in rows:
+                msg_id, embedding_blob = row[0], row[6]
+                try:
+                    msg_embedding = _blob_to_embedding(embedding_blob)
+                except Exception as e:
+                    logger.warning(f"Error procesando mensaje {msg_id}: {e}")
+                    continue
+                if not _is_current_blob(embedding_blob):
+                    # Ya normalizado al leerlo; se puntúa con el valor cuantizado que se guarda
+                    embedding_blob = _quantize(msg_embedding)
+                    msg_embedding = _blob_to_embedding(embedding_blob)
+                    migrated.append((embedding_blob, msg_id))
+                if msg_embedding.shape != query_vec.shape:
+                    logger.warning(f"Dimensión de embedding inválida en mensaje {msg_id}")
+                    continue
+                candidates.append(row)
+                vectors.append(msg_embedding)
             
-            # Calcular similitud con cada mensaje
+            # Vectores unitarios: la similitud coseno es una sola multiplicación
             results = []
-            for row in rows:
-                msg_id, role, content, metadata_json, timestamp, importance, embedding_blob = row
+            if candidates:
+                sims = np.stack(vectors) @ query_vec
                 
-                try:
-                    msg_embedding = pickle.loads(embedding_blob)
-                    similarity = self._cosine_similarity(query_embedding, msg_embedding)
-                    
-                    # Combinar similitud con importancia
-                    score = (similarity * 0.7) + (importance * 0.3)
-                    
-                    metadata = json.loads(metadata_json) if metadata_json else {}
-                    
+                # Combinar similitud con importancia
+                importances = np.array([row[5] for row in candidates], dtype=np.float32)
+                scores = sims * 0.7 + importances * 0.3
+                
+                # Seleccionar top-k sin ordenar todos los candidatos
+                k = min(max(limit, 0), len(scores))
+                top = np.argpartition(-scores, k)[:k] if k < len(scores) else np.arange(k)
+                top = top[np.argsort(-scores[top], kind='stable')]
+                
+                for i in top.tolist():
+                    msg_id, role, content, metadata_json, timestamp, importance, _ = candidates[i]
                     results.append({
                         'id': msg_id,
                         'role': role,
                         'content': content,
-                        'metadata': metadata,
+                        'metadata': json.loads(metadata_json) if metadata_json else {},
                         'timestamp': timestamp,
                         'importance': importance,
-                        'relevance_score': score
+                        'relevance_score': float(scores[i])
                     })
-                except Exception as e:
-                    logger.warning(f"Error procesando mensaje {msg_id}: {e}")
-                    continue
             
-            # Ordenar por score y retornar top-k
-            results.sort(key=lambda x: x['relevance_score'], reverse=True)
-            return results[:limit]
+            # Reescribir en el formato actual los embeddings antiguos
+            if migrated:
+                with conn:
+                    conn.executemany(
+                        "UPDATE long_term_memory SET embedding = ? WHERE id = ?", migrated
+                    )
             
-        finally:
-            conn.close()
+            return results
+            
+    
+    def _sync_ann_index(self, conn: sqlite3.Connection):
+        """Agregar al índice ANN los mensajes insertados desde la última sincronización"""
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT id, embedding FROM long_term_memory
+            WHERE user_id = ? AND id > ? AND embedding IS NOT NULL
+            ORDER BY id
+        """, (self.user_id, self._ann_last_id))
+        
+        ids = []
+        vectors = []
+        for msg_id, embedding_blob in cur:
+            self._ann_last_id = msg_id
+            try:
+                vector = _blob_to_embedding(embedding_blob)
+            except Exception:
+                continue
+            if self._ann_index is None:
+                self._ann_index = faiss.index_factory(
+                    vector.shape[0], f"IDMap,{MEMORY_ANN_INDEX}", faiss.METRIC_INNER_PRODUCT
+                )
+            if vector.shape[0] != self._ann_index.d:
+                continue
+            ids.append(msg_id)
+            vectors.append(vector)
+        
+        if vectors:
+            # Vectores normalizados: producto interno = similitud coseno
+            self._ann_index.add_with_ids(np.stack(vectors), np.array(ids, dtype=np.int64))
     
-    def _cosine_similarity(self, vec1, vec2) -> float:
-        """Calcular similitud coseno entre dos vectores"""
+    def _ann_candidates(self, conn: sqlite3.Connection, query_vec: np.ndarray,
+                        limit: int, min_importance: float) -> Optional[List[tuple]]:
+        """
+        Filas candidatas vía índice ANN sobre toda la memoria del usuario
+        
+        Returns:
+            Filas como las del escaneo lineal, o None si el índice no está disponible
+        """
+        if faiss is None or not MEMORY_ANN_INDEX or limit <= 0:
+            return None
         try:
-            import numpy as np
-            v1 = np.array(vec1, dtype=np.float32)
-            v2 = np.array(vec2, dtype=np.float32)
-            
-            dot_product = np.dot(v1, v2)
-            norm1 = np.linalg.norm(v1)
-            norm2 = np.linalg.norm(v2)
-            
-            if norm1 == 0 or norm2 == 0:
-                return 0.0
-            
-            return float(dot_product / (norm1 * norm2))
-        except Exception:
-            # Fallback sin numpy
-            dot = sum(a * b for a, b in zip(vec1, vec2))
-            import math
-            norm1 = math.sqrt(sum(a * a for a in vec1))
-            norm2 = math.sqrt(sum(b * b for b in vec2))
-            
-            if norm1 == 0 or norm2 == 0:
-                return 0.0
-            
-            return dot / (norm1 * norm2)
+            self._sync_ann_index(conn)
+        except Exception as e:
+            logger.warning(f"Índice ANN de memoria no disponible: {e}")
+            return None
+        index = self._ann_index
+        if index is None or index.ntotal == 0 or index.d != query_vec.shape[0]:
+            return None
+        
+        _, labels = index.search(query_vec.reshape(1, -1), min(limit * MEMORY_ANN_OVERFETCH, index.ntotal))
+        ids = [int(label) for label in labels[0] if label >= 0]
+        if not ids:
+            return []
+        
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT id, role, content, metadata, timestamp, importance_score, embedding
+            FROM long_term_memory
+            WHERE user_id = ? AND importance_score >= ? AND embedding IS NOT NULL
+              AND id IN ({','.join('?' * len(ids))})
+        """, (self.user_id, min_importance, *ids))
+        return cur.fetchall()
     
     def _compress_old_memory_if_needed(self):
         """
@@ -331,8 +590,7 @@ class EnhancedMemory:
         - Resumir conversaciones antiguas (>7 días)
         - Mantener solo mensajes importantes
         """
-        conn = sqlite3.connect(self.db_path)
-        try:
+        with self._connection() as conn:
             cur = conn.cursor()
             
             # Contar mensajes no resumidos antiguos
@@ -348,8 +606,6 @@ class EnhancedMemory:
             if old_count > 100:
                 logger.info(f"Comprimiendo {old_count} mensajes antiguos...")
                 self._compress_old_conversations(seven_days_ago, conn)
-        finally:
-            conn.close()
     
     def _compress_old_conversations(self, cutoff_date: str, conn: sqlite3.Connection):
         """Comprimir conversaciones antiguas usando resúmenes"""
@@ -359,48 +615,57 @@ class EnhancedMemory:
         
         cur = conn.cursor()
         
-        # Obtener mensajes antiguos agrupados por día
+        # Leer mensajes antiguos en orden cronológico; se agrupan por día al vuelo
         cur.execute("""
-            SELECT DATE(timestamp) as day, GROUP_CONCAT(content, '\n---\n') as combined
+            SELECT DATE(timestamp) as day, content
             FROM long_term_memory
             WHERE user_id = ? AND timestamp < ? AND is_summarized = 0
-            GROUP BY DATE(timestamp)
-            ORDER BY day
+            ORDER BY day, timestamp
         """, (self.user_id, cutoff_date))
         
-        rows = cur.fetchall()
-        
-        for day, combined_content in rows:
+        # Generar resumen de cada día
+        days = []
+        summaries = []
+        for day, day_rows in groupby(cur, key=itemgetter(0)):
+            # Acotar el texto enviado al LLM: el resto del día no se lee
+            parts = []
+            size = 0
+            for _, content in day_rows:
+                if size >= COMPRESSION_INPUT_CHARS:
+                    break
+                parts.append(content)
+                size += len(content) + len(_SUMMARY_SEPARATOR)
+            combined_content = _SUMMARY_SEPARATOR.join(parts)[:COMPRESSION_INPUT_CHARS]
             if not combined_content:
                 continue
             
             try:
-                # Generar resumen del día
-                summary = self.llm_client.summarize(combined_content, max_chars=500)
-                
-                # Guardar resumen
-                summary_embedding = pickle.dumps(self.embedder.encode_query(summary))
-                
-                cur.execute("""
-                    INSERT INTO long_term_memory 
-                    (user_id, role, content, embedding, importance_score, is_summarized, timestamp)
-                    VALUES (?, 'system', ?, ?, 0.7, 1, ?)
-                """, (self.user_id, f"Resumen del {day}: {summary}", 
-                      summary_embedding, f"{day} 23:59:59"))
-                
-                # Marcar mensajes originales como resumidos
-                cur.execute("""
-                    UPDATE long_term_memory
-                    SET is_summarized = 1
-                    WHERE user_id = ? AND DATE(timestamp) = ? AND is_summarized = 0
-                """, (self.user_id, day))
-                
-                conn.commit()
-                logger.info(f"Resumido día {day}")
-                
+                summaries.append(self.llm_client.summarize(combined_content, max_chars=500))
+                days.append(day)
             except Exception as e:
                 logger.error(f"Error resumiendo día {day}: {e}")
                 continue
+        
+        if not days:
+            return
+        
+        # Guardar resúmenes y marcar originales en una sola transacción
+        blobs = self._encode_contents(summaries)
+        with conn:
+            conn.executemany("""
+                INSERT INTO long_term_memory 
+                (user_id, role, content, embedding, importance_score, is_summarized, timestamp)
+                VALUES (?, 'system', ?, ?, 0.7, 1, ?)
+            """, [(self.user_id, f"Resumen del {day}: {summary}", blob, f"{day} 23:59:59")
+                  for day, summary, blob in zip(days, summaries, blobs)])
+            
+            conn.executemany("""
+                UPDATE long_term_memory
+                SET is_summarized = 1
+                WHERE user_id = ? AND DATE(timestamp) = ? AND is_summarized = 0
+            """, [(self.user_id, day) for day in days])
+        
+        logger.info(f"Resumidos {len(days)} días: {days[0]} a {days[-1]}")
     
     def get_summary(self, days: int = 7) -> str:
         """
@@ -414,8 +679,8 @@ class EnhancedMemory:
         """
         cutoff = (datetime.now() - timedelta(days=days)).isoformat()
         
-        conn = sqlite3.connect(self.db_path)
-        try:
+        self._flush()
+        with self._connection() as conn:
             cur = conn.cursor()
             cur.execute("""
                 SELECT content FROM long_term_memory
@@ -429,24 +694,22 @@ class EnhancedMemory:
                 return "\n\n".join(summaries)
             else:
                 return "No hay resúmenes disponibles para este período."
-        finally:
-            conn.close()
     
     def clear(self):
         """Limpiar toda la memoria del usuario"""
-        conn = sqlite3.connect(self.db_path)
-        try:
+        with self._connection() as conn:
+            self._pending = []
             cur = conn.cursor()
             cur.execute("DELETE FROM long_term_memory WHERE user_id = ?", (self.user_id,))
             conn.commit()
             self.short_term = []
-        finally:
-            conn.close()
+            self._ann_index = None
+            self._ann_last_id = 0
     
     def get_stats(self) -> Dict[str, Any]:
         """Obtener estadísticas de memoria"""
-        conn = sqlite3.connect(self.db_path)
-        try:
+        self._flush()
+        with self._connection() as conn:
             cur = conn.cursor()
             
             # Total de mensajes
@@ -476,5 +739,3 @@ class EnhancedMemory:
                 'oldest_message': oldest,
                 'short_term_size': len(self.short_term)
             }
-        finally:
-            conn.close()
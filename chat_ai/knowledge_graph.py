@@ -8,6 +8,8 @@ from typing import List, Dict, Optional, Set, Tuple, Any
 import json
 import sqlite3
 import logging
+import threading
+from contextlib import contextmanager
 from collections import defaultdict
 from dataclasses import dataclass, asdict
 
@@ -50,6 +52,10 @@ class KnowledgeGraph:
         self.db_path = db_path
         self.nodes: Dict[str, KnowledgeNode] = {}
         self.edges: List[KnowledgeEdge] = []
+        # Serializa escrituras: la extracción de relaciones corre en varios hilos
+        self._lock = threading.RLock()
+        # Conexión compartida mientras hay un batch() abierto
+        self._batch_conn: Optional[sqlite3.Connection] = None
         self._init_db()
         self._load_from_db()
     
@@ -126,14 +132,50 @@ class KnowledgeGraph:
         conn.close()
         logger.info(f"Loaded {len(self.nodes)} nodes and {len(self.edges)} edges from database")
     
+    @contextmanager
+    def batch(self):
+        """Agrupar escrituras en una sola conexión y un único commit.
+        
+        Las escrituras siguen serializadas por el lock, así que varios hilos
+        pueden escribir dentro del mismo batch.
+        """
+        with self._lock:
+            if self._batch_conn is not None:
+                nested = True
+            else:
+                nested = False
+                self._batch_conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        if nested:
+            yield self
+            return
+        try:
+            yield self
+        finally:
+            with self._lock:
+                conn, self._batch_conn = self._batch_conn, None
+                try:
+                    # Confirmar lo escrito aunque falle el bloque: los dicts en memoria ya cambiaron
+                    conn.commit()
+                finally:
+                    conn.close()
+    
+    def _write_conn(self) -> sqlite3.Connection:
+        return self._batch_conn or sqlite3.connect(self.db_path)
+    
+    def _release(self, conn: sqlite3.Connection) -> None:
+        if conn is not self._batch_conn:
+            conn.commit()
+            conn.close()
+    
     def add_node(self, node: KnowledgeNode) -> None:
         """Agregar o actualizar un nodo"""
-        self.nodes[node.id] = node
-        self._save_node_to_db(node)
+        with self._lock:
+            self.nodes[node.id] = node
+            self._save_node_to_db(node)
     
     def _save_node_to_db(self, node: KnowledgeNode):
         """Guardar nodo en base de datos"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._write_conn()
         cur = conn.cursor()
         cur.execute("""
             INSERT OR REPLACE INTO nodes (id, type, label, description, metadata)
@@ -145,39 +187,39 @@ class KnowledgeGraph:
             node.description,
             json.dumps(node.metadata, ensure_ascii=False)
         ))
-        conn.commit()
-        conn.close()
+        self._release(conn)
     
     def add_edge(self, edge: KnowledgeEdge) -> None:
         """Agregar una arista (relación)"""
-        # Verificar que ambos nodos existan
-        if edge.source not in self.nodes:
-            logger.warning(f"Source node {edge.source} not found, skipping edge")
-            return
-        if edge.target not in self.nodes:
-            logger.warning(f"Target node {edge.target} not found, skipping edge")
-            return
+        with self._lock:
+            # Verificar que ambos nodos existan
+            if edge.source not in self.nodes:
+                logger.warning(f"Source node {edge.source} not found, skipping edge")
+                return
+            if edge.target not in self.nodes:
+                logger.warning(f"Target node {edge.target} not found, skipping edge")
+                return
         
-        # Evitar duplicados (misma relación)
-        existing = next(
-            (e for e in self.edges 
-             if e.source == edge.source and e.target == edge.target and e.relation_type == edge.relation_type),
-            None
-        )
-        if existing:
-            # Actualizar peso y evidencia si la nueva relación es más fuerte
-            if edge.weight > existing.weight:
-                existing.weight = edge.weight
-                existing.evidence.extend(edge.evidence)
-                existing.evidence = list(set(existing.evidence))  # Eliminar duplicados
-                self._update_edge_in_db(existing)
-        else:
-            self.edges.append(edge)
-            self._save_edge_to_db(edge)
+            # Evitar duplicados (misma relación)
+            existing = next(
+                (e for e in self.edges 
+                 if e.source == edge.source and e.target == edge.target and e.relation_type == edge.relation_type),
+                None
+            )
+            if existing:
+                # Actualizar peso y evidencia si la nueva relación es más fuerte
+                if edge.weight > existing.weight:
+                    existing.weight = edge.weight
+                    existing.evidence.extend(edge.evidence)
+                    existing.evidence = list(set(existing.evidence))  # Eliminar duplicados
+                    self._update_edge_in_db(existing)
+            else:
+                self.edges.append(edge)
+                self._save_edge_to_db(edge)
     
     def _save_edge_to_db(self, edge: KnowledgeEdge):
         """Guardar arista en base de datos"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._write_conn()
         cur = conn.cursor()
         cur.execute("""
             INSERT INTO edges (source, target, relation_type, weight, evidence)
@@ -189,12 +231,11 @@ class KnowledgeGraph:
             edge.weight,
             json.dumps(edge.evidence, ensure_ascii=False)
         ))
-        conn.commit()
-        conn.close()
+        self._release(conn)
     
     def _update_edge_in_db(self, edge: KnowledgeEdge):
         """Actualizar arista existente en base de datos"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._write_conn()
         cur = conn.cursor()
         cur.execute("""
             UPDATE edges SET weight=?, evidence=?
@@ -206,8 +247,7 @@ class KnowledgeGraph:
             edge.target,
             edge.relation_type
         ))
-        conn.commit()
-        conn.close()
+        self._release(conn)
     
     def find_nodes(self, query: str, node_type: Optional[str] = None, limit: int = 10) -> List[KnowledgeNode]:
         """Buscar nodos por texto (búsqueda simple en label y description)"""
@@ -232,23 +272,35 @@ class KnowledgeGraph:
             relation_type: Filtrar por tipo de relación (opcional)
             direction: 'out' (salientes), 'in' (entrantes), 'both' (ambas)
         """
-        if node_id not in self.nodes:
-            return []
+        return self.get_related_nodes_batch([node_id], relation_type, direction)[node_id]
+    
+    def get_related_nodes_batch(self, node_ids: List[str], relation_type: Optional[str] = None,
+                                direction: str = "both") -> Dict[str, List[Tuple[KnowledgeNode, KnowledgeEdge]]]:
+        """
+        Igual que get_related_nodes para varios nodos, con un solo recorrido de las aristas.
         
-        results = []
+        Retorna {node_id: [(nodo, arista), ...]}; los IDs inexistentes quedan con lista vacía.
+        """
+        results: Dict[str, List[Tuple[KnowledgeNode, KnowledgeEdge]]] = {nid: [] for nid in node_ids}
+        wanted = {nid for nid in results if nid in self.nodes}
+        if not wanted:
+            return results
+        
+        want_out = direction in ("out", "both")
+        want_in = direction in ("in", "both")
         for edge in self.edges:
             if relation_type and edge.relation_type != relation_type:
                 continue
             
-            if direction in ("out", "both") and edge.source == node_id:
+            if want_out and edge.source in wanted:
                 target_node = self.nodes.get(edge.target)
                 if target_node:
-                    results.append((target_node, edge))
+                    results[edge.source].append((target_node, edge))
             
-            if direction in ("in", "both") and edge.target == node_id:
+            if want_in and edge.target in wanted:
                 source_node = self.nodes.get(edge.source)
                 if source_node:
-                    results.append((source_node, edge))
+                    results[edge.target].append((source_node, edge))
         
         return results
     
@@ -3,16 +3,30 @@ Minimal conversational memory with a rolling window by char budget.
 """
 from __future__ import annotations
 
-from typing import List, Dict
+from typing import Any, Iterable, List, Dict
 
 
 class ChatMemory:
     def __init__(self, max_chars: int = 4000) -> None:
         self._messages: List[Dict[str, str]] = []
         self._max_chars = max_chars
+        # Messages ever added; also serves as a version for caches
+        self._added = 0
 
     def add(self, role: str, content: str) -> None:
         self._messages.append({"role": role, "content": content})
+        self._added += 1
+        self._trim()
+
+    def add_many(self, entries: Iterable[Dict[str, Any]]) -> None:
+        """Add several messages and trim once.
+
+        Each entry needs ``role`` and ``content``; other keys (metadata,
+        importance...) are accepted for compatibility with EnhancedMemory.
+        """
+        for entry in entries:
+            self._messages.append({"role": entry["role"], "content": entry["content"]})
+            self._added += 1
         self._trim()
 
     def _trim(self) -> None:
@@ -26,6 +40,15 @@ class ChatMemory:
                 break
         self._messages = list(reversed(kept))
 
+    @property
+    def version(self) -> int:
+        """Total number of messages added so far; changes on every add.
+
+        The current window holds messages ``version - len(get())`` to
+        ``version - 1``, so callers can process only what is new.
+        """
+        return self._added
+
     def get(self) -> List[Dict[str, str]]:
         return list(self._messages)
 
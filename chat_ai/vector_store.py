@@ -5,20 +5,36 @@ Vector stores:
 """
 from __future__ import annotations
 
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Optional
 import numpy as np  # type: ignore
 import json
+import logging
 import os
 
+logger = logging.getLogger(__name__)
 
-def _cosine_sim_matrix(A: np.ndarray, B: np.ndarray) -> np.ndarray:
-    # Assumes rows are already L2-normalized. If not, normalize here.
-    return A @ B.T
+# Tipo de índice FAISS por defecto (cadena de faiss.index_factory).
+# SQfp16 guarda los vectores en media precisión: la mitad de memoria que Flat.
+DEFAULT_FAISS_INDEX = "SQfp16"
+# A partir de este tamaño un índice exhaustivo se reconstruye como IVF
+IVF_AUTO_THRESHOLD = 50_000
+IVF_AUTO_FACTORY = "IVF256,SQfp16"
+# FAISS recomienda al menos 39 vectores de entrenamiento por centroide
+IVF_MIN_POINTS_PER_CENTROID = 39
+# Listas visitadas por consulta en índices IVF (recall vs. latencia)
+FAISS_NPROBE = int(os.getenv("FAISS_NPROBE", "16"))
 
 
 class InMemoryVectorStore:
+    """Exhaustive cosine search over a float32 C-contiguous matrix.
+
+    Row norms are cached at ``add`` time so a query costs one matrix-vector
+    product plus a partial sort of the top-k scores.
+    """
+
     def __init__(self) -> None:
         self._embeddings: np.ndarray | None = None
+        self._norms: np.ndarray | None = None
         self._metas: List[Dict[str, str]] = []
 
     @property
@@ -28,34 +44,48 @@ class InMemoryVectorStore:
     def add(self, embeddings: np.ndarray, metas: List[Dict[str, str]]) -> None:
         if embeddings.shape[0] != len(metas):
             raise ValueError("Embeddings and metas size mismatch")
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(embeddings, axis=1)
         if self._embeddings is None:
             self._embeddings = embeddings
+            self._norms = norms
         else:
-            self._embeddings = np.vstack([self._embeddings, embeddings])
+            self._embeddings = np.concatenate([self._embeddings, embeddings])
+            self._norms = np.concatenate([self._norms, norms])
         self._metas.extend(metas)
 
     def search(self, query_vec: np.ndarray, top_k: int = 5) -> List[Tuple[Dict[str, str], float]]:
-        if self._embeddings is None or self._embeddings.shape[0] == 0:
+        if self._embeddings is None or self._embeddings.shape[0] == 0 or top_k <= 0:
             return []
-        # Ensure query is 2D
-        q = query_vec.reshape(1, -1)
-        sims = _cosine_sim_matrix(q, self._embeddings)[0]
-        idxs = np.argsort(-sims)[:top_k]
-        results: List[Tuple[Dict[str, str], float]] = []
-        for idx in idxs:
-            results.append((self._metas[int(idx)], float(sims[int(idx)])))
-        return results
+        q = np.ascontiguousarray(query_vec, dtype=np.float32).reshape(-1)
+        sims = self._embeddings @ q
+        sims /= self._norms * np.linalg.norm(q) + 1e-9
+        n = sims.shape[0]
+        if top_k < n:
+            idxs = np.argpartition(-sims, top_k - 1)[:top_k]
+        else:
+            idxs = np.arange(n)
+        idxs = idxs[np.argsort(-sims[idxs], kind="stable")]
+        return [(self._metas[int(idx)], float(sims[int(idx)])) for idx in idxs]
 
 
 class FaissVectorStore:
     """FAISS index with cosine similarity (inner product on normalized vectors).
 
+    Vectors and queries are L2-normalized before reaching FAISS, so scores
+    are dot products of unit vectors. ``index_type`` is any
+    ``faiss.index_factory`` description (``"SQfp16"``, ``"Flat"``,
+    ``"IVF256,Flat"``, ``"HNSW32"``...). An exhaustive index is rebuilt as IVF
+    once it grows past ``IVF_AUTO_THRESHOLD`` vectors.
+
     Persists index and metadata to a directory.
     """
 
-    def __init__(self) -> None:
+    def __init__(self, index_type: Optional[str] = None, nprobe: Optional[int] = None) -> None:
         self._index = None
         self._metas: List[Dict[str, str]] = []
+        self._index_type = index_type or DEFAULT_FAISS_INDEX
+        self._nprobe = nprobe or FAISS_NPROBE
 
     @property
     def size(self) -> int:
@@ -66,32 +96,100 @@ class FaissVectorStore:
         except Exception:
             return 0
 
-    def _ensure_index(self, dim: int):
-        if self._index is None:
-            try:
-                import faiss  # type: ignore
-            except Exception as e:
-                raise RuntimeError("FAISS no está instalado. Instala faiss-cpu.") from e
-            # Inner product because embeddings están L2-normalizados
-            self._index = faiss.IndexFlatIP(dim)
+    @property
+    def index_type(self) -> str:
+        return self._index_type
 
-    def add(self, embeddings: np.ndarray, metas: List[Dict[str, str]]) -> None:
-        if embeddings.shape[0] != len(metas):
-            raise ValueError("Embeddings and metas size mismatch")
-        self._ensure_index(embeddings.shape[1])
+    @staticmethod
+    def _faiss():
         try:
             import faiss  # type: ignore
         except Exception as e:
             raise RuntimeError("FAISS no está instalado. Instala faiss-cpu.") from e
-        self._index.add(embeddings.astype('float32'))
+        return faiss
+
+    def _new_index(self, dim: int, index_type: str):
+        faiss = self._faiss()
+        if index_type == "Flat":
+            # Inner product because embeddings están L2-normalizados
+            return faiss.IndexFlatIP(dim)
+        return faiss.index_factory(dim, index_type, faiss.METRIC_INNER_PRODUCT)
+
+    def _apply_nprobe(self) -> None:
+        faiss = self._faiss()
+        try:
+            faiss.extract_index_ivf(self._index).nprobe = self._nprobe
+        except RuntimeError:
+            pass  # no es un índice IVF
+
+    def _min_training_points(self, index) -> int:
+        try:
+            return IVF_MIN_POINTS_PER_CENTROID * self._faiss().extract_index_ivf(index).nlist
+        except RuntimeError:
+            return 1
+
+    def _ensure_index(self, embeddings: np.ndarray):
+        if self._index is not None:
+            return
+        index = self._new_index(embeddings.shape[1], self._index_type)
+        if not index.is_trained:
+            if embeddings.shape[0] < self._min_training_points(index):
+                logger.warning(
+                    f"Not enough vectors ({embeddings.shape[0]}) to train FAISS '{self._index_type}'; using '{DEFAULT_FAISS_INDEX}'"
+                )
+                self._index_type = DEFAULT_FAISS_INDEX
+                index = self._new_index(embeddings.shape[1], self._index_type)
+            else:
+                index.train(embeddings)
+        self._index = index
+        self._apply_nprobe()
+
+    def _maybe_upgrade(self) -> None:
+        """Rebuild a flat index as IVF once exhaustive search gets too slow."""
+        faiss = self._faiss()
+        if self.size <= IVF_AUTO_THRESHOLD or not isinstance(self._index, (faiss.IndexFlat, faiss.IndexScalarQuantizer)):
+            return
+        candidate = self._new_index(self._index.d, IVF_AUTO_FACTORY)
+        if self.size < self._min_training_points(candidate):
+            return
+        X = self._index.reconstruct_n(0, self.size)
+        candidate.train(X)
+        candidate.add(X)
+        self._index = candidate
+        self._index_type = IVF_AUTO_FACTORY
+        self._apply_nprobe()
+        logger.info(f"FAISS index upgraded to {IVF_AUTO_FACTORY} at {self.size} vectors")
+
+    def train(self, embeddings: np.ndarray) -> None:
+        """Build the index and train it on ``embeddings`` before any add.
+
+        Lets callers train IVF quantizers on a full batch (or a sample of
+        it); a no-op once the index exists.
+        """
+        if self._index is not None:
+            return
+        embeddings = np.array(embeddings, dtype='float32', order='C')
+        self._faiss().normalize_L2(embeddings)
+        self._ensure_index(embeddings)
+
+    def add(self, embeddings: np.ndarray, metas: List[Dict[str, str]]) -> None:
+        if embeddings.shape[0] != len(metas):
+            raise ValueError("Embeddings and metas size mismatch")
+        embeddings = np.array(embeddings, dtype='float32', order='C')
+        self._faiss().normalize_L2(embeddings)
+        self._ensure_index(embeddings)
+        self._index.add(embeddings)
         self._metas.extend(metas)
+        self._maybe_upgrade()
 
     def search(self, query_vec: np.ndarray, top_k: int = 5) -> List[Tuple[Dict[str, str], float]]:
         if self._index is None or self.size == 0:
             return []
         if not isinstance(query_vec, np.ndarray):
             query_vec = np.array(query_vec)
+        # copia: normalize_L2 trabaja in situ y el vector puede venir de una caché
         q = query_vec.astype('float32').reshape(1, -1)
+        self._faiss().normalize_L2(q)
         D, I = self._index.search(q, top_k)
         results: List[Tuple[Dict[str, str], float]] = []
         for idx, score in zip(I[0], D[0]):
@@ -125,5 +223,6 @@ class FaissVectorStore:
             self._index = faiss.read_index(index_path)
         except Exception as e:
             raise RuntimeError("Error al cargar índice FAISS") from e
+        self._apply_nprobe()
 
 